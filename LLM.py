@@ -1,32 +1,129 @@
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-import ollama
-from rich.console import Console
-from config import DEFAULT_MODEL
-from utils import safe_resolve, read_vault_file
-import tiktoken
+from utils import LazyConsole
+from config import (
+    DEFAULT_MODEL, NUM_CTX_BUCKETS, GENERATION_ALLOWANCE, KV_BYTES_PER_TOKEN,
+    CASSETTE_MODE, CASSETTE_PATH, CASSETTE_LATENCY, CASSETTE_STRICT, LLM_REQUEST_TIMEOUT, LLM_CONNECT_TIMEOUT,
+    logs_dir, TOKEN_CACHE_SIZE, OLLAMA_HOSTS, BACKEND_HEALTH_INTERVAL,
+    characters_root, NPC_INDEX_PATH,
+)
+from cassette import Cassette
+from perf import PerfLog
+from utils import safe_resolve, read_vault_file, get_model_token_limit
+from sheets import SheetStore
+from npc_library import NpcLibrary, Roster
+from tokenizer import get_encoding
+
+
+console = LazyConsole()
+
+LIVE_TASKS = ("roleplay", "group", "fanout")   # chat tasks whose tokens are broadcast to viewers
+
+TIMING_FIELDS = (
+    "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration", "done_reason",
+)
+
+
+def parse_chat_response(resp) -> dict:
+    """
+    Normalize an Ollama chat response (object or dict) into
+    {"content": str, <timing metadata fields>}.
+    """
+    content = None
+    if isinstance(resp, dict):
+        msg = resp.get("message")
+        if hasattr(msg, "content"):
+            content = str(msg.content).strip()
+        elif isinstance(msg, dict):
+            content = str(msg.get("content", "")).strip()
+        else:
+            content = str(resp.get("content", ""))
+    elif hasattr(resp, "message") and hasattr(resp.message, "content"):
+        content = str(resp.message.content).strip()
+    else:
+        content = str(resp).strip()
+
+    result = {"content": content}
+    for field in TIMING_FIELDS:
+        value = resp.get(field) if isinstance(resp, dict) else getattr(resp, field, None)
+        if value is not None:
+            result[field] = value
+    return result
+
+
+def chunk_text(chunk) -> str:
+    """Raw (unstripped) text of one streamed chat chunk."""
+    msg = chunk.get("message") if isinstance(chunk, dict) else getattr(chunk, "message", None)
+    if isinstance(msg, dict):
+        return msg.get("content") or ""
+    return getattr(msg, "content", None) or ""
+
+
+class GenerationCancelled(Exception):
+    """Raised when a streamed generation is cancelled; carries the partial output."""
+
+    def __init__(self, partial: str = "", keep: bool = False):
+        super().__init__("Generation cancelled")
+        self.partial = partial
+        self.keep = keep
+
+
+class GenerationTimeout(GenerationCancelled):
+    """Raised when a streamed generation runs past its deadline."""
 
 
-console = Console()
 # ---------- Agent ----------
 class OllamaAgent:
     def __init__(self, vault_root: Path, characters_dir: Path, scenes_active_dir: Path, model=DEFAULT_MODEL):
-        self.client = ollama.Client(host="http://localhost:11434")
+        self._client = None         # created on first request (see client)
         self.model = model
         self.vault_root = vault_root
         self.characters_dir = characters_dir
         self.scenes_active_dir = scenes_active_dir
         self.auto_mode = False
 
-        # --- NEW: scan characters and store paths/names
-        self.character_paths = sorted(characters_dir.glob("*.md"))
-        self.character_names = [p.stem for p in self.character_paths]
+        # Active roster (starts from Characters/Active) and the index of every NPC sheet
+        self.roster = Roster(sorted(characters_dir.glob("*.md")))
+        self.library = NpcLibrary(characters_root, NPC_INDEX_PATH, count_tokens=self.count_tokens_string)
+        self.sheets = SheetStore(vault_root, count_tokens=self.count_tokens_string)
         self.active_character_index = 0
         self._last_append = None
 
         # NEW: Track last LLM output and GM input for retry
         self._last_llm_append = None
 
+        # Streaming + cancellation (used by the async console)
+        self.streaming = False
+        self.cancel_event = threading.Event()
+        self._cancel_keep_partial = False
+        self._active_streams = 0
+        self._streams_lock = threading.Lock()
+        self.scene_lock = threading.RLock()
+
+        # num_ctx currently loaded per model, and known context limits
+        self._loaded_ctx = {}
+        self._model_limits = {}           # model -> context length, asked once per model (ollama show)
+
+        # Token counts by content hash (seeded from the session snapshot)
+        self._token_cache = OrderedDict()
+        self._token_cache_lock = threading.Lock()
+
+        # Timing metadata of every call, per session
+        self.perf = PerfLog(logs_dir)
+
+        # Live viewers of the scene (broadcast.py), set by main() when BROADCAST is on
+        self.broadcaster = None
+
+        # Optional record/replay of all chat traffic
+        self.cassette = (
+            Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_LATENCY, strict=CASSETTE_STRICT) if CASSETTE_MODE else None
+        )
+
         # Startup load printout
         console.print("[Character Loading]", style="bold cyan")
         if self.character_names:
@@ -35,6 +132,32 @@ class OllamaAgent:
         else:
             console.print("[Warning] No characters found in Characters/Active", style="bold yellow")
 
+    @property
+    def character_names(self) -> list[str]:
+        return self.roster.names
+
+    @property
+    def character_paths(self) -> list[Path]:
+        return self.roster.paths
+
+    @property
+    def client(self):
+        """
+        Pool of the OLLAMA_HOSTS backends, with the ollama client interface.
+        Created on first use (ollama/httpx are only imported then).
+        """
+        if self._client is None:
+            from backends import BackendPool
+            self._client = BackendPool(
+                OLLAMA_HOSTS, LLM_REQUEST_TIMEOUT, LLM_CONNECT_TIMEOUT,
+                health_interval=BACKEND_HEALTH_INTERVAL,
+            )
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
     def get_active_scene_path(self):
         md_files = sorted(self.scenes_active_dir.glob("*.md"))
         return md_files[0] if md_files else None
@@ -54,12 +177,15 @@ class OllamaAgent:
 
         payload = ("\n\n" + text.strip() + "\n").encode("utf-8")
 
-        with open(abs_path, "ab+") as f:
+        with self.scene_lock, open(abs_path, "ab+") as f:
             f.seek(0, os.SEEK_END)
             offset = f.tell()
             f.write(payload)
             f.flush()
 
+        if self.broadcaster:
+            self.broadcaster.publish("line", {"text": text.strip()})
+
         # Store BOTH offset and length
         self._last_append = {
             "file": abs_path,
@@ -89,11 +215,13 @@ class OllamaAgent:
         offset = self._last_llm_append["offset"]
 
         try:
-            with open(file, "r+b") as f:
+            with self.scene_lock, open(file, "r+b") as f:
                 f.truncate(offset)
             self.scene_raw = self.read_active_scene()
             self._last_llm_append = None
             self._last_append = None   # optional but safer
+            if self.broadcaster:
+                self.broadcaster.publish("rollback", {})
             return True
         except Exception:
             return False
@@ -104,7 +232,7 @@ class OllamaAgent:
         file = self._last_append["file"]
         offset = self._last_append["offset"]
         try:
-            with open(file, "r+b") as f:
+            with self.scene_lock, open(file, "r+b") as f:
                 f.truncate(offset)
             self.scene_raw = self.read_active_scene()
             self._last_append = None
@@ -112,26 +240,181 @@ class OllamaAgent:
         except:
             return False
 
+    def follow_scene_rewrite(self, path: Path, before: bytes):
+        """
+        After a scene file was rewritten (summaries, roll-ups, renumbering),
+        move the tracked appends to where their text now stands, so a rollback
+        still cuts at the right place. An append whose text did not survive the
+        rewrite as the end of the file is forgotten rather than left pointing
+        into the middle of it.
+        """
+        after = path.read_bytes().rstrip(b"\n")
+        for attr in ("_last_append", "_last_llm_append"):
+            record = getattr(self, attr)
+            if not record or Path(record["file"]).resolve() != path.resolve():
+                continue
+            tail = before[record["offset"]:].rstrip(b"\n")
+            if after.endswith(tail):
+                record["offset"] = len(after) - len(tail)
+            else:
+                setattr(self, attr, None)
+
     def get_character_sheet_by_name(self, name: str) -> str:
-        for path in self.character_paths:
-            if path.stem == name:
-                return read_vault_file(self.vault_root, str(path.relative_to(self.vault_root)))
-        return ""
-
-    def chat(self, messages):
-        resp = self.client.chat(model=self.model, messages=messages)
-        msg = None
-        if isinstance(resp, dict):
-            msg = resp.get("message")
-            if hasattr(msg, "content"):
-                return str(msg.content).strip()
-            if isinstance(resp, dict):
-                return str(resp.get("content", ""))
-        if hasattr(resp, "message") and hasattr(resp.message, "content"):
-            return str(resp.message.content).strip()
-        return str(resp).strip()
+        path = self.roster.get(name)
+        if path is None:
+            matches = self.library.resolve(name)
+            path = self.library.path(matches[0]) if len(matches) == 1 else None
+        return self.sheets.prompt_text(path) if path else ""
+
+    def model_token_limit(self, model: str = None):
+        """Context length of a model (the agent's by default), from `ollama show` on first use."""
+        model = model or self.model
+        if model not in self._model_limits:
+            self._model_limits[model] = get_model_token_limit(model)
+            console.print(f"[bold cyan]Token limit for {model}: {self._model_limits[model]}[/bold cyan]")
+        return self._model_limits[model]
+
+    def pick_num_ctx(self, messages, allowance: int = GENERATION_ALLOWANCE, model: str = None) -> int:
+        """
+        Size the context for one request: counted prompt + reply allowance,
+        rounded up to a bucket and capped at the model limit.
+        The bucket already loaded is kept when it is only one step larger, to avoid a reload.
+        """
+        model = model or self.model
+        prompt_tokens = self.count_tokens(messages, model_to_use=model, include_history=False)
+        needed = prompt_tokens + allowance
+
+        buckets = sorted(NUM_CTX_BUCKETS)
+        limit = self.model_token_limit(model)
+        if limit:
+            buckets = [b for b in buckets if b < limit] + [limit]
+        bucket = next((b for b in buckets if b >= needed), buckets[-1])
+
+        loaded = self._loaded_ctx.get(model)
+        if loaded and loaded in buckets and needed <= loaded:
+            if buckets.index(loaded) - buckets.index(bucket) <= 1:
+                bucket = loaded
+
+        if needed > bucket:
+            console.print(
+                f"[bold red][num_ctx] Prompt needs {needed} tokens but the model allows {bucket} — "
+                f"the start of the scene will be truncated.[/bold red]"
+            )
+
+        reload = loaded is not None and loaded != bucket
+        kv_mib = bucket * KV_BYTES_PER_TOKEN / (1024 * 1024)
+        console.print(
+            f"[dim][num_ctx] {prompt_tokens} prompt + {allowance} reply → {bucket} "
+            f"(KV ≈ {kv_mib:.0f} MiB){' — reload from ' + str(loaded) if reload else ''}[/dim]"
+        )
+        self._loaded_ctx[model] = bucket
+        return bucket
+
+    def chat(self, messages, options: dict = None, task: str = "chat",
+             character: str = None, submode: str = None, monitor=None):
+        """
+        Send messages and return the reply text.
+        task / character / submode only tag the call in the perf log.
+        monitor (a generation.RepetitionDetector) can stop a degenerate reply.
+        """
+        options = dict(options or {})
+        if "num_ctx" not in options:
+            allowance = options.get("num_predict", GENERATION_ALLOWANCE)
+            options["num_ctx"] = self.pick_num_ctx(messages, allowance)
+
+        # Scene replies are streamed token by token to live viewers
+        on_token = None
+        if self.broadcaster and self.streaming and task in LIVE_TASKS:
+            on_token = self.broadcaster.token_sink(character)
+
+        result = self.chat_request(messages, options, on_token=on_token, monitor=monitor)
+        self.perf.record(result, task, self.model, character=character,
+                         submode=submode, num_ctx=options.get("num_ctx"))
+
+        load_duration = result.get("load_duration")
+        if load_duration and load_duration > 5e8:
+            console.print(f"[dim][num_ctx] Model load took {load_duration / 1e9:.1f}s[/dim]")
+        return result["content"]
+
+    def chat_request(self, messages, options: dict, on_token=None, monitor=None) -> dict:
+        """
+        One chat round-trip, returning content + timing metadata.
+        Served from the cassette in replay mode, recorded to it in record mode.
+        on_token receives each streamed chunk (streaming mode only).
+        monitor aborts a streamed reply that loops; a complete reply is trimmed instead.
+        """
+        if self.cassette and self.cassette.mode == "replay":
+            return self.cassette.replay(self.model, messages, options)
+
+        start = time.perf_counter()
+        if self.streaming:
+            result = self._stream_chat(messages, options, deadline=start + LLM_REQUEST_TIMEOUT,
+                                       on_token=on_token, monitor=monitor)
+        else:
+            resp = self.client.chat(model=self.model, messages=messages, options=options)
+            result = parse_chat_response(resp)
+            if monitor and monitor.scan(result["content"]):
+                result["content"] = result["content"][:monitor.cut].strip()
+                result["done_reason"] = "repetition"
+        result["wall_time"] = time.perf_counter() - start
+
+        if self.cassette:
+            self.cassette.record(self.model, messages, options, result)
+        return result
     
 
+    def request_cancel(self, keep_partial: bool = False):
+        """Ask the generation in flight to stop at its next chunk."""
+        self._cancel_keep_partial = keep_partial
+        self.cancel_event.set()
+
+    def _stream_chat(self, messages, options: dict, deadline: float, on_token=None, monitor=None) -> dict:
+        """
+        Streamed chat that can be cancelled between chunks or abandoned past its deadline.
+        Closing the stream drops the connection, which stops generation server-side.
+        Concurrent streams (fan-out) share one cancel flag: it is only reset
+        when no other stream is in flight, so "!" stops all of them.
+        """
+        with self._streams_lock:
+            if self._active_streams == 0:
+                self.cancel_event.clear()
+            self._active_streams += 1
+        stream = self.client.chat(model=self.model, messages=messages, options=options, stream=True)
+        parts = []
+        last = None
+        first_at = looped_at = None
+        try:
+            for chunk in stream:
+                last = chunk
+                parts.append(chunk_text(chunk))
+                if first_at is None:
+                    first_at = time.perf_counter()
+                if on_token and parts[-1]:
+                    on_token(parts[-1])
+                if monitor and parts[-1] and monitor.feed(parts[-1]):
+                    looped_at = time.perf_counter()
+                    break
+                if self.cancel_event.is_set():
+                    raise GenerationCancelled("".join(parts), keep=self._cancel_keep_partial)
+                if time.perf_counter() > deadline:
+                    raise GenerationTimeout("".join(parts))
+        finally:
+            stream.close()
+            with self._streams_lock:
+                self._active_streams -= 1
+                if self._active_streams == 0:
+                    self.cancel_event.clear()
+
+        result = parse_chat_response(last) if last is not None else {}
+        result["content"] = "".join(parts).strip()
+        if looped_at is not None:
+            # No final chunk with timings: one chunk is one token, decode time from the stream
+            result["content"] = "".join(parts)[:monitor.cut].strip()
+            result["done_reason"] = "repetition"
+            result["eval_count"] = len(parts)
+            result["eval_duration"] = int((looped_at - first_at) * 1e9)
+        return result
+
     def count_tokens(
         self,
         messages: list[dict] = None,
@@ -147,10 +430,7 @@ class OllamaAgent:
         if model_to_use is None:
             model_to_use = self.model
 
-        try:
-            encoding = tiktoken.encoding_for_model(model_to_use)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
+        encoding = get_encoding(model_to_use)
 
         # Gather messages
         all_messages = messages.copy() if messages else []
@@ -166,7 +446,7 @@ class OllamaAgent:
         for msg in all_messages:
             role = msg.get("role", "unknown")
             content = msg.get("content", "")
-            msg_tokens = len(encoding.encode(role)) + len(encoding.encode(content)) + 4  # message overhead
+            msg_tokens = len(encoding.encode(role)) + self._cached_token_len(content, model_to_use, encoding) + 4  # message overhead
             total_tokens += msg_tokens
             breakdown[role] = breakdown.get(role, 0) + msg_tokens
 
@@ -180,10 +460,34 @@ class OllamaAgent:
         if model_to_use is None:
             model_to_use = self.model
 
-        try:
-            import tiktoken
-            encoding = tiktoken.encoding_for_model(model_to_use)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
+        encoding = get_encoding(model_to_use)
+        return self._cached_token_len(text, model_to_use, encoding)
+
+    def _cached_token_len(self, text: str, model: str, encoding) -> int:
+        """Token count of text, memoized by content hash (LRU of TOKEN_CACHE_SIZE entries)."""
+        if not text:
+            return 0
+        key = f"{model}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+        with self._token_cache_lock:
+            count = self._token_cache.get(key)
+            if count is not None:
+                self._token_cache.move_to_end(key)
+                return count
+        count = len(encoding.encode(text))
+        with self._token_cache_lock:
+            self._token_cache[key] = count
+            if len(self._token_cache) > TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+        return count
+
+    def token_cache_items(self) -> dict:
+        with self._token_cache_lock:
+            return dict(self._token_cache)
 
-        return len(encoding.encode(text))
\ No newline at end of file
+    def seed_token_cache(self, entries: dict):
+        """Preload token counts (e.g. from a snapshot); entries already known are kept."""
+        with self._token_cache_lock:
+            for key, count in entries.items():
+                self._token_cache.setdefault(key, count)
+            while len(self._token_cache) > TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
\ No newline at end of file
@@ -1,9 +1,11 @@
 from pathlib import Path
-from rich.console import Console
+from utils import LazyConsole
 from config import vault_root, scenes_active_dir
 from utils import read_vault_file
+from cold_storage import hydrate_lines
+from turns import rollup_header_pattern as ROLLUP_HEADER_RE, rollup_matches
 
-console = Console()
+console = LazyConsole()
 
 class PromptManager:
     """
@@ -15,11 +17,13 @@ class PromptManager:
       - group prompt building
     """
 
-    def __init__(self, prompts_dir: Path, scene_text: str = ""):
+    def __init__(self, prompts_dir: Path, scene_text: str = "", count_tokens=None):
         self.prompts_dir = prompts_dir
         self.cache = {}
+        self.count_tokens = count_tokens      # str -> int, enables the history budget of build_scene_text
         self.vault_root = vault_root
         self.scenes_active_dir = scenes_active_dir
+        self._history_memo = None             # (key, units) of the last _history_units call
 
     # ------------------------------------------------------------------
     # Internal cached loader
@@ -129,6 +133,20 @@ class PromptManager:
             {"role": "user", "content": user_instruction},
         ]
 
+    def build_rollup_messages(self, texts: list[str], level: int, first_turn: int, last_turn: int) -> list[dict]:
+        parts = "\n\n".join(f"Part {i}:\n{t}" for i, t in enumerate(texts, start=1))
+        user_instruction = (
+            f"Here are consecutive summaries covering Turns {first_turn} to {last_turn}, oldest first:\n"
+            f"{parts}\n\n"
+            "Merge them into ONE short paragraph (3–4 sentences), in chronological order.\n"
+            "Keep only what still matters later: decisions, discoveries, injuries, who is where, unresolved threads.\n"
+            "Do NOT add new information, headings or bullet lists.\n"
+        )
+        return [
+            {"role": "system", "content": self.summary_prompt()},
+            {"role": "user", "content": user_instruction},
+        ]
+
     # ------------------------------------------------------------------
     # MEMORY MESSAGES
     # ------------------------------------------------------------------
@@ -144,11 +162,13 @@ class PromptManager:
             {"role": "user", "content": user_instruction},
         ]
     
-    def build_scene_text(self, turns_to_keep: int | None = None) -> str:
+    def build_scene_text(self, turns_to_keep: int | None = None, history_budget: int | None = None) -> str:
         """
         Builds a collapsed scene text for LLM input:
         - Uses summaries if present (under '## Summary')
         - Keeps the last `turns_to_keep` turns fully detailed
+        - Past `history_budget` tokens of summaries, the oldest turns are
+          replaced by their roll-ups ('## Roll-up L<n>'), coarsest first
         - Returns text suitable for LLM context
         """
         scene_text = self.load_scene()
@@ -157,10 +177,13 @@ class PromptManager:
             turns_to_keep = TURNS_TO_KEEP
         lines = scene_text.splitlines()
         description_lines = []
-        turns = []  # list of dicts: {"summary": [], "lines": []}
+        turns = []  # list of dicts: {"summary": [], "lines": [], "rollups": {level: []}}
 
         current_summary_lines = []
         current_turn_lines = []
+        current_rollups = {}
+        current_ranges = {}
+        rollup_lines = None
         in_description = False
         in_turn = False
         in_summary = False
@@ -179,10 +202,15 @@ class PromptManager:
                 if current_summary_lines or current_turn_lines:
                     turns.append({
                         "summary": current_summary_lines if current_summary_lines else None,
-                        "lines": current_turn_lines
+                        "lines": current_turn_lines,
+                        "rollups": current_rollups,
+                        "rollup_ranges": current_ranges,
                     })
                 current_summary_lines = []
                 current_turn_lines = []
+                current_rollups = {}
+                current_ranges = {}
+                rollup_lines = None
                 in_description = False
                 in_turn = True
                 in_summary = False
@@ -192,14 +220,26 @@ class PromptManager:
             elif stripped.startswith("## Summary"):
                 in_summary = True
                 in_full_turn = False
+                rollup_lines = None
                 continue
 
             elif stripped.startswith("## Full Turn"):
                 in_full_turn = True
                 in_summary = False
+                rollup_lines = None
+                continue
+
+            elif m := ROLLUP_HEADER_RE.match(stripped):
+                rollup_lines = current_rollups.setdefault(int(m.group(1)), [])
+                current_ranges[int(m.group(1))] = (int(m.group(2)), int(m.group(3))) if m.group(2) else None
+                in_summary = in_full_turn = False
                 continue
 
-            if in_description:
+            if rollup_lines is not None:
+                if stripped:
+                    rollup_lines.append(stripped)
+
+            elif in_description:
                 description_lines.append(stripped)
 
             elif in_summary:
@@ -213,25 +253,97 @@ class PromptManager:
         if current_summary_lines or current_turn_lines:
             turns.append({
                 "summary": current_summary_lines if current_summary_lines else None,
-                "lines": current_turn_lines
+                "lines": current_turn_lines,
+                "rollups": current_rollups,
+                "rollup_ranges": current_ranges,
             })
 
         # determine cutoff: last N turns to keep fully detailed
         num_turns = len(turns)
         cutoff_idx = max(0, num_turns - turns_to_keep)
 
-        # rebuild scene using summaries for older turns
+        # rebuild scene using summaries (or roll-ups) for older turns
         final_lines = description_lines + [""] if description_lines else []
 
-        for idx, turn in enumerate(turns):
+        for start, end, lines_ in self._history_units(turns, cutoff_idx, history_budget):
+            final_lines.append(f"# Turn {start + 1}" if end - start == 1 else f"# Turns {start + 1}–{end}")
+            final_lines.extend(lines_)
+
+        for idx in range(cutoff_idx, num_turns):
             final_lines.append(f"# Turn {idx + 1}")
-            if idx < cutoff_idx and turn["summary"]:
-                final_lines.extend(turn["summary"])
-            else:
-                final_lines.extend(turn["lines"])
+            # Full text may live in cold storage if fewer turns were kept at summary time
+            final_lines.extend(hydrate_lines(turns[idx]["lines"], self.get_active_scene_file()))
 
         return "\n".join(final_lines)
 
+    def _history_units(self, turns: list[dict], cutoff_idx: int, history_budget: int | None) -> list[tuple]:
+        """
+        (start, end, lines) units for the turns before cutoff_idx: one per turn
+        (its summary, or its full text if not summarized), then, while the units
+        exceed the budget, the oldest span covered by a roll-up is replaced by it.
+        A roll-up stored in turn i at level L covers the ROLLUP_FACTOR**L turns
+        ending at i; one whose header range no longer matches is skipped.
+        The result is reused while the history turns and budget are unchanged,
+        so a prompt build does not re-count (or re-hydrate) the same history.
+        """
+        if history_budget is None:
+            from config import HISTORY_TOKEN_BUDGET
+            history_budget = HISTORY_TOKEN_BUDGET
+        key = (
+            str(self.get_active_scene_file()), cutoff_idx, history_budget,
+            tuple(
+                (tuple(t["summary"] or ()), tuple(t["lines"]) if not t["summary"] else (),
+                 tuple(sorted((level, tuple(l)) for level, l in t["rollups"].items())),
+                 tuple(sorted(t.get("rollup_ranges", {}).items())))
+                for t in turns[:cutoff_idx]
+            ),
+        )
+        memo = self._history_memo
+        if memo and memo[0] == key:
+            return list(memo[1])
+        units = self._collapse_history(turns, cutoff_idx, history_budget)
+        self._history_memo = (key, units)
+        return list(units)
+
+    def _collapse_history(self, turns: list[dict], cutoff_idx: int, history_budget: int) -> list[tuple]:
+        units = []
+        for idx in range(cutoff_idx):
+            turn = turns[idx]
+            if turn["summary"]:
+                units.append((idx, idx + 1, turn["summary"]))
+            else:
+                units.append((idx, idx + 1, hydrate_lines(turn["lines"], self.get_active_scene_file())))
+
+        if not self.count_tokens or not history_budget:
+            return units
+
+        from config import ROLLUP_FACTOR
+        rollups = sorted(
+            (idx + 1 - ROLLUP_FACTOR ** level, level, idx + 1, lines_)
+            for idx in range(cutoff_idx)
+            for level, lines_ in turns[idx].get("rollups", {}).items()
+            if lines_ and rollup_matches(level, turns[idx].get("rollup_ranges", {}).get(level), idx + 1, ROLLUP_FACTOR)
+        )
+
+        def unit_tokens(unit):
+            return self.count_tokens("\n".join(unit[2]))
+
+        total = sum(unit_tokens(u) for u in units)
+        for start, level, end, lines_ in rollups:
+            if total <= history_budget:
+                break
+            covered = [u for u in units if start <= u[0] and u[1] <= end]
+            # Skip spans already collapsed into a coarser roll-up
+            if len(covered) <= 1 or any(u[0] < start < u[1] or u[0] < end < u[1] for u in units):
+                continue
+            rolled = (start, end, lines_)
+            total += unit_tokens(rolled) - sum(unit_tokens(u) for u in covered)
+            units = [u for u in units if not (start <= u[0] and u[1] <= end)]
+            units.append(rolled)
+            units.sort(key=lambda u: u[0])
+
+        return units
+
     # ------------------------------------------------------------------
     # MAIN DIALOGUE MESSAGES
     # ------------------------------------------------------------------
@@ -261,12 +373,18 @@ class PromptManager:
         agent,
         system_prompt: str,
         scene_text: str,
-        user_input: str
+        user_input: str,
+        render_sheet=None,
+        submode: str = None,
+        record: bool = True,
     ) -> list[dict]:
         """
         Build messages for group mode:
         - System message: system prompt + group prompt loaded from file + all character sheets
         - User message: collapsed scene + GM input
+        render_sheet, if given, transforms each sheet text (e.g. dense rendering).
+        submode selects the sheet sections sent (SUBMODE_SHEET_PROFILES).
+        record=False keeps the sheet selection stats untouched (prewarming).
         """
 
         # Load group prompt template from file
@@ -276,7 +394,9 @@ class PromptManager:
         # Build character sheets text
         sheet_blocks = []
         for name, path in zip(agent.character_names, agent.character_paths):
-            sheet_text = read_vault_file(agent.vault_root, str(path.relative_to(agent.vault_root)))
+            sheet_text = agent.sheets.prompt_text(path, submode, record=record)
+            if render_sheet:
+                sheet_text = render_sheet(sheet_text)
             sheet_blocks.append(f"### CHARACTER: {name}\n{sheet_text}")
         combined_sheets = "\n\n".join(sheet_blocks)
 
@@ -295,3 +415,34 @@ class PromptManager:
             {"role": "user", "content": user_content},
         ]
 
+    def build_fanout_messages(
+        self,
+        system_prompt: str,
+        character_instructions: str,
+        submode_instructions: str,
+        character_sheet: str,
+        speaker_name: str,
+        group_names: list[str],
+        scene_text: str,
+        user_input: str,
+    ) -> list[dict]:
+        """
+        Build messages for one character of a fan-out group turn.
+        Everything up to the scene and GM input is identical for every character,
+        so the server can reuse that prefix; only the last message differs.
+        """
+        others = ", ".join(n for n in group_names if n != speaker_name) or "nobody else"
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": character_instructions},
+            {"role": "system", "content": submode_instructions},
+            {"role": "user", "content": (
+                f"Here is the scene so far:\n{scene_text}\n\n"
+                f"The GM has said to the whole group:\n{user_input}"
+            )},
+            {"role": "user", "content": (
+                f"ACTIVE CHARACTER SHEET:\n{character_sheet}\n\n"
+                f"You are {speaker_name}. Respond only as this character; {others} answer for themselves. "
+                "Keep your answer short unless the GM explicitly requests length."
+            )},
+        ]
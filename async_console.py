@@ -0,0 +1,102 @@
+# async_console.py
+import asyncio
+import threading
+from utils import LazyConsole
+from LLM import GenerationCancelled
+
+console = LazyConsole()
+
+CANCEL_DISCARD = "!"
+CANCEL_KEEP = "!k"
+
+
+def is_local_command(line: str) -> bool:
+    """Commands that never call the LLM and may run while a reply is generating."""
+    if line.startswith(".") or line == "*":
+        return True
+    if line.startswith("/") and line[1:].isdigit():
+        return True
+    if line in ("/h", "/ls", "/n", "/npc", "/perf", "/compact", "/backends", "/viewers", "/profiles", "/pov"):
+        return True
+    return line.startswith(("/r ", "/odds ", "/find ", "/stat ", "/npc ", "/add ", "/rm "))
+
+
+class AsyncGMConsole:
+    """
+    asyncio front-end for GMInterface:
+      - local commands (/r, /ls, /n, narration…) run at once, even during a generation
+      - LLM-bound commands are queued and run one at a time in a worker thread
+      - "!" cancels the generation in flight and discards it, "!k" keeps the partial output
+      - every request runs under the agent's deadline (LLM_REQUEST_TIMEOUT)
+    """
+
+    def __init__(self, gm):
+        self.gm = gm
+        self.lines = None
+        self.pending = None
+        self.in_flight = None
+
+    def _stdin_reader(self, loop: asyncio.AbstractEventLoop):
+        # Daemon thread: a blocked input() never keeps the process alive on exit
+        while True:
+            try:
+                line = input(self.gm.prompt_text())
+            except (EOFError, KeyboardInterrupt):
+                line = None
+            loop.call_soon_threadsafe(self.lines.put_nowait, line)
+            if line is None:
+                return
+
+    async def _dispatch(self):
+        while True:
+            line = await self.lines.get()
+            if line is None:
+                await self.pending.put(None)
+                return
+            line = line.strip()
+
+            if line in (CANCEL_DISCARD, CANCEL_KEEP):
+                if self.in_flight is not None:
+                    self.gm.agent.request_cancel(keep_partial=(line == CANCEL_KEEP))
+                    console.print("[yellow]Cancelling…[/yellow]")
+                else:
+                    console.print("[dim]Nothing is generating.[/dim]")
+                continue
+
+            if is_local_command(line):
+                try:
+                    await asyncio.to_thread(self.gm.handle_command, line)
+                except Exception as e:
+                    console.print(f"[red]Command failed: {e}[/red]")
+                await asyncio.to_thread(self.gm.save_session)
+                continue
+
+            await self.pending.put(line)
+            if self.in_flight is not None:
+                console.print(f"[dim]Queued ({self.pending.qsize()} waiting)[/dim]")
+
+    async def _worker(self):
+        while True:
+            line = await self.pending.get()
+            if line is None:
+                return
+            self.in_flight = line
+            try:
+                await asyncio.to_thread(self.gm.handle_command, line)
+            except GenerationCancelled:
+                console.print("[yellow]Command cancelled.[/yellow]")
+            except Exception as e:
+                console.print(f"[red]Command failed: {e}[/red]")
+            finally:
+                self.in_flight = None
+            await asyncio.to_thread(self.gm.save_session)
+
+    async def run(self):
+        self.lines = asyncio.Queue()
+        self.pending = asyncio.Queue()
+        self.gm.agent.streaming = True
+
+        console.print("[bold cyan]GM Assistant Ready.[/bold cyan] [dim](! cancels a generation, !k keeps its partial output)[/dim]\n")
+        reader = threading.Thread(target=self._stdin_reader, args=(asyncio.get_running_loop(),), daemon=True)
+        reader.start()
+        await asyncio.gather(self._dispatch(), self._worker())
@@ -0,0 +1,256 @@
+# backends.py
+import threading
+import time
+from utils import LazyConsole
+
+console = LazyConsole()
+
+FAILOVER_STATUS = 500           # ResponseError status from which another backend is tried
+AFFINITY_WEIGHT = 2             # A model load costs about as much as queueing behind this many requests
+MAX_DOWN_BACKOFF = 300.0        # Seconds between checks of a host that keeps failing (doubles up to this)
+
+
+def model_key(name: str) -> str:
+    """Ollama reports loaded models with their tag ("dolphin3:8b", "name:latest")."""
+    return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+
+class Backend:
+    """One Ollama host: its client (one persistent HTTP connection pool) and counters."""
+
+    def __init__(self, host: str, request_timeout: float, connect_timeout: float):
+        self.host = host
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self._client = None
+        self.healthy = True
+        self.last_check = 0.0
+        self.failures = 0               # consecutive failed checks / requests, for the down backoff
+        self.checking = False
+        self.loaded_models = set()
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            import ollama
+            self._client = ollama.Client(
+                host=self.host,
+                timeout=httpx.Timeout(self.request_timeout, connect=self.connect_timeout),
+            )
+        return self._client
+
+    @property
+    def avg_latency(self) -> float | None:
+        return self.total_latency / self.requests if self.requests else None
+
+
+class PooledStream:
+    """
+    Chunks of a streamed chat on one backend. The backend's in-flight slot is
+    released when the stream is exhausted, fails or is closed (e.g. on cancel).
+    """
+
+    def __init__(self, pool, backend: Backend, started: float, model: str, first, chunks):
+        self.pool = pool
+        self.backend = backend
+        self.started = started
+        self.model = model
+        self._first = first
+        self._chunks = chunks
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            return first
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self._finish("ok")
+            raise
+        except Exception as e:
+            self._finish("down" if self.pool._is_failover(e) else "error")
+            raise
+
+    def close(self):
+        close = getattr(self._chunks, "close", None)
+        if close:
+            close()
+        self._finish("ok")
+
+    def _finish(self, outcome: str):
+        if not self._finished:
+            self._finished = True
+            self.pool._done(self.backend, self.started, self.model, outcome)
+
+
+class BackendPool:
+    """
+    Several Ollama hosts behind the client interface used by OllamaAgent (chat / ps):
+      - health checks (ps) at most every `health_interval` seconds per host, on
+        a background thread so a request never waits on a ping; a host that
+        is down is checked again after a backoff doubling up to MAX_DOWN_BACKOFF
+      - routing to the least-loaded healthy host, preferring hosts that
+        already have the model loaded (no load stall)
+      - fail-over to the next host on connection errors or 5xx answers
+      - per-host request, error and latency counters (report)
+    """
+
+    def __init__(self, hosts: list[str], request_timeout: float, connect_timeout: float,
+                 health_interval: float = 15.0):
+        if not hosts:
+            raise ValueError("BackendPool needs at least one host")
+        self.backends = [Backend(h, request_timeout, connect_timeout) for h in hosts]
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Health
+    # ------------------------------------------------------------------
+    def check(self, backend: Backend) -> bool:
+        """Ping a host with ps(), refreshing the models it has loaded."""
+        try:
+            resp = backend.client.ps()
+            models = resp.get("models", []) if isinstance(resp, dict) else getattr(resp, "models", [])
+            backend.loaded_models = {
+                model_key(m.get("model") or m.get("name") if isinstance(m, dict) else m.model) for m in models
+            }
+            backend.healthy = True
+            backend.failures = 0
+        except Exception:
+            backend.healthy = False
+            backend.failures += 1
+        backend.last_check = time.monotonic()
+        return backend.healthy
+
+    def _check_interval(self, backend: Backend) -> float:
+        if backend.healthy:
+            return self.health_interval
+        return min(self.health_interval * 2 ** max(backend.failures - 1, 0), MAX_DOWN_BACKOFF)
+
+    def _background_check(self, backend: Backend):
+        try:
+            self.check(backend)
+        finally:
+            backend.checking = False
+
+    def _refresh(self):
+        """Start a background check of every host that is due; never blocks."""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                b for b in self.backends
+                if not b.checking and now - b.last_check >= self._check_interval(b)
+            ]
+            for backend in due:
+                backend.checking = True
+        for backend in due:
+            threading.Thread(target=self._background_check, args=(backend,), daemon=True).start()
+
+    def _pick(self, model: str, exclude: set) -> Backend | None:
+        self._refresh()
+        key = model_key(model)
+        with self._lock:
+            candidates = [b for b in self.backends if b.host not in exclude and b.healthy]
+            if not candidates:
+                # Everything looks down: still try the hosts not tried yet
+                candidates = [b for b in self.backends if b.host not in exclude]
+            if not candidates:
+                return None
+            best = min(candidates, key=lambda b: (
+                b.in_flight + (0 if key in b.loaded_models else AFFINITY_WEIGHT),
+                b.avg_latency if b.avg_latency is not None else 0.0,
+            ))
+            best.in_flight += 1
+            return best
+
+    def _done(self, backend: Backend, started: float, model: str, outcome: str = "ok"):
+        """outcome: "ok", "error" (request failed) or "down" (host unreachable / broken)."""
+        with self._lock:
+            backend.in_flight -= 1
+            if outcome != "ok":
+                backend.errors += 1
+                if outcome == "down":
+                    backend.healthy = False
+                    backend.failures += 1
+                    backend.last_check = time.monotonic()
+            else:
+                backend.requests += 1
+                backend.total_latency += time.monotonic() - started
+                backend.loaded_models.add(model_key(model))
+
+    @staticmethod
+    def _is_failover(exc: Exception) -> bool:
+        import httpx
+        import ollama
+        if isinstance(exc, (ConnectionError, httpx.TransportError)):
+            return not isinstance(exc, httpx.ReadTimeout)   # a slow reply is not a dead host
+        return isinstance(exc, ollama.ResponseError) and exc.status_code >= FAILOVER_STATUS
+
+    # ------------------------------------------------------------------
+    # Client interface
+    # ------------------------------------------------------------------
+    def chat(self, model: str = "", messages=None, stream: bool = False, **kwargs):
+        tried = set()
+        last_error = None
+        while True:
+            backend = self._pick(model, tried)
+            if backend is None:
+                raise last_error or ConnectionError("No Ollama backend available")
+            tried.add(backend.host)
+            started = time.monotonic()
+            try:
+                if not stream:
+                    resp = backend.client.chat(model=model, messages=messages, **kwargs)
+                    self._done(backend, started, model)
+                    return resp
+                # Streams connect lazily: pull the first chunk here so a dead host still fails over
+                chunks = backend.client.chat(model=model, messages=messages, stream=True, **kwargs)
+                first = next(chunks, None)
+            except Exception as e:
+                failover = self._is_failover(e)
+                self._done(backend, started, model, "down" if failover else "error")
+                if not failover:
+                    raise
+                last_error = e
+                console.print(f"[yellow][backends] {backend.host} failed ({e.__class__.__name__}), trying another host[/yellow]")
+                continue
+            return PooledStream(self, backend, started, model, first, chunks)
+
+    def ps(self):
+        """Models loaded on the first healthy host (client interface)."""
+        self._refresh()
+        for backend in self.backends:
+            if backend.healthy:
+                return backend.client.ps()
+        raise ConnectionError("No Ollama backend available")
+
+    # ------------------------------------------------------------------
+    # Report
+    # ------------------------------------------------------------------
+    def report(self):
+        from rich.table import Table
+        for backend in self.backends:
+            self.check(backend)
+        table = Table(title="Ollama backends")
+        for col in ("Host", "Status", "Loaded models", "In flight", "Requests", "Errors", "Avg latency s"):
+            table.add_column(col, justify="left" if col in ("Host", "Status", "Loaded models") else "right")
+        for b in self.backends:
+            table.add_row(
+                b.host,
+                "[green]up[/green]" if b.healthy else "[red]down[/red]",
+                ", ".join(sorted(b.loaded_models)) or "-",
+                str(b.in_flight),
+                str(b.requests),
+                str(b.errors),
+                "-" if b.avg_latency is None else f"{b.avg_latency:.2f}",
+            )
+        console.print(table)
@@ -0,0 +1,299 @@
+# bakeoff.py
+"""
+Model bake-off over recorded scenes.
+
+    python bakeoff.py                                   # BAKEOFF_MODELS over Scenes/Finished
+    python bakeoff.py --models dolphin3:8b llama3.2:3b "Scenes/Finished/Test*.md"
+    python bakeoff.py --replies 3 --turns 3 --ctx 8192
+
+Every model replays the same workloads taken from the scenes:
+  - reply:         each sampled GM line, answered by the character who spoke next
+  - turn summary:  summarize_turn on sampled turns
+  - scene summary: the /end pipeline (get_tokenwise_summary_batches + summarize_batches)
+
+Per model: prefill / decode throughput, wall time per task, compression ratio
+of the summaries, context-fit failures and errors. Results are printed as a
+table and written to Logs/bakeoff-<time>.json.
+"""
+import argparse
+import glob
+import json
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from utils import LazyConsole
+from config import (
+    vault_root, characters_dir, scenes_active_dir, scenes_finished_dir, prompts_dir, logs_dir,
+    SCENE_CONTEXT_THRESHOLD, GENERATION_ALLOWANCE, BAKEOFF_MODELS,
+)
+from LLM import OllamaAgent
+from Prompt_Manager2000 import PromptManager
+from batch import BatchManager
+from turns import summarize_turn
+from cold_storage import hydrate_scene_text
+from generation import generation_options, RepetitionDetector
+
+console = LazyConsole()
+
+GM_LINE_RE = re.compile(r"^GM\s*:\s*(.+)$")
+SPEAKER_RE = re.compile(r"^([^:\n]{1,40}?)\s*:")
+
+
+def _sample(items: list, count: int) -> list:
+    """`count` items spread evenly over the list (all of them when count is 0 or larger)."""
+    if not count or len(items) <= count:
+        return items
+    step = len(items) / count
+    return [items[int(i * step)] for i in range(count)]
+
+
+# ---------------------------------------------------------
+# Workloads (model independent, built once)
+# ---------------------------------------------------------
+def reply_workloads(scene_text: str, roster: list[str], count: int) -> list[dict]:
+    """GM lines of the scene, each with the text before it and the character who answered."""
+    lines = scene_text.splitlines()
+    found = []
+    for i, line in enumerate(lines):
+        m = GM_LINE_RE.match(line.strip())
+        if not m:
+            continue
+        answer = next((l.strip() for l in lines[i + 1:] if l.strip()), "")
+        speaker = SPEAKER_RE.match(answer)
+        name = speaker.group(1).strip() if speaker and not answer.startswith("GM") else None
+        found.append({
+            "scene_text": "\n".join(lines[:i]).strip(),
+            "user_input": m.group(1).strip(),
+            "speaker": name or (roster[0] if roster else "Character"),
+        })
+    return _sample(found, count)
+
+
+def turn_workloads(batcher: BatchManager, scene_text: str, count: int) -> list[dict]:
+    sections = batcher.parse_generic(scene_text)
+    turns = batcher.extract_groups_from_sections(sections, header_regex=r"^Turn\s+(\d+)")
+    found = []
+    for turn in turns:
+        full = next((s["text"] for s in turn["sections"] if s.get("header", "").lower() == "full turn"), "")
+        text = full or "\n".join(s["text"] for s in turn["sections"])
+        if text.strip():
+            found.append({"index": turn["index"], "text": text})
+    return _sample(found, count)
+
+
+def load_scenes(patterns: list[str], replies: int, turns: int, roster: list[str], batcher: BatchManager) -> list[dict]:
+    if patterns:
+        paths = sorted({Path(p) for pattern in patterns for p in glob.glob(pattern)})
+    else:
+        paths = sorted(scenes_finished_dir.glob("*.md"))
+
+    scenes = []
+    for path in paths:
+        text = hydrate_scene_text(path.read_text(encoding="utf-8"), path)
+        if not text.strip():
+            continue
+        workloads = reply_workloads(text, roster, replies)
+        scenes.append({
+            "name": path.name,
+            "text": text,
+            "replies": workloads,
+            "turns": turn_workloads(batcher, text, turns),
+            # Characters of the scene, for the stop sequences of the replies
+            "roster": list(dict.fromkeys([*roster, *(w["speaker"] for w in workloads)])),
+        })
+    return scenes
+
+
+# ---------------------------------------------------------
+# One model
+# ---------------------------------------------------------
+class ModelRun:
+    """Calls, failures and summary sizes of one model over all workloads."""
+
+    def __init__(self, agent: OllamaAgent, model: str, ctx: int | None):
+        self.agent = agent
+        self.model = model
+        self.limit = ctx or agent.model_token_limit(model)
+        self.calls = []             # perf records of this model's calls
+        self.context_failures = 0
+        self.errors = 0
+        self.summary_in = 0         # tokens summarized
+        self.summary_out = 0        # tokens of the summaries
+
+    def fits(self, messages) -> bool:
+        """A request that cannot fit the model context is a failure, not a call."""
+        needed = self.agent.count_tokens(messages, include_history=False) + GENERATION_ALLOWANCE
+        if self.limit and needed > self.limit:
+            self.context_failures += 1
+            return False
+        return True
+
+    def track(self, fn, *args, **kwargs):
+        """Run an LLM-calling function and keep the perf records it produced."""
+        before = len(self.agent.perf.records)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            console.print(f"[red]{self.model}: {e}[/red]")
+            return None
+        finally:
+            self.calls += self.agent.perf.records[before:]
+
+    def summarized(self, source: str, summary: str | None):
+        if summary:
+            self.summary_in += self.agent.count_tokens_string(source)
+            self.summary_out += self.agent.count_tokens_string(summary)
+
+
+def run_model(agent: OllamaAgent, pm: PromptManager, model: str, scenes: list[dict], ctx: int | None) -> ModelRun:
+    agent.model = model
+    batcher = BatchManager(agent)
+    run = ModelRun(agent, model, ctx)
+    if not run.limit:
+        console.print(f"[red]Could not get the context length of {model}, pass it with --ctx.[/red]")
+        return run
+    system_prompt, instructions = pm.system_prompt(), pm.character_instructions()
+    roleplay = pm.submode("roleplay")
+
+    # Load the model first so the load time is not billed to the first task
+    run.track(agent.chat, [{"role": "user", "content": "Hi"}], options={"num_predict": 1}, task="load")
+
+    for scene in scenes:
+        console.print(f"[cyan]{model} · {scene['name']}[/cyan]")
+        for work in scene["replies"]:
+            messages = pm.build_single_character_messages(
+                system_prompt=system_prompt,
+                character_instructions=instructions,
+                submode_instructions=roleplay,
+                character_sheet=agent.get_character_sheet_by_name(work["speaker"]),
+                speaker_name=work["speaker"],
+                scene_text=work["scene_text"],
+                user_input=work["user_input"],
+            )
+            if run.fits(messages):
+                # Same generation profile (length, temperature, stop sequences) and loop abort as a live roleplay reply
+                options = generation_options("roleplay", work["speaker"], scene["roster"])
+                run.track(agent.chat, messages, options=options, monitor=RepetitionDetector(),
+                          task="reply", character=work["speaker"], submode="roleplay")
+
+        for work in scene["turns"]:
+            if run.fits(pm.build_turn_summary_messages(work["text"], work["index"])):
+                run.summarized(work["text"], run.track(summarize_turn, work["text"], agent, work["index"]))
+
+        batches = batcher.get_tokenwise_summary_batches(
+            scene_text=scene["text"],
+            system_prompts=[{"role": "system", "content": pm.summary_prompt()}],
+            SCENE_CONTEXT_THRESHOLD=SCENE_CONTEXT_THRESHOLD,
+            prompt_manager=pm,
+            model_token_limit=run.limit,
+        )
+        run.summarized(scene["text"], run.track(batcher.summarize_batches, batches, pm, verbose=False))
+    return run
+
+
+# ---------------------------------------------------------
+# Report
+# ---------------------------------------------------------
+def _rate(records, count_key, duration_key):
+    count = sum(r[count_key] or 0 for r in records)
+    duration = sum(r[duration_key] or 0 for r in records)
+    return count / (duration / 1e9) if count and duration else None
+
+
+def summarize_run(run: ModelRun) -> dict:
+    work = [r for r in run.calls if r["task"] != "load"]
+    tasks = {}
+    for r in work:
+        tasks.setdefault(r["task"], []).append(r)
+    return {
+        "model": run.model,
+        "context_limit": run.limit,
+        "calls": len(work),
+        "load_s": sum((r["load_duration"] or 0) for r in run.calls) / 1e9,
+        "prefill_tps": _rate(work, "prompt_eval_count", "prompt_eval_duration"),
+        "decode_tps": _rate(work, "eval_count", "eval_duration"),
+        "wall_s": sum(r["wall_time"] or 0 for r in work),
+        "tasks": {
+            task: {
+                "calls": len(rows),
+                "mean_wall_s": sum(r["wall_time"] or 0 for r in rows) / len(rows),
+                "prefill_tps": _rate(rows, "prompt_eval_count", "prompt_eval_duration"),
+                "decode_tps": _rate(rows, "eval_count", "eval_duration"),
+            }
+            for task, rows in tasks.items()
+        },
+        "compression_ratio": run.summary_in / run.summary_out if run.summary_out else None,
+        "context_failures": run.context_failures,
+        "errors": run.errors,
+    }
+
+
+def print_table(results: list[dict]):
+    from rich.table import Table
+    fmt = lambda v, d=1: "-" if v is None else f"{v:.{d}f}"
+    task_wall = lambda res, task: fmt(res["tasks"].get(task, {}).get("mean_wall_s"), 2)
+
+    table = Table(title="Model bake-off")
+    for col in ("Model", "Prefill tok/s", "Decode tok/s", "Reply s", "Turn sum s", "Scene batch s",
+                "Compression", "Ctx fails", "Errors", "Load s", "Total s"):
+        table.add_column(col, justify="left" if col == "Model" else "right")
+    for res in results:
+        table.add_row(
+            res["model"],
+            fmt(res["prefill_tps"]),
+            fmt(res["decode_tps"]),
+            task_wall(res, "reply"),
+            task_wall(res, "turn summary"),
+            task_wall(res, "scene batch"),
+            fmt(res["compression_ratio"]) + ("x" if res["compression_ratio"] else ""),
+            str(res["context_failures"]),
+            str(res["errors"]),
+            fmt(res["load_s"]),
+            fmt(res["wall_s"]),
+        )
+    console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded scenes against several models and compare them.")
+    parser.add_argument("patterns", nargs="*", help="Scene file globs (default: Scenes/Finished/*.md)")
+    parser.add_argument("--models", nargs="+", default=BAKEOFF_MODELS, help="Ollama models to compare")
+    parser.add_argument("--replies", type=int, default=5, help="GM lines replayed per scene (0 = all)")
+    parser.add_argument("--turns", type=int, default=5, help="Turns summarized per scene (0 = all)")
+    parser.add_argument("--ctx", type=int, default=None, help="Context length, if Ollama cannot report it")
+    parser.add_argument("--out", type=Path, default=None, help="JSON results file (default: Logs/bakeoff-<time>.json)")
+    args = parser.parse_args()
+
+    agent = OllamaAgent(vault_root, characters_dir, scenes_active_dir)
+    pm = PromptManager(prompts_dir, count_tokens=agent.count_tokens_string)
+    scenes = load_scenes(args.patterns, args.replies, args.turns, agent.character_names, BatchManager(agent))
+    if not scenes:
+        console.print("[yellow]No scene to replay.[/yellow]")
+        return
+    console.print(
+        f"[cyan]{len(scenes)} scene(s): {sum(len(s['replies']) for s in scenes)} replies, "
+        f"{sum(len(s['turns']) for s in scenes)} turn summaries, {len(scenes)} scene summaries per model.[/cyan]"
+    )
+
+    results = []
+    for model in args.models:
+        start = time.perf_counter()
+        result = summarize_run(run_model(agent, pm, model, scenes, args.ctx))
+        result["elapsed_s"] = time.perf_counter() - start
+        results.append(result)
+
+    print_table(results)
+    out = args.out or logs_dir / f"bakeoff-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({
+        "time": time.time(),
+        "scenes": [s["name"] for s in scenes],
+        "results": results,
+    }, indent=2), encoding="utf-8")
+    console.print(f"[dim]Results: {out}[/dim]")
+
+
+if __name__ == "__main__":
+    main()
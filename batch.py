@@ -1,5 +1,54 @@
 import re
 import math
+import hashlib
+import json
+import os
+from pathlib import Path
+from utils import LazyConsole
+
+console = LazyConsole()
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(scene_path: Path) -> Path:
+    return scene_path.with_name(scene_path.name + ".endckpt.json")
+
+
+class BatchCheckpoint:
+    """
+    Output of every finished summary batch, saved to a sidecar next to the scene
+    after each batch. Entries are only valid for the same scene content (hash) and
+    the same batch boundaries (turn indices); anything else starts over.
+    """
+
+    def __init__(self, path: Path, scene_text: str):
+        self.path = path
+        self.scene_hash = hashlib.sha1(scene_text.encode("utf-8")).hexdigest()
+        self.batches = []
+        if path.exists():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+                if data.get("version") == CHECKPOINT_VERSION and data.get("scene_hash") == self.scene_hash:
+                    self.batches = data["batches"]
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                console.print(f"[yellow][checkpoint] Unreadable checkpoint ignored: {e}[/yellow]")
+
+    def lookup(self, position: int, turn_indices: list) -> str | None:
+        if position < len(self.batches) and self.batches[position]["turns"] == turn_indices:
+            return self.batches[position]["summary"]
+        return None
+
+    def record(self, position: int, turn_indices: list, summary: str):
+        del self.batches[position:]
+        self.batches.append({"turns": turn_indices, "summary": summary})
+        data = {"version": CHECKPOINT_VERSION, "scene_hash": self.scene_hash, "batches": self.batches}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
 
 class BatchManager:
     def __init__(self, agent):
@@ -271,4 +320,59 @@ class BatchManager:
                 "turn_indices": batch_turn_indices,
             })
 
-        return batches
\ No newline at end of file
+        return batches
+
+    # -----------------------------
+    # SCENE SUMMARY PIPELINE
+    # -----------------------------
+    def summarize_batches(self, batches: list[dict], prompt_manager, verbose: bool = True,
+                          checkpoint: BatchCheckpoint = None) -> str:
+        """
+        Summarize batches in order, each one seeing the summary accumulated so far.
+        With a checkpoint, leading batches already summarized are reused and each
+        new batch output is saved as soon as it is received.
+        Returns the full scene summary.
+        """
+        accumulated_summary = ""
+        total = len(batches)
+        position = 0            # index among non-empty batches
+        resumed = 0
+
+        for i, batch in enumerate(batches, start=1):
+            if not batch["batch_text"].strip():
+                continue
+            batch["prior_summary_text"] = accumulated_summary
+
+            # Reuse the checkpoint while every earlier batch came from it too
+            cached = checkpoint.lookup(position, batch["turn_indices"]) if checkpoint and resumed == position else None
+            if cached is not None:
+                accumulated_summary += ("\n\n" if accumulated_summary else "") + cached
+                position += 1
+                resumed += 1
+                continue
+            if resumed and resumed == position and verbose:
+                console.print(f"[cyan]Resumed {resumed} finished batch(es) from checkpoint.[/cyan]")
+            messages = prompt_manager.build_summary_messages(
+                scene_text=batch["batch_text"],
+                prior_summary_text=accumulated_summary,  # empty for first batch
+            )
+
+            if verbose:
+                used_tokens = self.agent.count_tokens(messages)
+                console.print(f"\n[bold cyan]Processing batch {i}/{total}…[/bold cyan]")
+                console.print(f"[magenta]Batch {i} token usage: {used_tokens} tokens[/magenta]")
+                console.print(f"[magenta]Turns in this batch: {batch['turn_indices']}[/magenta]")
+                console.print(f"[yellow]Requesting LLM summary for batch {i}…[/yellow]")
+
+            llm_output = self.agent.chat(messages, task="scene batch").strip()
+            if verbose:
+                console.print(f"[green]Received summary for batch {i}.[/green]")
+            if checkpoint:
+                checkpoint.record(position, batch["turn_indices"], llm_output)
+            position += 1
+
+            accumulated_summary += ("\n\n" if accumulated_summary else "") + llm_output
+
+        if resumed and resumed == position and verbose:
+            console.print(f"[cyan]All {resumed} batch(es) restored from checkpoint.[/cyan]")
+        return accumulated_summary.strip()
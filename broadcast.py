@@ -0,0 +1,158 @@
+# broadcast.py
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import LazyConsole
+
+console = LazyConsole()
+
+KEEPALIVE_SECONDS = 15          # comment line sent to idle viewers so proxies keep the stream open
+
+VIEWER_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Scene</title>
+<style>
+body { font-family: Georgia, serif; max-width: 48em; margin: 2em auto; padding: 0 1em; background: #1b1b1b; color: #ddd; }
+p { white-space: pre-wrap; line-height: 1.4; }
+.live { color: #9cf; }
+</style></head>
+<body><div id="scene"></div>
+<script>
+const scene = document.getElementById("scene");
+const live = {};
+function line(text, cls) { const p = document.createElement("p"); p.textContent = text; if (cls) p.className = cls; scene.appendChild(p); window.scrollTo(0, document.body.scrollHeight); return p; }
+const es = new EventSource("/events");
+es.addEventListener("token", e => { const d = JSON.parse(e.data); (live[d.id] ||= line((d.character ? d.character + " : " : ""), "live")).textContent += d.text; });
+es.addEventListener("line", e => { for (const id in live) { live[id].remove(); delete live[id]; } line(JSON.parse(e.data).text); });
+es.addEventListener("rollback", e => { for (const id in live) { live[id].remove(); delete live[id]; } if (scene.lastChild) scene.lastChild.remove(); });
+</script></body></html>
+"""
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class Broadcaster:
+    """
+    Fan-out of scene events to any number of viewers.
+
+    publish() encodes an event once and offers it to every subscriber queue
+    without blocking; a viewer whose queue is full is too slow and is dropped,
+    so the GM loop never waits on the network. New viewers first receive the
+    last `history` appended lines.
+    """
+
+    def __init__(self, queue_size: int = 256, history: int = 50):
+        self.queue_size = queue_size
+        self.history = deque(maxlen=history)
+        self.subscribers = set()
+        self.dropped = 0
+        self._stream_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue(maxsize=self.queue_size + len(self.history))
+        with self._lock:
+            for payload in self.history:
+                q.put_nowait(payload)
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self.subscribers.discard(q)
+
+    def publish(self, event: str, data: dict):
+        payload = sse_event(event, data)
+        with self._lock:
+            if event == "line":
+                self.history.append(payload)
+            elif event == "rollback" and self.history:
+                self.history.pop()
+            subscribers = list(self.subscribers)
+
+        for q in subscribers:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                self._drop(q)
+
+    def _drop(self, q: queue.Queue):
+        with self._lock:
+            if q not in self.subscribers:
+                return
+            self.subscribers.discard(q)
+            self.dropped += 1
+        # Make room for the sentinel so the viewer's thread closes its connection
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def token_sink(self, character: str = None):
+        """Callback publishing the chunks of one streamed reply under their own stream id."""
+        stream_id = next(self._stream_ids)
+        return lambda text: self.publish("token", {"id": stream_id, "character": character, "text": text})
+
+    def report(self) -> str:
+        return f"{len(self.subscribers)} viewer(s), {self.dropped} dropped"
+
+
+class _ViewerHandler(BaseHTTPRequestHandler):
+    broadcaster: Broadcaster = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/":
+            body = VIEWER_PAGE.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path != "/events":
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        q = self.broadcaster.subscribe()
+        try:
+            while True:
+                try:
+                    payload = q.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    payload = b": keepalive\n\n"
+                if payload is None:         # dropped for being too slow
+                    return
+                self.wfile.write(payload)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            self.broadcaster.unsubscribe(q)
+
+
+def start_broadcast(host: str, port: int, queue_size: int = 256, history: int = 50) -> Broadcaster:
+    """Serve the viewer page and the SSE stream from a daemon thread."""
+    broadcaster = Broadcaster(queue_size=queue_size, history=history)
+    handler = type("ViewerHandler", (_ViewerHandler,), {"broadcaster": broadcaster})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    console.print(f"[cyan][broadcast] Viewers: http://{host}:{port}/[/cyan]")
+    return broadcaster
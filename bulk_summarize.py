@@ -0,0 +1,185 @@
+# bulk_summarize.py
+"""
+Headless scene summarization for archived scenes.
+
+    python bulk_summarize.py                      # every scene in Scenes/Finished
+    python bulk_summarize.py "Scenes/Finished/Act2*.md" --concurrency 3
+    python bulk_summarize.py --force              # also redo scenes that already have a summary
+
+Scenes are parsed and tokenized in a process pool, then summarized with the
+BatchManager pipeline (several scenes in flight at once). Each summary is
+written in place as soon as its scene is done, and scenes that already carry a
+'# Scene Summary' are skipped, so an interrupted run resumes where it stopped.
+"""
+import argparse
+import glob
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from utils import LazyConsole
+from config import (
+    vault_root, characters_dir, scenes_active_dir, scenes_finished_dir, prompts_dir,
+    SCENE_CONTEXT_THRESHOLD, BULK_LLM_CONCURRENCY, BULK_PARSE_WORKERS, DEFAULT_MODEL,
+)
+from LLM import OllamaAgent
+from Prompt_Manager2000 import PromptManager
+from batch import BatchManager
+from turns import has_scene_summary, insert_scene_summary
+from cold_storage import hydrate_scene_text
+
+console = LazyConsole()
+
+
+class TokenCounter:
+    """
+    Token counting of OllamaAgent without its client and session state,
+    so a BatchManager can run inside worker processes.
+    """
+    count_tokens = OllamaAgent.count_tokens
+    count_tokens_string = OllamaAgent.count_tokens_string
+    _cached_token_len = OllamaAgent._cached_token_len
+
+    def __init__(self, model: str):
+        self.model = model
+        self._token_cache = OrderedDict()
+        self._token_cache_lock = threading.Lock()
+
+
+def prepare_scene(path: str, model: str, summary_prompt: str, model_token_limit: int) -> dict:
+    """
+    Worker: read, hydrate, parse and batch one scene (no LLM call).
+    "skip" holds why the scene has nothing to summarize: empty, or no '# Turn N' text.
+    """
+    scene_path = Path(path)
+    text = scene_path.read_text(encoding="utf-8")
+    if not text.strip():
+        return {"path": path, "batches": [], "tokens": 0, "skip": "empty"}
+
+    counter = TokenCounter(model)
+    full_text = hydrate_scene_text(text, scene_path)
+    batches = BatchManager(counter).get_tokenwise_summary_batches(
+        scene_text=full_text,
+        system_prompts=[{"role": "system", "content": summary_prompt}],
+        SCENE_CONTEXT_THRESHOLD=SCENE_CONTEXT_THRESHOLD,
+        prompt_manager=None,
+        model_token_limit=model_token_limit,
+    )
+    if not any(batch["turn_indices"] for batch in batches):
+        return {"path": path, "batches": [], "tokens": 0, "skip": "no turns"}
+    return {"path": path, "batches": batches, "tokens": counter.count_tokens_string(full_text), "skip": None}
+
+
+def collect_scenes(patterns: list[str], force: bool) -> tuple[list[Path], int]:
+    """Scene files matching the patterns, minus those already summarized (unless force)."""
+    if patterns:
+        paths = sorted({Path(p) for pattern in patterns for p in glob.glob(pattern)})
+    else:
+        paths = sorted(scenes_finished_dir.glob("*.md"))
+
+    todo = []
+    skipped = 0
+    for path in paths:
+        if not force and has_scene_summary(path.read_text(encoding="utf-8")):
+            skipped += 1
+            continue
+        todo.append(path)
+    return todo, skipped
+
+
+def summarize_prepared(scene: dict, batcher: BatchManager, pm: PromptManager) -> str:
+    """Run the summary pipeline for one prepared scene and write it in place."""
+    summary = batcher.summarize_batches(scene["batches"], pm, verbose=False)
+    if summary:
+        scene_path = Path(scene["path"])
+        original = scene_path.read_text(encoding="utf-8")
+        scene_path.write_text(insert_scene_summary(original, summary), encoding="utf-8")
+    return summary
+
+
+def run(patterns: list[str], concurrency: int, parse_workers: int | None, force: bool, model_token_limit: int | None):
+    todo, skipped = collect_scenes(patterns, force)
+    if skipped:
+        console.print(f"[dim]Skipping {skipped} scene(s) that already have a Scene Summary.[/dim]")
+    if not todo:
+        console.print("[yellow]No scene to summarize.[/yellow]")
+        return
+
+    agent = OllamaAgent(vault_root, characters_dir, scenes_active_dir)
+    pm = PromptManager(prompts_dir)
+    batcher = BatchManager(agent)
+    model_token_limit = model_token_limit or agent.model_token_limit()
+    if not model_token_limit:
+        console.print("[red]Could not get the model context length, pass it with --ctx.[/red]")
+        return
+
+    console.print(f"[cyan]Summarizing {len(todo)} scene(s) with {DEFAULT_MODEL} "
+                  f"({concurrency} at a time, context {model_token_limit}).[/cyan]")
+    start = time.perf_counter()
+    done = failed = nothing = tokens_done = 0
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as llm_pool:
+        prepared = [
+            parse_pool.submit(prepare_scene, str(p), agent.model, pm.summary_prompt(), model_token_limit)
+            for p in todo
+        ]
+
+        # Scenes go to the LLM pool as soon as they are parsed
+        running = {}
+        for future in as_completed(prepared):
+            try:
+                scene = future.result()
+            except Exception as e:
+                failed += 1
+                console.print(f"[red]Could not parse scene: {e}[/red]")
+                continue
+            if scene["skip"]:
+                nothing += 1
+                console.print(f"[dim]{Path(scene['path']).name}: {scene['skip']}, skipped.[/dim]")
+                continue
+            running[llm_pool.submit(summarize_prepared, scene, batcher, pm)] = scene
+
+        for future in as_completed(running):
+            scene = running[future]
+            name = Path(scene["path"]).name
+            try:
+                summary = future.result()
+            except Exception as e:
+                failed += 1
+                console.print(f"[red]{name}: failed ({e})[/red]")
+                continue
+            if not summary:
+                failed += 1
+                console.print(f"[yellow]{name}: no summary returned.[/yellow]")
+                continue
+
+            done += 1
+            tokens_done += scene["tokens"]
+            minutes = (time.perf_counter() - start) / 60
+            console.print(
+                f"[green]✓ {name}[/green] [dim]({len(scene['batches'])} batch(es), {scene['tokens']} tokens) — "
+                f"{done}/{len(todo) - nothing} · {done / minutes:.2f} scenes/min · {tokens_done / minutes:.0f} tokens/min[/dim]"
+            )
+
+    minutes = (time.perf_counter() - start) / 60
+    console.print(
+        f"\n[bold green]{done} scene(s) summarized, {failed} failed, {nothing} without turns skipped in {minutes:.1f} min "
+        f"({done / minutes if minutes else 0:.2f} scenes/min, {tokens_done / minutes if minutes else 0:.0f} tokens/min).[/bold green]"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write '# Scene Summary' sections into archived scenes.")
+    parser.add_argument("patterns", nargs="*", help="Scene file globs (default: Scenes/Finished/*.md)")
+    parser.add_argument("--concurrency", type=int, default=BULK_LLM_CONCURRENCY, help="Scenes summarized at the same time")
+    parser.add_argument("--workers", type=int, default=BULK_PARSE_WORKERS, help="Parsing/tokenizing processes")
+    parser.add_argument("--ctx", type=int, default=None, help="Model context length, if Ollama cannot report it")
+    parser.add_argument("--force", action="store_true", help="Also redo scenes that already have a Scene Summary")
+    args = parser.parse_args()
+    run(args.patterns, args.concurrency, args.workers, args.force, args.ctx)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# cassette.py
+import atexit
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from utils import LazyConsole
+
+console = LazyConsole()
+
+# Options that depend on runtime state rather than on the request itself
+UNKEYED_OPTIONS = ("num_ctx",)
+
+
+def request_key(model: str, messages: list[dict], options: dict | None) -> str:
+    """Stable hash of a chat request (model, messages, options)."""
+    keyed_options = {k: v for k, v in (options or {}).items() if k not in UNKEYED_OPTIONS}
+    payload = json.dumps(
+        {"model": model, "messages": messages, "options": keyed_options},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class Cassette:
+    """
+    Record / replay of Ollama chat traffic in a gzip'd JSONL file.
+
+    record: every request (model, messages, options) and response (content +
+            timing metadata) is appended as one line keyed by request hash.
+    replay: responses are served from the file. Identical requests are served
+            in recorded order; a request whose hash is unknown raises
+            CassetteMiss, or with strict=False falls back to the next
+            unconsumed recording (the replay is then no longer deterministic).
+            Hits and misses are reported at exit.
+    latency: "original" sleeps for the recorded wall time, "zero" returns at once.
+    """
+
+    def __init__(self, path: Path, mode: str, latency: str = "original", strict: bool = True):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._in_order = deque()
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+
+        if mode == "replay":
+            self._load()
+            atexit.register(self.report)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        console.print(f"[cyan][cassette] {mode} → {self.path}[/cyan]")
+
+    def _load(self):
+        if not self.path.exists():
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["_id"] = i
+                self._by_key.setdefault(entry["key"], deque()).append(entry)
+                self._in_order.append(entry)
+        console.print(f"[cyan][cassette] Loaded {len(self._in_order)} recorded response(s)[/cyan]")
+
+    def record(self, model: str, messages: list[dict], options: dict | None, response: dict):
+        entry = {
+            "key": request_key(model, messages, options),
+            "time": time.time(),
+            "request": {"model": model, "messages": messages, "options": options or {}},
+            "response": response,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            # Each append is its own gzip member; readers see one continuous stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+    def report(self):
+        if self.mode != "replay":
+            return
+        style = "yellow" if self.misses else "cyan"
+        console.print(f"[{style}][cassette] Replay: {self.hits} hit(s), {self.misses} miss(es)[/{style}]")
+
+    def replay(self, model: str, messages: list[dict], options: dict | None) -> dict:
+        key = request_key(model, messages, options)
+        with self._lock:
+            entry = None
+            queue = self._by_key.get(key)
+            while queue:
+                candidate = queue.popleft()
+                if candidate["_id"] not in self._used:
+                    entry = candidate
+                    break
+
+            if entry is None:
+                self.misses += 1
+                if self.strict:
+                    raise CassetteMiss(key)
+                while self._in_order and self._in_order[0]["_id"] in self._used:
+                    self._in_order.popleft()
+                if not self._in_order:
+                    raise CassetteMiss(key)
+                entry = self._in_order.popleft()
+                console.print(f"[yellow][cassette] No recording for request {key}, serving next in order[/yellow]")
+            else:
+                self.hits += 1
+            self._used.add(entry["_id"])
+
+        response = dict(entry["response"])
+        if self.latency == "original":
+            time.sleep(response.get("wall_time", 0.0))
+        return response
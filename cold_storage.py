@@ -0,0 +1,192 @@
+# cold_storage.py
+import gzip
+import hashlib
+import json
+import mmap
+import re
+import sys
+from pathlib import Path
+from utils import LazyConsole
+
+console = LazyConsole()
+
+COLD_MARKER_RE = re.compile(r"^<!--\s*cold:([0-9a-f]+)\s*-->$")
+turn_header_pattern = re.compile(r"^#{1,3}\s*Turn[: ]+\s*(\d+)", re.IGNORECASE)
+
+
+def sidecar_paths(scene_path: Path) -> tuple[Path, Path]:
+    """Compressed bodies file and its JSON offset index, next to the scene."""
+    return (
+        scene_path.with_name(scene_path.name + ".cold"),
+        scene_path.with_name(scene_path.name + ".cold.idx"),
+    )
+
+
+def cold_marker(body_id: str) -> str:
+    return f"<!-- cold:{body_id} -->"
+
+
+class ColdStore:
+    """
+    Append-only store of gzip-compressed turn bodies.
+    Each body is its own gzip member; the index maps body id -> [offset, length]
+    so a single body is read back with one memory-mapped range read.
+    """
+
+    def __init__(self, scene_path: Path):
+        self.scene_path = scene_path
+        self.data_path, self.index_path = sidecar_paths(scene_path)
+        self._index = None
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            if self.index_path.exists():
+                self._index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            else:
+                self._index = {}
+        return self._index
+
+    def put_many(self, bodies: list[str]) -> list[str]:
+        """Store bodies (deduplicated by content hash), returning their ids."""
+        ids = []
+        pending = []
+        for body in bodies:
+            body_id = hashlib.sha1(body.encode("utf-8")).hexdigest()[:16]
+            ids.append(body_id)
+            if body_id not in self.index and body_id not in (p[0] for p in pending):
+                pending.append((body_id, gzip.compress(body.encode("utf-8"))))
+
+        if pending:
+            with open(self.data_path, "ab") as f:
+                offset = f.tell()
+                for body_id, blob in pending:
+                    f.write(blob)
+                    self.index[body_id] = [offset, len(blob)]
+                    offset += len(blob)
+                f.flush()
+            self.index_path.write_text(json.dumps(self.index), encoding="utf-8")
+        return ids
+
+    def get_many(self, body_ids: list[str]) -> dict:
+        """Read several bodies through one mapping of the sidecar."""
+        found = {}
+        wanted = [i for i in body_ids if i in self.index]
+        if not wanted or not self.data_path.exists():
+            return found
+        with open(self.data_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for body_id in wanted:
+                offset, length = self.index[body_id]
+                found[body_id] = gzip.decompress(mm[offset:offset + length]).decode("utf-8")
+        return found
+
+    def get(self, body_id: str) -> str | None:
+        return self.get_many([body_id]).get(body_id)
+
+
+# ---------------------------------------------------------
+# Scene-level operations
+# ---------------------------------------------------------
+def _full_turn_bodies(lines: list[str], turns_to_keep: int) -> list[tuple[int, int]]:
+    """
+    (start, end) line ranges of '## Full Turn' bodies of summarized turns,
+    skipping the last `turns_to_keep` turns and bodies already in cold storage.
+    """
+    turn_starts = [i for i, line in enumerate(lines) if turn_header_pattern.match(line)]
+    if turns_to_keep:
+        turn_starts = turn_starts[:-turns_to_keep] if len(turn_starts) > turns_to_keep else []
+
+    ranges = []
+    for start in turn_starts:
+        end = next((i for i in range(start + 1, len(lines)) if turn_header_pattern.match(lines[i])), len(lines))
+        block = [l.strip().lower() for l in lines[start:end]]
+        if not any(l.startswith("## summary") for l in block):
+            continue
+        full = next((start + j for j, l in enumerate(block) if l.startswith("## full turn")), None)
+        if full is None:
+            continue
+        body_end = next((i for i in range(full + 1, end) if lines[i].lstrip().startswith("#")), end)
+        body = [l for l in lines[full + 1:body_end] if l.strip()]
+        if not body or (len(body) == 1 and COLD_MARKER_RE.match(body[0].strip())):
+            continue
+        ranges.append((full + 1, body_end))
+    return ranges
+
+
+def freeze_summarized_turns(scene_path: Path, turns_to_keep: int = 0) -> int:
+    """
+    Move full-turn bodies of summarized turns into the compressed sidecar,
+    leaving a cold marker in the scene. Returns the number of bodies moved.
+    """
+    if not scene_path or not scene_path.exists():
+        return 0
+
+    lines = scene_path.read_text(encoding="utf-8").splitlines()
+    ranges = _full_turn_bodies(lines, turns_to_keep)
+    if not ranges:
+        return 0
+
+    store = ColdStore(scene_path)
+    bodies = ["\n".join(lines[start:end]).strip("\n") for start, end in ranges]
+    ids = store.put_many(bodies)   # sidecar is written before the scene is shrunk
+
+    for (start, end), body_id in reversed(list(zip(ranges, ids))):
+        lines[start:end] = [cold_marker(body_id), ""]
+
+    scene_path.write_text("\n".join(lines), encoding="utf-8")
+    return len(ranges)
+
+
+def hydrate_lines(lines: list[str], scene_path: Path) -> list[str]:
+    """Replace cold markers with their stored bodies (only reads the sidecar if needed)."""
+    marker_ids = [m.group(1) for l in lines if (m := COLD_MARKER_RE.match(l.strip()))]
+    if not marker_ids:
+        return lines
+    bodies = ColdStore(scene_path).get_many(marker_ids)
+
+    out = []
+    for line in lines:
+        m = COLD_MARKER_RE.match(line.strip())
+        if m and m.group(1) in bodies:
+            out.extend(bodies[m.group(1)].splitlines())
+        else:
+            out.append(line)
+    return out
+
+
+def hydrate_scene_text(text: str, scene_path: Path) -> str:
+    """Full scene text with every cold body restored in place."""
+    if "<!-- cold:" not in text:
+        return text
+    return "\n".join(hydrate_lines(text.splitlines(), scene_path))
+
+
+def search_cold(scene_path: Path, query: str) -> list[dict]:
+    """Case-insensitive search through the cold bodies of a scene."""
+    store = ColdStore(scene_path)
+    needle = query.lower()
+    results = []
+    for body_id, body in store.get_many(list(store.index)).items():
+        for line in body.splitlines():
+            if needle in line.lower():
+                results.append({"id": body_id, "line": line.strip()})
+    return results
+
+
+def archive_scenes(paths: list[Path]) -> int:
+    """Apply the cold layout to finished scenes (every summarized turn is moved)."""
+    total = 0
+    for path in paths:
+        moved = freeze_summarized_turns(path, turns_to_keep=0)
+        if moved:
+            console.print(f"[green]Archived {moved} full turn(s) from {path.name}[/green]")
+        total += moved
+    return total
+
+
+if __name__ == "__main__":
+    # python cold_storage.py [scene files…] — defaults to every scene in Scenes/Finished
+    from config import scenes_finished_dir
+    targets = [Path(p) for p in sys.argv[1:]] or sorted(scenes_finished_dir.glob("*.md"))
+    count = archive_scenes(targets)
+    console.print(f"[bold green]{count} full turn(s) moved to cold storage.[/bold green]")
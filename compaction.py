@@ -0,0 +1,234 @@
+# compaction.py
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from utils import LazyConsole
+from sheets import parse_markdown_sheet, HEADER_RE
+
+console = LazyConsole()
+
+# Message classes whose text is instructions: markdown is stripped and
+# sentences already given by an earlier instruction block are dropped
+INSTRUCTION_CLASSES = ("system", "instructions", "submode", "group")
+# Message classes already rendered by PromptCompactor.sheet(), where their savings are counted
+PRE_COUNTED_CLASSES = ("sheet",)
+# Message classes that differ on every request: compacted each time, never cached
+UNCACHED_CLASSES = ("scene",)
+COMPACTION_CACHE_SIZE = 512     # compacted blocks kept (LRU): prompt files, sheet versions, group prompts
+
+EMPHASIS_RE = re.compile(r"(\*\*|__)(.+?)\1|(?<![\w*])([*_])(?!\s)(.+?)(?<!\s)\3(?![\w*])")
+RULE_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+BULLET_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+BOLD_LINE_RE = re.compile(r"^(\*\*|__)([^*_]+?)\1:?$")
+SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]*")
+MIN_DEDUPE_WORDS = 4            # shorter sentences ("Never apologize.") may repeat on purpose
+
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def normalize_whitespace(text: str) -> str:
+    """Trailing spaces, runs of spaces and blank lines removed."""
+    lines = [re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def strip_markdown(text: str) -> str:
+    """Headings become 'Title:' lines, emphasis / code markers and horizontal rules are dropped."""
+    out = []
+    for line in text.splitlines():
+        if RULE_RE.match(line):
+            continue
+        m = HEADER_RE.match(line.strip())
+        if m:
+            line = m.group(2)
+        line = EMPHASIS_RE.sub(lambda e: e.group(2) or e.group(4), line).replace("`", "")
+        if m and line.strip() and not line.rstrip().endswith(":"):
+            line = line.rstrip() + ":"
+        out.append(line)
+    return "\n".join(out)
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", sentence.lower()).split())
+
+
+def _join(values: list[str]) -> str:
+    """Sentences are joined with a space, list fragments with '; '."""
+    out = values[0]
+    for value in values[1:]:
+        out += (" " if out[-1] in ".!?" else "; ") + value
+    return out
+
+
+def dense_sheet(text: str) -> str:
+    """
+    Render a Markdown character sheet as dense 'Key: value; value' lines.
+    Headers and bold label lines ("**Tools of the Trade**") become keys, list
+    items and paragraphs under them are joined on a single line; a header
+    with no content of its own is kept as a bare 'Header:' line.
+    """
+    sheet = parse_markdown_sheet(Path("sheet"), text, 0)
+    out = []
+    header = None               # header not written yet
+    label = None
+    values = []
+
+    def flush():
+        nonlocal header
+        if label is not None:
+            if header is not None:
+                out.append(f"{header}:")
+                header = None
+            if values:
+                out.append(f"{label}: {_join(values)}")
+        elif values:
+            out.append(f"{header}: {_join(values)}" if header is not None else _join(values))
+            header = None
+        values.clear()
+
+    for entry in sheet.lines:
+        line = entry["line"]
+        if not line or RULE_RE.match(line):
+            continue
+        m = HEADER_RE.match(line)
+        if m:
+            flush()
+            if header is not None:
+                out.append(f"{header}:")
+            header = strip_markdown(m.group(2)).strip().rstrip(":")
+            label = None
+            continue
+        bold = BOLD_LINE_RE.match(line)
+        if bold:
+            flush()
+            label = bold.group(2).strip()
+            continue
+        item = strip_markdown(BULLET_RE.sub("", line)).strip()
+        if item:
+            values.append(item.rstrip(";"))
+    flush()
+    if header is not None:
+        out.append(f"{header}:")
+    return "\n".join(out)
+
+
+class PromptCompactor:
+    """
+    Compaction stage between PromptManager and the agent:
+      - whitespace normalized in every message
+      - markdown stripped from instruction blocks, and sentences repeated
+        from an earlier instruction block of the same request dropped
+      - sheets rendered in a dense key: value form (dense_sheet)
+    Results are cached by content hash (LRU), so unchanged prompt files and
+    sheet versions are compacted once; the scene, new on every request, is
+    not cached. Token savings are tracked per message class.
+    """
+
+    def __init__(self, count_tokens, cache_size: int = COMPACTION_CACHE_SIZE):
+        self.count_tokens = count_tokens
+        self.cache_size = cache_size
+        self._cache = OrderedDict()   # digest -> (text, tokens_before, tokens_after)
+        self._lock = threading.Lock()
+        self.stats = {}           # class -> {"messages", "before", "after"}
+
+    def _record(self, kind: str, before: int, after: int):
+        entry = self.stats.setdefault(kind, {"messages": 0, "before": 0, "after": 0})
+        entry["messages"] += 1
+        entry["before"] += before
+        entry["after"] += after
+
+    def _cached(self, key: str, original: str, build) -> tuple[str, int, int]:
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is None:
+            text = build()
+            cached = (text, self.count_tokens(original), self.count_tokens(text))
+            with self._lock:
+                self._cache[key] = cached
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return cached
+
+    def sheet(self, text: str, record: bool = True) -> str:
+        """Dense rendering of one sheet (counted under the 'sheet' class unless record is False)."""
+        if not text:
+            return text
+        dense, before, after = self._cached(_digest("sheet", text), text, lambda: dense_sheet(text))
+        if record:
+            self._record("sheet", before, after)
+        return dense
+
+    def compact(self, messages: list[dict], kinds: list[str], record: bool = True) -> list[dict]:
+        """
+        Compacted copy of messages; kinds gives the class of each message
+        (system, instructions, submode, group, sheet, scene…).
+        record=False only fills the cache (prewarming), savings are not counted.
+        """
+        seen = set()
+        compacted = []
+        for message, kind in zip(messages, kinds):
+            content = message.get("content", "")
+            if kind in INSTRUCTION_CLASSES:
+                # Dedupe depends on the blocks before this one
+                key = _digest(kind, content, *sorted(seen))
+                text, before, after = self._cached(key, content, lambda: self._instructions(content, seen))
+                seen.update(_sentence_key(s) for s in SENTENCE_RE.findall(text))
+            elif kind in UNCACHED_CLASSES:
+                text = normalize_whitespace(content)
+                before, after = self.count_tokens(content), self.count_tokens(text)
+            else:
+                text, before, after = self._cached(_digest(kind, content), content, lambda: normalize_whitespace(content))
+            if record and kind not in PRE_COUNTED_CLASSES:
+                self._record(kind, before, after)
+            compacted.append({**message, "content": text})
+        return compacted
+
+    @staticmethod
+    def _instructions(content: str, seen: set) -> str:
+        lines = []
+        for line in normalize_whitespace(strip_markdown(content)).splitlines():
+            kept = []
+            for sentence in SENTENCE_RE.findall(line):
+                key = _sentence_key(sentence)
+                if key and key in seen and len(key.split()) >= MIN_DEDUPE_WORDS:
+                    continue
+                kept.append(sentence.strip())
+            if any(kept):
+                lines.append(" ".join(kept))
+        return "\n".join(lines)
+
+    # ------------------------------------------------------------------
+    # Report
+    # ------------------------------------------------------------------
+    def report(self):
+        from rich.table import Table
+        if not self.stats:
+            console.print("[yellow]No prompt compacted yet.[/yellow]")
+            return
+
+        table = Table(title="Prompt compaction")
+        for col in ("Class", "Messages", "Tokens before", "Tokens after", "Saved", "Saved %"):
+            table.add_column(col, justify="left" if col == "Class" else "right")
+
+        total_before = total_after = 0
+        for kind, s in self.stats.items():
+            saved = s["before"] - s["after"]
+            total_before += s["before"]
+            total_after += s["after"]
+            table.add_row(kind, str(s["messages"]), str(s["before"]), str(s["after"]), str(saved),
+                          f"{saved / s['before']:.0%}" if s["before"] else "-")
+        saved = total_before - total_after
+        table.add_row("[bold]total[/bold]", "", str(total_before), str(total_after), str(saved),
+                      f"{saved / total_before:.0%}" if total_before else "-")
+        console.print(table)
+        console.print(f"[dim]{len(self._cache)} compacted block(s) cached[/dim]")
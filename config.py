@@ -1,5 +1,4 @@
 from pathlib import Path
-from rich import print as rprint
 
 DEFAULT_MODEL = "fluffy/l3-8b-stheno-v3.2"
 MODEL = "dolphin3:8b"           # optional, if you need both
@@ -7,22 +6,100 @@ CONTEXT_THRESHOLD = 0.4        # % of context for warnings and auto-summary (0-1
 SCENE_CONTEXT_THRESHOLD = 0.5 # % of context for scene summaries (0-1)
 AUTO_SUMMARIZE = True           # Automatically summarize when token usage is above context treshold
 TURNS_TO_KEEP = 3               # How many last turns to leave unsummarized
+ROLLUP_FACTOR = 5               # Turn summaries per level-1 roll-up, and roll-ups per next-level roll-up
+ROLLUP_MAX_LEVEL = 3            # Highest roll-up level built (5, 25, 125 turns with a factor of 5)
+HISTORY_TOKEN_BUDGET = 1500     # Tokens for summarized history in the prompt, older turns use coarser roll-ups past this
+MEMORIES_ON_END = False         # Generate one memory per active character after /end (also: /end m)
+MEMORY_MAX_WORKERS = 8          # Max concurrent LLM calls when generating memories
+PERSPECTIVE_FILTER = False      # Opt-in: single-character and fan-out prompts only get the turns the character was present in (/pov for savings)
+SUBMODE_SHEET_PROFILES = {      # Sheet sections sent per submode: headers with a "keep" word always (wins over "drop" below it), "drop" never, others up to "budget" tokens
+    "combat":      {"keep": ["attribute", "stat", "ability", "abilities", "skill", "saving", "combat", "attack", "weapon",
+                             "armor", "armour", "hit point", "hp", "spell", "spellcasting", "feature", "trait",
+                             "cliché", "cliche", "condition"],
+                    "drop": ["description", "backstory", "background", "personality", "appearance",
+                             "memory", "memories", "relationship", "goal", "note"],
+                    "budget": 500},
+    "exploration": {"keep": ["skill", "ability", "abilities", "inventory", "equipment", "gear", "tool", "feature", "trait", "cliché", "cliche"],
+                    "drop": ["backstory", "memory", "memories", "relationship"],
+                    "budget": 600},
+    "roleplay":    {"keep": ["description", "personality", "background", "backstory", "appearance", "goal",
+                             "relationship", "memory", "memories", "cliché", "cliche", "trait"],
+                    "drop": ["attribute", "saving", "attack", "weapon", "armor", "armour", "spell", "inventory", "equipment"],
+                    "budget": 600},
+    "fanout":      {"keep": ["description", "personality", "appearance", "cliché", "cliche", "trait", "memory", "memories"],
+                    "drop": ["attribute", "saving", "attack", "weapon", "armor", "armour", "spell", "inventory", "equipment"],
+                    "budget": 400},
+    "group":       {"keep": ["description", "personality", "cliché", "cliche", "trait"],
+                    "drop": ["saving", "inventory", "equipment", "memory", "memories", "backstory"],
+                    "budget": 300},
+}
+COMPACT_PROMPTS = True          # Strip markdown, dedupe instructions and send dense sheets to the LLM (/compact for savings)
+FANOUT_MAX_WORKERS = 4          # Max concurrent per-character requests in fan-out group mode (/gf), match OLLAMA_NUM_PARALLEL
+SHEET_FLUSH_DELAY = 2.0         # Seconds without sheet edits before pending stat changes are written to disk
+NUM_CTX_BUCKETS = [2048, 4096, 8192, 16384, 32768]  # Allowed num_ctx values, fewer values = fewer model reloads
+GENERATION_ALLOWANCE = 512      # Tokens reserved for the reply when sizing num_ctx
+GENERATION_PROFILES = {         # Ollama options of scene replies per submode (stop sequences are added from the roster)
+    "combat":      {"num_predict": 160, "temperature": 0.7},
+    "exploration": {"num_predict": 220, "temperature": 0.8},
+    "roleplay":    {"num_predict": 260, "temperature": 0.9},
+    "group":       {"num_predict": 420, "temperature": 0.85},
+    "fanout":      {"num_predict": 160, "temperature": 0.9},
+}
+UNPROFILED_REPLY_TOKENS = 400   # Typical length of a rambling reply without a profile, reference for /profiles savings
+REPETITION_MIN_PERIOD = 12      # Shortest repeated span (characters) treated as a degenerate loop
+REPETITION_MAX_PERIOD = 200     # Longest repeated span checked
+REPETITION_REPEATS = 3          # Back-to-back copies of a span that abort a streamed reply
+REPETITION_MIN_SPAN = 150       # ...and the characters those copies must cover (short shouts are not loops)
+KV_BYTES_PER_TOKEN = 131072     # KV cache per context token (Llama 3 8B, fp16: 2 x 32 layers x 8 heads x 128 dims x 2 bytes)
+COLD_STORAGE = True             # Move full text of summarized turns into a compressed sidecar next to the scene
+ASYNC_CONSOLE = True            # Local commands run during generation, LLM commands are queued, "!" cancels
+LLM_REQUEST_TIMEOUT = 300       # Seconds before a single LLM request is abandoned
+LLM_CONNECT_TIMEOUT = 5         # Seconds to reach the Ollama server before failing
+OLLAMA_HOSTS = ["http://localhost:11434"]  # Ollama servers with the same models; requests are load-balanced across them
+BACKEND_HEALTH_INTERVAL = 15.0  # Seconds between health checks of each Ollama host
+BROADCAST = False               # Serve the scene live to player viewers (browser, SSE) while the GM plays
+BROADCAST_HOST = "0.0.0.0"      # Interface the viewer page listens on ("127.0.0.1" for this machine only)
+BROADCAST_PORT = 8765           # Viewers open http://<GM machine>:8765/
+BROADCAST_QUEUE_SIZE = 256      # Events buffered per viewer; a viewer this far behind is dropped
+SNAPSHOT = True                 # Save session state next to the scene and resume from it on launch
+TOKEN_CACHE_SIZE = 50000        # Token counts remembered by content hash (also stored in the snapshot)
+FALLBACK_ENCODING = "cl100k_base"  # tiktoken encoding for models tiktoken does not know (all Ollama models)
+CASSETTE_MODE = None            # None, "record" or "replay" — record/replay all Ollama traffic
+CASSETTE_LATENCY = "original"   # Replay speed: "original" (recorded wall time) or "zero"
+CASSETTE_STRICT = True          # Replay: a request with no recording raises instead of taking the next one in order
+BULK_LLM_CONCURRENCY = 2        # bulk_summarize.py: scenes summarized at the same time (one LLM call in flight each)
+BULK_PARSE_WORKERS = None       # bulk_summarize.py: processes used to parse/tokenize scenes (None = CPU count)
+BAKEOFF_MODELS = [DEFAULT_MODEL, MODEL]  # bakeoff.py: models compared over Scenes/Finished
 HELP_LINES = [
     "/h                   - Show help",
-    "/r <dice>            - Roll dice",
+    "/r <dice>            - Roll dice (2d6+3, 4d6kh3, 2d20kl1, 3d6!, 2d8r1, 6x(4d6kh3))",
+    "/odds <dice> [>= n]  - Exact odds of a dice expression, optionally of beating a target (>=, >, <=, <, =)",
     "/c                   - Combat submode",
     "/e                   - Exploration submode",
     "/r                   - Roleplay submode",
     "/g                   - Group submode",
+    "/gf                  - Fan-out group submode: one concurrent request per character, replies merged from the active character on",
     "/s <n>               - Summarize scene. Optionally keep the last N turns unsummarized (default uses config value)",
     "try again <comment>  - Regenerate last LLM message (retry), optional comment is added to last user input as clarification for retries (cumulative)",
+    "/find <text>         - Search the active scene, including full turns in cold storage",
     "/ls                  - List characters",
+    "/stat <field> <n>    - Edit a number on the active sheet: +n / -n adjusts, =n sets (e.g. /stat HP -4)",
     "/n                   - Next character",
+    "/npc [text]          - Search the NPC library (all of Characters/) by name, alias or tag",
+    "/add <name>          - Add an NPC from the library to the active roster",
+    "/rm <name|n>         - Remove a character from the active roster",
     "/1 /2 /3             - Switch active character",
     "/t                   - Next turn",
     "*                    - Toggle auto-mode (when True, upon empty user input, switches to next character then sends)",
-    ".                    - Append GM text in scene file without summoning LLM"
-    "/end                 - End scene and launch a batched summary using full turn text (respecting scene context treshold)",
+    ".                    - Append GM text in scene file without summoning LLM",
+    "!  /  !k             - Cancel the generation in flight, discarding / keeping the partial output (async console)",
+    "/compact             - Tokens saved by prompt compaction, per message class",
+    "/backends            - Ollama hosts: health, loaded models, load, requests, errors, latency",
+    "/viewers             - Live scene viewers connected (BROADCAST) and viewers dropped for lagging",
+    "/pov                 - Scene tokens saved per character by the perspective filter",
+    "/profiles            - Generation profiles per submode: output tokens, capped replies, loops aborted, decode time saved",
+    "/perf                - LLM performance for this session: prefill vs decode speed, load stalls, trends",
+    "/end [m]             - End scene and launch a batched summary using full turn text (respecting scene context treshold), 'm' also writes character memories",
 ]
 # ---------------------------------------------------------
 # Vault folders
@@ -32,12 +109,24 @@ vault_root = BASE_DIR
 
 characters_root = vault_root / "Characters"
 characters_dir = characters_root / "Active"
+NPC_INDEX_PATH = characters_root / ".npc_index.json"   # NPC library index, refreshed by mtime
 
 scenes_root = vault_root / "Scenes"
 scenes_active_dir = scenes_root / "Active"
+scenes_finished_dir = scenes_root / "Finished"
 
 prompts_dir = vault_root / "Prompts"
 
+TOKENIZER_CACHE_DIR = vault_root / "Tokenizers"   # tiktoken BPE files, provisioned with tokenizer.py
+
+cassettes_dir = vault_root / "Cassettes"
+logs_dir = vault_root / "Logs"
+CASSETTE_PATH = cassettes_dir / "session.jsonl.gz"
+
+def rprint(*args, **kwargs):
+    from rich import print as rich_print   # imported on first message only
+    rich_print(*args, **kwargs)
+
 # ---------------------------------------------------------
 # Ensure required directories exist
 # ---------------------------------------------------------
@@ -1,29 +1,470 @@
+import math
 import re
-import random
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
 
 # ---------- Dice roller ----------
-DICE_RE = re.compile(r"(?P<count>\d*)d(?P<sides>\d+)(?P<mods>(?:[+-]\d+)*)")
-MOD_RE = re.compile(r"[+-]\d+")
+# Expressions are parsed once into a small AST (cached per expression string),
+# then rolled with batched NumPy sampling.
+#
+# Supported syntax:
+#   NdS          N dice with S sides (N defaults to 1, d% = d100)
+#   NdSkhK/klK   keep the K highest / lowest dice (k = kh)
+#   NdS!  NdS!T  exploding dice (reroll and add on S, or on >= T)
+#   NdSrT        reroll once any die <= T
+#   (...)        grouping, + and - between terms, integer constants
+#   Rx(expr)     repeat expr R times, one total per repetition
+MAX_EXPLOSIONS = 100
+TOKEN_RE = re.compile(r"\s*(?:(\d+)|(kh|kl|k|d%|d|r|!|x|\+|-|\(|\)))")
 
-def roll_dice(expr: str) -> dict:
-    expr = expr.replace(" ", "")
-    m = DICE_RE.match(expr)
-    if not m:
-        if expr.isdigit() or (expr.startswith("-") and expr[1:].isdigit()):
-            return {"rolls": [], "total": int(expr)}
-        parts = re.findall(r"[+-]?[^+-]+", expr)
-        total = 0
+
+class Const(NamedTuple):
+    value: int
+
+
+class Dice(NamedTuple):
+    count: int
+    sides: int
+    keep: tuple | None = None       # ("h", n) or ("l", n)
+    explode: int | None = None      # explode on rolls >= this value
+    reroll: int | None = None       # reroll once rolls <= this value
+
+
+class Sum(NamedTuple):
+    terms: tuple                    # ((sign, node), ...)
+
+
+class Repeat(NamedTuple):
+    times: int
+    node: tuple
+
+
+# ---------- Parsing ----------
+def _tokenize(expr: str) -> list:
+    tokens = []
+    pos = 0
+    expr = expr.strip().lower()
+    while pos < len(expr):
+        m = TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Invalid dice expression near: {expr[pos:]!r}")
+        tokens.append(int(m.group(1)) if m.group(1) else m.group(2))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def take_int(self, default=None):
+        if isinstance(self.peek(), int):
+            return self.take()
+        if default is None:
+            raise ValueError("Expected a number in dice expression")
+        return default
+
+    def parse(self):
+        node = self.expr()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected token in dice expression: {self.peek()!r}")
+        return node
+
+    def expr(self):
+        # Repeat prefix: "6x(4d6kh3)" or "6x4d6kh3"
+        if isinstance(self.peek(), int) and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1] == "x":
+            times = self.take()
+            self.take()
+            node = self.expr()
+            if isinstance(node, Repeat):
+                raise ValueError("Repeats cannot be nested")
+            return Repeat(times, node)
+
+        terms = []
+        sign = 1
+        if self.peek() in ("+", "-"):
+            sign = -1 if self.take() == "-" else 1
+        terms.append((sign, self.atom()))
+        while self.peek() in ("+", "-"):
+            sign = -1 if self.take() == "-" else 1
+            terms.append((sign, self.atom()))
+
+        if len(terms) == 1 and terms[0][0] == 1:
+            return terms[0][1]
+        return Sum(tuple(terms))
+
+    def atom(self):
+        tok = self.peek()
+        if tok == "(":
+            self.take()
+            node = self.expr()
+            if self.take() != ")":
+                raise ValueError("Unbalanced parentheses in dice expression")
+            if isinstance(node, Repeat):
+                raise ValueError("Repeats are only allowed at the start of an expression")
+            return node
+
+        if isinstance(tok, int):
+            count = self.take()
+        elif tok in ("d", "d%"):
+            count = 1
+        else:
+            raise ValueError(f"Unexpected token in dice expression: {tok!r}")
+        if self.peek() not in ("d", "d%"):
+            return Const(count)
+
+        if self.take() == "d%":
+            sides = 100
+        else:
+            sides = self.take_int()
+        if count < 1 or sides < 1:
+            raise ValueError("Dice need at least one die and one side")
+
+        keep = explode = reroll = None
+        while self.peek() in ("kh", "kl", "k", "!", "r"):
+            mod = self.take()
+            if mod in ("kh", "k"):
+                keep = ("h", min(self.take_int(default=1), count))
+            elif mod == "kl":
+                keep = ("l", min(self.take_int(default=1), count))
+            elif mod == "!":
+                explode = self.take_int(default=sides)
+                if explode <= 1:
+                    raise ValueError("Exploding threshold must be above 1")
+            else:
+                reroll = self.take_int()
+                if reroll >= sides:
+                    raise ValueError("Reroll threshold must be below the number of sides")
+        return Dice(count, sides, keep, explode, reroll)
+
+
+@lru_cache(maxsize=512)
+def parse_dice(expr: str):
+    """Parse a dice expression into its AST (cached per expression string)."""
+    return _Parser(_tokenize(expr)).parse()
+
+
+# ---------- Rolling ----------
+_rng = None
+
+
+def get_rng() -> np.random.Generator:
+    global _rng
+    if _rng is None:
+        _rng = np.random.default_rng()
+    return _rng
+
+
+def set_seed(seed: int | None):
+    """Reseed the shared generator (None = fresh OS entropy)."""
+    global _rng
+    _rng = np.random.default_rng(seed)
+
+
+def _roll_dice_node(node: Dice, n: int, rng: np.random.Generator):
+    """
+    Roll n independent instances of a Dice node.
+    Returns (totals[n], die_values[n, count], kept_mask[n, count]).
+    """
+    values = rng.integers(1, node.sides + 1, size=(n, node.count))
+
+    if node.reroll is not None:
+        mask = values <= node.reroll
+        values[mask] = rng.integers(1, node.sides + 1, size=int(mask.sum()))
+
+    if node.explode is not None:
+        exploding = values >= node.explode
+        for _ in range(MAX_EXPLOSIONS):
+            if not exploding.any():
+                break
+            extra = rng.integers(1, node.sides + 1, size=int(exploding.sum()))
+            values[exploding] += extra
+            # Only dice whose latest extra roll exploded keep going
+            still = np.zeros_like(exploding)
+            still[exploding] = extra >= node.explode
+            exploding = still
+
+    kept = np.ones(values.shape, dtype=bool)
+    if node.keep:
+        direction, k = node.keep
+        order = np.argsort(values, axis=1, kind="stable")
+        drop = order[:, : node.count - k] if direction == "h" else order[:, k:]
+        np.put_along_axis(kept, drop, False, axis=1)
+
+    totals = np.where(kept, values, 0).sum(axis=1)
+    return totals, values, kept
+
+
+def _roll_totals(node, n: int, rng: np.random.Generator) -> np.ndarray:
+    if isinstance(node, Const):
+        return np.full(n, node.value, dtype=np.int64)
+    if isinstance(node, Dice):
+        return _roll_dice_node(node, n, rng)[0]
+    if isinstance(node, Sum):
+        totals = np.zeros(n, dtype=np.int64)
+        for sign, term in node.terms:
+            totals += sign * _roll_totals(term, n, rng)
+        return totals
+    if isinstance(node, Repeat):
+        return _roll_totals(node.node, n * node.times, rng).reshape(n, node.times)
+    raise TypeError(f"Unknown dice node: {node!r}")
+
+
+def roll_bulk(expr: str, n: int, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Roll an expression n times in one batched call.
+    Returns totals with shape (n,), or (n, times) for a repeat expression.
+    """
+    return _roll_totals(parse_dice(expr), n, rng or get_rng())
+
+
+def _roll_detail(node, rng: np.random.Generator) -> dict:
+    if isinstance(node, Const):
+        return {"rolls": [], "total": node.value}
+    if isinstance(node, Dice):
+        totals, values, kept = _roll_dice_node(node, 1, rng)
+        result = {"rolls": values[0].tolist(), "total": int(totals[0])}
+        if node.keep:
+            result["kept"] = values[0][kept[0]].tolist()
+        return result
+    if isinstance(node, Sum):
         breakdown = []
-        for p in parts:
-            part = roll_dice(p)
+        total = 0
+        for sign, term in node.terms:
+            part = _roll_detail(term, rng)
+            if sign < 0:
+                part["total"] = -part["total"]
             breakdown.append(part)
             total += part["total"]
-        return {"breakdown": breakdown, "total": total}
+        rolls = [r for part in breakdown for r in part["rolls"]]
+        return {"rolls": rolls, "breakdown": breakdown, "total": total}
+    if isinstance(node, Repeat):
+        totals = _roll_totals(node.node, node.times, rng).tolist()
+        return {"rolls": [], "totals": totals, "total": sum(totals)}
+    raise TypeError(f"Unknown dice node: {node!r}")
+
+
+def roll_dice(expr: str) -> dict:
+    return _roll_detail(parse_dice(expr), get_rng())
+
+
+# ---------- Exact distributions ----------
+# A distribution is (offset, probs) with probs[i] = P(total == offset + i).
+# Sub-expression results are memoized on the (hashable) AST nodes.
+FFT_CONVOLVE_MIN = 1 << 20      # switch to FFT convolution above this many products
+EXPLODE_TAIL = 1e-12            # stop unrolling explosions below this probability
+COMPARISONS = {
+    ">=": lambda totals, t: totals >= t,
+    ">": lambda totals, t: totals > t,
+    "<=": lambda totals, t: totals <= t,
+    "<": lambda totals, t: totals < t,
+    "=": lambda totals, t: totals == t,
+}
+
+
+def _convolve(a: tuple, b: tuple) -> tuple:
+    (oa, pa), (ob, pb) = a, b
+    if len(pa) * len(pb) < FFT_CONVOLVE_MIN:
+        probs = np.convolve(pa, pb)
+    else:
+        n = len(pa) + len(pb) - 1
+        size = 1 << (n - 1).bit_length()
+        probs = np.fft.irfft(np.fft.rfft(pa, size) * np.fft.rfft(pb, size), size)[:n]
+        # Drop floating point noise left by the transform
+        probs[probs < 1e-16 * probs.max()] = 0.0
+    return oa + ob, probs
+
+
+def _power(dist: tuple, n: int) -> tuple:
+    """Distribution of the sum of n independent copies (repeated squaring)."""
+    result = (0, np.ones(1))
+    while n:
+        if n & 1:
+            result = _convolve(result, dist)
+        n >>= 1
+        if n:
+            dist = _convolve(dist, dist)
+    return result
+
+
+def _shift(probs: np.ndarray, s: int, length: int) -> np.ndarray:
+    out = np.zeros(length)
+    out[s:s + len(probs)] = probs[: max(0, length - s)]
+    return out
+
+
+def _die_distribution(node: Dice) -> tuple:
+    """Distribution of a single die with its reroll / explode rules (values start at 1)."""
+    sides = node.sides
+    uniform = np.full(sides, 1.0 / sides)
+
+    # First roll after an optional single reroll
+    first = uniform.copy()
+    if node.reroll is not None:
+        first[: node.reroll] = 0.0
+        first += (node.reroll / sides) * uniform
+
+    if node.explode is None:
+        return 1, first
+
+    # Continuation after an explosion: a plain exploding die, unrolled until the tail is negligible
+    t = node.explode
+    p_explode = (sides - t + 1) / sides
+    depth = 1
+    while p_explode ** depth > EXPLODE_TAIL and depth < MAX_EXPLOSIONS:
+        depth += 1
+
+    cont = uniform.copy()       # values 1..sides at index value-1
+    for _ in range(depth):
+        length = sides * (depth + 1)
+        nxt = np.zeros(length)
+        nxt[: t - 1] = uniform[: t - 1]
+        for face in range(t, sides + 1):
+            nxt += (1.0 / sides) * _shift(cont, face, length)
+        cont = nxt
+
+    length = len(cont) + sides
+    die = np.zeros(length)
+    die[: t - 1] = first[: t - 1]
+    for face in range(t, sides + 1):
+        die += first[face - 1] * _shift(cont, face, length)
+    return 1, np.trim_zeros(die, "b")
+
+
+def _keep_distribution(die: tuple, count: int, keep: tuple) -> tuple:
+    """
+    Exact distribution of the sum of the kept dice.
+    Faces are visited from the kept end; each step decides how many of the
+    remaining dice show that face, so the state is just the number of dice left.
+    """
+    direction, k = keep
+    offset, probs = die
+    if k <= 0:
+        return 0, np.ones(1)
+
+    support = [(offset + i, float(p)) for i, p in enumerate(probs) if p > 0]
+    if direction == "h":
+        support.reverse()
+
+    length = k * support[0][0] + 1 if direction == "h" else k * support[-1][0] + 1
+    states = {count: np.zeros(length)}
+    states[count][0] = 1.0
+    done = np.zeros(length)
+    remaining_mass = sum(p for _, p in support)
+
+    for i, (value, p) in enumerate(support):
+        q = 1.0 if i == len(support) - 1 else min(1.0, p / remaining_mass)
+        remaining_mass -= p
+        new_states = {}
+        for left, pmf in states.items():
+            kept_so_far = count - left
+            for c in range(left + 1):
+                weight = math.comb(left, c) * q ** c * (1 - q) ** (left - c)
+                if weight == 0.0:
+                    continue
+                newly = min(c, k - kept_so_far)
+                shifted = weight * _shift(pmf, newly * value, length)
+                if kept_so_far + newly >= k:
+                    done += shifted
+                else:
+                    new_states[left - c] = new_states.get(left - c, 0) + shifted
+        states = new_states
+        if not states:
+            break
+
+    return 0, done
+
+
+@lru_cache(maxsize=256)
+def _distribution(node) -> tuple:
+    if isinstance(node, Const):
+        dist = (node.value, np.ones(1))
+    elif isinstance(node, Dice):
+        die = _die_distribution(node)
+        if node.keep and node.keep[1] < node.count:
+            dist = _keep_distribution(die, node.count, node.keep)
+        else:
+            dist = _power(die, node.count)
+    elif isinstance(node, Sum):
+        dist = (0, np.ones(1))
+        for sign, term in node.terms:
+            offset, probs = _distribution(term)
+            if sign < 0:
+                offset, probs = -(offset + len(probs) - 1), probs[::-1]
+            dist = _convolve(dist, (offset, probs))
+    elif isinstance(node, Repeat):
+        # Each repetition is independent; the distribution is per repetition
+        dist = _distribution(node.node)
+    else:
+        raise TypeError(f"Unknown dice node: {node!r}")
+
+    offset, probs = dist
+    nonzero = np.flatnonzero(probs > 0)
+    probs = np.array(probs[nonzero[0]: nonzero[-1] + 1]) if len(nonzero) else np.ones(1)
+    probs /= probs.sum()
+    probs.setflags(write=False)
+    return offset + (int(nonzero[0]) if len(nonzero) else 0), probs
+
+
+def _bounds(node) -> tuple:
+    """Smallest and largest possible totals (None = unbounded, for exploding dice)."""
+    if isinstance(node, Const):
+        return node.value, node.value
+    if isinstance(node, Dice):
+        kept = node.keep[1] if node.keep else node.count
+        return kept, None if node.explode is not None else kept * node.sides
+    if isinstance(node, Sum):
+        low = high = 0
+        for sign, term in node.terms:
+            t_low, t_high = _bounds(term)
+            if sign < 0:
+                t_low, t_high = (-t_high if t_high is not None else None), -t_low
+            low = None if low is None or t_low is None else low + t_low
+            high = None if high is None or t_high is None else high + t_high
+        return low, high
+    if isinstance(node, Repeat):
+        return _bounds(node.node)
+    raise TypeError(f"Unknown dice node: {node!r}")
+
+
+def dice_distribution(expr: str) -> tuple[int, np.ndarray]:
+    """
+    Exact outcome distribution of an expression: (offset, probs) with
+    probs[i] = P(total == offset + i). For a repeat, the distribution of one repetition.
+    """
+    return _distribution(parse_dice(expr))
 
-    count = int(m.group("count") or 1)
-    sides = int(m.group("sides"))
-    mods = m.group("mods") or ""
 
-    rolls = [random.randint(1, sides) for _ in range(count)]
-    mod_total = sum(int(x) for x in MOD_RE.findall(mods)) if mods else 0
-    return {"rolls": rolls, "total": sum(rolls) + mod_total}
\ No newline at end of file
+def dice_odds(expr: str, op: str = None, target: int = None) -> dict:
+    """Summary statistics of an expression, plus P(total <op> target) when given."""
+    node = parse_dice(expr)
+    offset, probs = _distribution(node)
+    totals = np.arange(offset, offset + len(probs))
+    mean = float((totals * probs).sum())
+    low, high = _bounds(node)
+    result = {
+        "min": low,
+        "max": high,
+        "mean": mean,
+        "stdev": float(np.sqrt((((totals - mean) ** 2) * probs).sum())),
+        "repeat": node.times if isinstance(node, Repeat) else None,
+    }
+    if op is not None:
+        if op not in COMPARISONS:
+            raise ValueError(f"Unknown comparison: {op}")
+        p = float(probs[COMPARISONS[op](totals, target)].sum())
+        result["probability"] = p
+        if result["repeat"]:
+            result["expected_successes"] = p * node.times
+            result["p_any"] = 1.0 - (1.0 - p) ** node.times
+    return result
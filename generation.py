@@ -0,0 +1,152 @@
+# generation.py
+import re
+from utils import LazyConsole
+from config import (
+    GENERATION_PROFILES, UNPROFILED_REPLY_TOKENS,
+    REPETITION_MIN_PERIOD, REPETITION_MAX_PERIOD, REPETITION_REPEATS, REPETITION_MIN_SPAN,
+)
+
+console = LazyConsole()
+
+GM_PREFIXES = ("GM :", "GM:")
+CUT_REASONS = ("length", "repetition")      # done_reason of replies the profile cut short
+
+
+# ---------------------------------------------------------
+# Profiles
+# ---------------------------------------------------------
+def stop_sequences(speaker: str | None, roster: list[str]) -> list[str]:
+    """
+    Line starts the model must not write: the GM, and every other character
+    (group replies speak for the whole roster, so only the GM stops them).
+    """
+    names = [] if speaker in (None, "Group") else [n for n in roster if n != speaker]
+    return [f"\n{prefix}" for prefix in GM_PREFIXES] + [f"\n{name}{sep}" for name in names for sep in (" :", ":")]
+
+
+def generation_options(submode: str, speaker: str | None, roster: list[str]) -> dict:
+    """Ollama options of a scene reply: the submode profile plus its stop sequences."""
+    profile = GENERATION_PROFILES.get(submode)
+    if not profile:
+        return {}
+    return {**profile, "stop": stop_sequences(speaker, roster)}
+
+
+def trim_foreign_lines(response: str, speaker: str, roster: list[str]) -> str:
+    """
+    Drop everything from the first line written for the GM or another character
+    (the server-side stop sequences miss variants like extra spaces or bold names).
+    """
+    others = [] if speaker == "Group" else [n for n in roster if n != speaker]
+    pattern = re.compile(
+        rf"^\**\s*(?:GM|{'|'.join(re.escape(n) for n in others)})\s*\**\s*:" if others else r"^\**\s*GM\s*\**\s*:"
+    )
+    lines = response.splitlines()
+    for i, line in enumerate(lines[1:], start=1):
+        if pattern.match(line.strip()):
+            return "\n".join(lines[:i]).rstrip()
+    return response
+
+
+# ---------------------------------------------------------
+# Degenerate loops
+# ---------------------------------------------------------
+class RepetitionDetector:
+    """
+    Watches a streamed reply for a loop: the same span of text (between
+    REPETITION_MIN_PERIOD and REPETITION_MAX_PERIOD characters) repeated back
+    to back at the end of the output, at least REPETITION_REPEATS times and
+    over at least REPETITION_MIN_SPAN characters (so a shouted "MILK-BOLT!"
+    three times is not a loop, a sentence said three times is).
+    After feed() returns True, `cut` is the length of the output to keep:
+    everything up to the end of the first copy.
+    """
+
+    def __init__(self, min_period: int = REPETITION_MIN_PERIOD, max_period: int = REPETITION_MAX_PERIOD,
+                 repeats: int = REPETITION_REPEATS, min_span: int = REPETITION_MIN_SPAN):
+        self.min_period = min_period
+        self.max_period = max_period
+        self.repeats = repeats
+        self.min_span = min_span
+        self.text = ""
+        self.cut = None
+
+    def _copies(self, period: int) -> int:
+        return max(self.repeats, -(-self.min_span // period))
+
+    def feed(self, chunk: str) -> bool:
+        self.text += chunk
+        if self.cut is not None:
+            return True
+        text = self.text
+        for period in range(self.min_period, self.max_period + 1):
+            copies = self._copies(period)
+            if copies * period > len(text):
+                break
+            if text[-1] != text[-1 - period]:      # cheap reject before comparing whole copies
+                continue
+            unit = text[-period:]
+            if not unit.strip():
+                continue
+            if all(text[len(text) - (k + 1) * period:len(text) - k * period] == unit for k in range(1, copies)):
+                # Start of the loop: whole copies first, then characters (the loop rarely starts on a copy boundary)
+                start = len(text) - copies * period
+                while start >= period and text[start - period:start] == unit:
+                    start -= period
+                while start > 0 and text[start - 1] == text[start - 1 + period]:
+                    start -= 1
+                self.cut = start + period
+                return True
+        return False
+
+    def scan(self, text: str, step: int = 16) -> bool:
+        """Check a complete reply as if it had been streamed in `step`-character chunks."""
+        return any(self.feed(text[i:i + step]) for i in range(0, len(text), step))
+
+
+# ---------------------------------------------------------
+# Report
+# ---------------------------------------------------------
+def profile_report(records: list[dict]):
+    """
+    Per-submode output of profiled replies, and decode time saved.
+    Saved time is only counted for replies the profile cut (num_predict cap or
+    repetition abort): the tokens they would have gone on to, up to
+    UNPROFILED_REPLY_TOKENS, at the reply's own decode speed.
+    Replies ended by a stop sequence are not counted, so this is a lower bound.
+    """
+    from rich.table import Table
+    rows = {}
+    for r in records:
+        if r.get("submode") in GENERATION_PROFILES and r["task"] in ("roleplay", "group", "fanout"):
+            rows.setdefault(r["submode"], []).append(r)
+    if not rows:
+        console.print("[yellow]No profiled reply yet.[/yellow]")
+        return
+
+    table = Table(title=f"Generation profiles (reference: {UNPROFILED_REPLY_TOKENS} tokens unprofiled)")
+    for col in ("Submode", "num_predict", "Replies", "Avg out tok", "Capped", "Loops aborted", "Decode s", "Saved s"):
+        table.add_column(col, justify="left" if col == "Submode" else "right")
+
+    total_saved = 0.0
+    for submode, calls in rows.items():
+        decode = sum((r["eval_duration"] or 0) for r in calls) / 1e9
+        saved = 0.0
+        for r in calls:
+            if r.get("done_reason") in CUT_REASONS and r["eval_count"] and r["eval_duration"]:
+                per_token = r["eval_duration"] / 1e9 / r["eval_count"]
+                saved += max(0, UNPROFILED_REPLY_TOKENS - r["eval_count"]) * per_token
+        total_saved += saved
+        out = [r["eval_count"] for r in calls if r["eval_count"]]
+        table.add_row(
+            submode,
+            str(GENERATION_PROFILES[submode].get("num_predict", "-")),
+            str(len(calls)),
+            f"{sum(out) / len(out):.0f}" if out else "-",
+            str(sum(1 for r in calls if r.get("done_reason") == "length")),
+            str(sum(1 for r in calls if r.get("done_reason") == "repetition")),
+            f"{decode:.1f}",
+            f"{saved:.1f}",
+        )
+    console.print(table)
+    console.print(f"Decode time saved this session: at least {total_saved:.1f}s")
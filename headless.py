@@ -0,0 +1,257 @@
+# headless.py
+"""
+Scripted, non-interactive GM session.
+
+    python headless.py session.gm                   # run a script against the active scene
+    python headless.py session.gm --sequential      # one command at a time, no pipelining
+    python headless.py session.gm --out Logs/run.json
+
+A script holds console lines, one per line, in the console syntax
+(GM messages, ". narration", /t, /s 2, /n, /c, /gf, try again …, /end m).
+Blank lines and lines starting with '#' are skipped; a line holding only
+'~' is an empty input (the GM says nothing: next reply, or next character
+in auto mode). '!' and '!k' have nothing to cancel here and are skipped.
+
+Every line goes through GMInterface.handle_command in script order, and the
+session snapshot is saved after each one, exactly as in the console. While a
+command runs:
+  - the prompt caches of the next GM message are filled (GMInterface.prewarm),
+    unless a command between them changes the speaker, submode or roster
+  - dice rolls and odds further down the script run at once: they neither
+    read nor change the session
+
+Per command: latency, LLM calls, prompt and generated tokens, prewarm time.
+For the run: wall time, commands per minute, generated tokens per second and
+the time saved by overlapping. Printed as a table and written to
+Logs/headless-<time>.json.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from utils import LazyConsole
+from config import logs_dir
+from async_console import is_local_command, CANCEL_DISCARD, CANCEL_KEEP
+from ollama_ttrpg_agent import create_interface
+
+console = LazyConsole()
+
+EMPTY_INPUT = "~"
+INDEPENDENT_PREFIXES = ("/r ", "/odds ")     # commands that neither read nor change the session
+
+
+def load_script(path: Path) -> list[str]:
+    lines = []
+    for number, raw in enumerate(path.read_text(encoding="utf-8").splitlines(), start=1):
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line in (CANCEL_DISCARD, CANCEL_KEEP):
+            console.print(f"[yellow]Line {number}: '{line}' has nothing to cancel in a script, skipped.[/yellow]")
+            continue
+        lines.append("" if line == EMPTY_INPUT else line)
+    return lines
+
+
+def is_independent(line: str) -> bool:
+    return line.startswith(INDEPENDENT_PREFIXES)
+
+
+def is_retry(line: str) -> bool:
+    return line.lower().startswith("try again") or line == "/p" or line.startswith("/p ")
+
+
+def sends_message(line: str) -> bool:
+    """A GM message (or empty input): the reply prompt is built from the current speaker and submode."""
+    return not (line.startswith(("/", ".")) or line == "*" or is_retry(line))
+
+
+def kind_of(line: str) -> str:
+    """
+    independent: runs at any time; message / retry: only appends a reply, so
+    the lines after it can be prepared meanwhile; local / command: changes
+    the session (scene, speaker, submode, roster, sheets) or reports on it.
+    """
+    if is_independent(line):
+        return "independent"
+    if sends_message(line):
+        return "message"
+    if is_retry(line):
+        return "retry"
+    return "local" if is_local_command(line) else "command"
+
+
+# ---------------------------------------------------------
+# Runner
+# ---------------------------------------------------------
+class ScriptRunner:
+    """
+    Runs script lines through one GMInterface, in order. With pipelining,
+    a GM message or retry runs in a worker thread, and meanwhile the lines
+    after it are looked at: independent ones start at once, and the next GM
+    message gets its prompt caches prewarmed. The lookahead stops at the
+    first line that changes the session; other commands run one at a time.
+    """
+
+    def __init__(self, gm, pipeline: bool = True):
+        self.gm = gm
+        self.pipeline = pipeline
+        self.records = []
+        self.origin = None
+
+    def _record(self, index: int, line: str) -> dict:
+        return {
+            "index": index + 1,
+            "line": line,
+            "kind": kind_of(line),
+            "start_s": None,
+            "wall_s": None,
+            "llm_calls": 0,
+            "prompt_tokens": 0,
+            "eval_tokens": 0,
+            "prewarm_s": None,
+            "overlapped": False,
+            "error": None,
+        }
+
+    def _execute(self, record: dict):
+        """Run one line and fill its timings and LLM usage (perf records it produced)."""
+        perf = self.gm.agent.perf.records
+        before = len(perf)
+        started = time.perf_counter()
+        record["start_s"] = started - self.origin
+        try:
+            self.gm.handle_command(record["line"])
+        except Exception as e:
+            record["error"] = str(e)
+            console.print(f"[red]Command failed: {e}[/red]")
+        finally:
+            record["wall_s"] = time.perf_counter() - started
+        if record["kind"] != "independent":
+            calls = perf[before:]
+            record["llm_calls"] = len(calls)
+            record["prompt_tokens"] = sum(r["prompt_eval_count"] or 0 for r in calls)
+            record["eval_tokens"] = sum(r["eval_count"] or 0 for r in calls)
+
+    def _look_ahead(self, start: int, lines: list[str], advance_auto: bool, side: ThreadPoolExecutor, early: dict):
+        """Start the independent lines after a running command and prewarm the next GM message."""
+        for j in range(start, len(lines)):
+            record = self.records[j]
+            if record["kind"] == "independent":
+                record["overlapped"] = True
+                early[j] = side.submit(self._execute, record)
+                continue
+            if record["kind"] == "message":
+                started = time.perf_counter()
+                try:
+                    self.gm.prewarm(advance=advance_auto and lines[j] == "")
+                except Exception as e:
+                    console.print(f"[yellow]Prewarm failed: {e}[/yellow]")
+                record["prewarm_s"] = time.perf_counter() - started
+            return
+
+    def run(self, lines: list[str]) -> list[dict]:
+        self.records = [self._record(i, line) for i, line in enumerate(lines)]
+        self.origin = time.perf_counter()
+        early = {}                         # script index -> future of a line started ahead
+
+        with ThreadPoolExecutor(max_workers=1) as worker, ThreadPoolExecutor(max_workers=2) as side:
+            for i, record in enumerate(self.records):
+                if i in early:
+                    continue
+                console.print(f"[bold cyan]>>> {record['line'] or EMPTY_INPUT}[/bold cyan]")
+                if self.pipeline and record["kind"] in ("message", "retry"):
+                    future = worker.submit(self._execute, record)
+                    self._look_ahead(i + 1, lines, self.gm.auto_mode, side, early)
+                    future.result()
+                else:
+                    self._execute(record)
+                self.gm.save_session()
+            for future in early.values():
+                future.result()
+        return self.records
+
+
+# ---------------------------------------------------------
+# Report
+# ---------------------------------------------------------
+def summarize(records: list[dict], wall: float) -> dict:
+    eval_tokens = sum(r["eval_tokens"] for r in records)
+    latency = sum(r["wall_s"] or 0 for r in records)
+    return {
+        "commands": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "wall_s": wall,
+        "latency_sum_s": latency,
+        "overlap_saved_s": max(0.0, latency - wall),
+        "commands_per_min": len(records) / wall * 60 if wall else None,
+        "llm_calls": sum(r["llm_calls"] for r in records),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+        "eval_tokens": eval_tokens,
+        "eval_tokens_per_s": eval_tokens / wall if wall else None,
+        "prewarm_s": sum(r["prewarm_s"] or 0 for r in records),
+    }
+
+
+def print_report(records: list[dict], summary: dict):
+    from rich.table import Table
+    table = Table(title="Headless run")
+    for col in ("#", "Command", "Kind", "Latency s", "LLM calls", "Prompt tok", "Gen tok", "Prewarm ms"):
+        table.add_column(col, justify="left" if col in ("Command", "Kind") else "right")
+    for r in records:
+        line = r["line"] or EMPTY_INPUT
+        table.add_row(
+            str(r["index"]),
+            (line[:40] + "…" if len(line) > 41 else line) + (" [red](failed)[/red]" if r["error"] else ""),
+            r["kind"] + (" ∥" if r["overlapped"] else ""),
+            f"{r['wall_s']:.2f}" if r["wall_s"] is not None else "-",
+            str(r["llm_calls"]),
+            str(r["prompt_tokens"]),
+            str(r["eval_tokens"]),
+            f"{r['prewarm_s'] * 1000:.0f}" if r["prewarm_s"] is not None else "-",
+        )
+    console.print(table)
+    rate = summary["eval_tokens_per_s"]
+    console.print(
+        f"{summary['commands']} command(s) in {summary['wall_s']:.1f}s "
+        f"({summary['commands_per_min']:.1f}/min), {summary['llm_calls']} LLM call(s), "
+        f"{summary['eval_tokens']} generated tokens ({rate:.1f} tok/s overall). "
+        f"Overlap saved {summary['overlap_saved_s']:.2f}s, prewarming took {summary['prewarm_s'] * 1000:.0f} ms."
+        + (f" [red]{summary['errors']} failed.[/red]" if summary["errors"] else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a script of GM console lines without the interactive console.")
+    parser.add_argument("script", type=Path, help="Script file: one console line per line")
+    parser.add_argument("--sequential", action="store_true", help="No pipelining: one command at a time")
+    parser.add_argument("--out", type=Path, default=None, help="JSON results file (default: Logs/headless-<time>.json)")
+    args = parser.parse_args()
+
+    lines = load_script(args.script)
+    if not lines:
+        console.print("[yellow]Empty script.[/yellow]")
+        return
+
+    gm = create_interface()
+    started = time.perf_counter()
+    records = ScriptRunner(gm, pipeline=not args.sequential).run(lines)
+    summary = summarize(records, time.perf_counter() - started)
+    print_report(records, summary)
+
+    out = args.out or logs_dir / f"headless-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({
+        "time": time.time(),
+        "script": str(args.script),
+        "pipeline": not args.sequential,
+        "summary": summary,
+        "commands": records,
+    }, indent=2, ensure_ascii=False), encoding="utf-8")
+    console.print(f"[dim]Results: {out}[/dim]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# npc_library.py
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from utils import LazyConsole
+from sheets import render_json_sheet
+
+console = LazyConsole()
+
+INDEX_VERSION = 1
+SHEET_SUFFIXES = (".md", ".json")
+
+FIELD_RE = re.compile(r"^\s*-?\s*([A-Za-z][A-Za-z ]*?)\s*:\s*(.+?)\s*$")   # matched with * and _ stripped
+ALIAS_FIELDS = ("name", "alias", "aliases", "nickname", "nicknames", "aka")
+TAG_FIELDS = ("tags", "race", "class", "role", "faction", "background")
+
+
+def _split_values(value) -> list[str]:
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in re.split(r"[,;/]", str(value)) if v.strip()]
+
+
+def read_sheet(path: Path) -> tuple[str, list[str], list[str]]:
+    """
+    Prompt text, aliases and tags of a sheet, without parsing it into the SheetStore.
+    Markdown: "- **Name:** …", "Aliases:", "Tags:", "Race:", "Class:"… lines.
+    JSON: the same keys at the top level.
+    """
+    text = path.read_text(encoding="utf-8")
+    aliases, tags = [], []
+    if path.suffix.lower() == ".json":
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            data = {}
+        text = "\n".join(render_json_sheet(data)[0])
+        fields = data.items()
+    else:
+        fields = [
+            (m.group(1), m.group(2)) for line in text.splitlines()
+            if (m := FIELD_RE.match(line.replace("*", "").replace("_", "")))
+        ]
+
+    for key, value in fields:
+        key = str(key).strip().lower()
+        if isinstance(value, (dict, int, float, bool)) or value is None:
+            continue
+        if key in ALIAS_FIELDS:
+            aliases += _split_values(value)
+        elif key in TAG_FIELDS:
+            tags += [v.lower() for v in _split_values(value)]
+
+    # A multi-word name is also known by its first word ("Blorg")
+    first = path.stem.split()[0] if " " in path.stem else None
+    if first:
+        aliases.append(first)
+    aliases = [a for a in dict.fromkeys(aliases) if a.lower() != path.stem.lower()]
+    return text.strip(), aliases, list(dict.fromkeys(tags))
+
+
+class NpcLibrary:
+    """
+    Index of every character sheet under Characters/ (Markdown and JSON):
+    name, aliases, tags and prompt token size per sheet.
+
+    The index is persisted as JSON and refreshed incrementally: only sheets whose
+    mtime or size changed are read again. Sheets themselves are never parsed here;
+    the SheetStore loads one the first time it is referenced in a prompt.
+    """
+
+    def __init__(self, characters_root: Path, index_path: Path, count_tokens=None):
+        self.characters_root = characters_root
+        self.index_path = index_path
+        self.count_tokens = count_tokens
+        self.entries = {}                 # relative path -> entry dict
+        self._lookup = {}                 # lowercased name / alias -> [relative paths]
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+    def _load(self):
+        if self.index_path.exists():
+            try:
+                data = json.loads(self.index_path.read_text(encoding="utf-8"))
+                if data.get("version") == INDEX_VERSION:
+                    self.entries = data["entries"]
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                console.print(f"[yellow][npc] Index unreadable, rebuilding: {e}[/yellow]")
+        self._loaded = True
+
+    def _save(self):
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": INDEX_VERSION, "entries": self.entries}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def _entry(self, path: Path, rel: str, st) -> dict:
+        prompt_text, aliases, tags = read_sheet(path)
+        return {
+            "name": path.stem,
+            "path": rel,
+            "aliases": aliases,
+            "tags": tags,
+            "tokens": self.count_tokens(prompt_text) if self.count_tokens else 0,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+        }
+
+    def _rebuild_lookup(self):
+        lookup = {}
+        for rel, entry in self.entries.items():
+            for key in [entry["name"], rel, *entry["aliases"]]:
+                lookup.setdefault(key.lower(), []).append(rel)
+        self._lookup = lookup
+
+    def refresh(self) -> dict:
+        """
+        Bring the index in line with the disk. Only new or modified sheets are read.
+        Returns {"added": n, "updated": n, "removed": n}.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            seen = set()
+            counts = {"added": 0, "updated": 0, "removed": 0}
+            for path in self.characters_root.rglob("*"):
+                if path.suffix.lower() not in SHEET_SUFFIXES or path.name.startswith(".") or not path.is_file():
+                    continue
+                rel = path.relative_to(self.characters_root).as_posix()
+                seen.add(rel)
+                st = path.stat()
+                entry = self.entries.get(rel)
+                if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                    continue
+                try:
+                    self.entries[rel] = self._entry(path, rel, st)
+                except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+                    console.print(f"[yellow][npc] Skipped {rel}: {e}[/yellow]")
+                    continue
+                counts["updated" if entry else "added"] += 1
+
+            for rel in [r for r in self.entries if r not in seen]:
+                del self.entries[rel]
+                counts["removed"] += 1
+
+            if any(counts.values()) or not self.index_path.exists():
+                try:
+                    self._save()
+                except OSError as e:
+                    console.print(f"[yellow][npc] Could not write {self.index_path}: {e}[/yellow]")
+            self._rebuild_lookup()
+            return counts
+
+    def _ensure(self):
+        if not self._loaded:
+            self.refresh()
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def path(self, entry: dict) -> Path:
+        return self.characters_root / entry["path"]
+
+    def resolve(self, name: str) -> list[dict]:
+        """
+        Entries matching a name or alias (case-insensitive).
+        Falls back to a prefix match when nothing matches exactly.
+        """
+        self._ensure()
+        key = name.strip().lower()
+        rels = self._lookup.get(key)
+        if not rels:
+            rels = sorted({r for k, v in self._lookup.items() if k.startswith(key) for r in v})
+        return [self.entries[r] for r in dict.fromkeys(rels)]
+
+    def search(self, query: str = "") -> list[dict]:
+        """Entries whose name, aliases or tags contain the query (all entries when empty)."""
+        self._ensure()
+        needle = query.strip().lower()
+        found = [
+            e for e in self.entries.values()
+            if not needle
+            or needle in e["name"].lower()
+            or any(needle in a.lower() for a in e["aliases"])
+            or any(needle in t for t in e["tags"])
+        ]
+        return sorted(found, key=lambda e: e["name"].lower())
+
+
+class Roster:
+    """
+    Characters taking part in the scene, in order: name -> sheet path.
+    Adding, removing and looking up a member are dict operations; the ordered
+    name / path lists used for indexing are rebuilt only after a change.
+    """
+
+    def __init__(self, paths=()):
+        self._members = {}
+        self._views = None
+        for path in paths:
+            self.add(path.stem, path)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._members
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def get(self, name: str) -> Path | None:
+        return self._members.get(name)
+
+    def add(self, name: str, path: Path) -> bool:
+        if name in self._members:
+            return False
+        self._members[name] = path
+        self._views = None
+        return True
+
+    def remove(self, name: str) -> Path | None:
+        path = self._members.pop(name, None)
+        if path is not None:
+            self._views = None
+        return path
+
+    def _lists(self) -> tuple[list[str], list[Path]]:
+        if self._views is None:
+            self._views = (list(self._members), list(self._members.values()))
+        return self._views
+
+    @property
+    def names(self) -> list[str]:
+        return self._lists()[0]
+
+    @property
+    def paths(self) -> list[Path]:
+        return self._lists()[1]
@@ -1,20 +1,36 @@
 #!/usr/bin/env python3
+import time
+STARTUP = {"import_start": time.perf_counter()}   # cold start timings, see main() and _report_first_message()
+
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from rich.console import Console
+from utils import LazyConsole
 from snitch import SnitchEditor, write_vault_file, run_snitch_auto_detection
-from dice import roll_dice
-from LLM import OllamaAgent
+from LLM import OllamaAgent, GenerationCancelled, GenerationTimeout
 from Prompt_Manager2000 import PromptManager
-from config import vault_root, characters_dir, scenes_active_dir, prompts_dir, HELP_LINES, SCENE_CONTEXT_THRESHOLD
-from turns import ensure_current_turn, advance_turn, summarize_scene_turns
-from batch import BatchManager
-from utils import read_vault_file, DEFAULT_MODEL_TOKEN_LIMIT, check_context_usage
+from config import (
+    vault_root, characters_dir, scenes_active_dir, prompts_dir, HELP_LINES, SCENE_CONTEXT_THRESHOLD,
+    MEMORIES_ON_END, MEMORY_MAX_WORKERS, ASYNC_CONSOLE, FANOUT_MAX_WORKERS, COMPACT_PROMPTS,
+    SNAPSHOT, PERSPECTIVE_FILTER, BROADCAST, BROADCAST_HOST, BROADCAST_PORT, BROADCAST_QUEUE_SIZE,
+)
+from turns import ensure_current_turn, advance_turn, summarize_scene_turns, insert_scene_summary
+from batch import BatchManager, BatchCheckpoint, checkpoint_path
+from utils import read_vault_file, check_context_usage
+from cold_storage import hydrate_scene_text, search_cold
+from compaction import PromptCompactor
+from snapshot import save_snapshot, restore_snapshot
+from perspective import PerspectiveFilter
+from generation import generation_options, trim_foreign_lines, RepetitionDetector, profile_report
 
 # ---------- Configuration ----------
 active_char = None
 GM_input = ""
-console = Console()
+console = LazyConsole()
+
+# Message classes of each builder's output, for the compaction stage
+SINGLE_CHARACTER_KINDS = ["system", "instructions", "submode", "sheet", "scene"]
+FANOUT_KINDS = ["system", "instructions", "submode", "scene", "sheet"]
 
 # ---------- Command Processing ----------
 class GMInterface:
@@ -32,6 +48,76 @@ class GMInterface:
         self.batcher = BatchManager(self.agent)
         self.retry_feedback = []
         self.auto_mode = False
+        self.compactor = PromptCompactor(self.agent.count_tokens_string) if COMPACT_PROMPTS else None
+        self.perspective = PerspectiveFilter(self.agent.count_tokens_string) if PERSPECTIVE_FILTER else None
+
+    # ------------------- PERSPECTIVE -------------------
+    def _scene_for(self, name: str, collapsed_scene: str) -> str:
+        """The part of the collapsed scene a character witnessed (whole scene when the filter is off)."""
+        if not self.perspective:
+            return collapsed_scene
+        return self.perspective.view(collapsed_scene, name, self.agent.character_names)
+
+    # ------------------- PROMPT COMPACTION -------------------
+    def _sheet_for_prompt(self, sheet_text: str) -> str:
+        return self.compactor.sheet(sheet_text) if self.compactor else sheet_text
+
+    def _compact(self, messages: list[dict], kinds: list[str]) -> list[dict]:
+        """Pass messages through the compaction stage (kinds: class of each message)."""
+        return self.compactor.compact(messages, kinds) if self.compactor else messages
+
+    # ------------------- PREWARMING -------------------
+    def prewarm(self, advance: bool = False):
+        """
+        Fill the caches the next reply's prompt reads, without sending anything:
+        the speaker sheets selected for the current submode and their compacted
+        form, the compacted static messages and their token counts, and the
+        token counts of the scene history (older turns do not change from one
+        reply to the next). Nothing is appended and no savings are recorded, so
+        it can run while the previous command is generating (see headless.py).
+        advance: the next command first moves to the next character (auto mode).
+        """
+        names, paths = self.agent.character_names, self.agent.character_paths
+        if not names:
+            return
+        submode = self.current_submode
+        sheet = lambda text: self.compactor.sheet(text, record=False) if self.compactor else text
+        compact = lambda messages, kinds: self.compactor.compact(messages, kinds, record=False) if self.compactor else messages
+
+        if submode == "group":
+            messages = self.pm.build_group_messages(
+                self.agent, self.SYSTEM_PROMPT, "", "",
+                render_sheet=sheet if self.compactor else None, submode="group", record=False,
+            )
+            static = compact(messages, ["group", "scene"])[:1]
+        elif submode == "fanout":
+            static = []
+            for idx in self.fanout_order():
+                messages = compact(self.pm.build_fanout_messages(
+                    system_prompt=self.SYSTEM_PROMPT,
+                    character_instructions=self.CHARACTER_INSTRUCTIONS,
+                    submode_instructions=self.submode_instruction_text,
+                    character_sheet=sheet(self.agent.sheets.prompt_text(paths[idx], submode, record=False)),
+                    speaker_name=names[idx],
+                    group_names=names,
+                    scene_text="",
+                    user_input="",
+                ), FANOUT_KINDS)
+                static += [m for m, kind in zip(messages, FANOUT_KINDS) if kind != "scene"]
+        else:
+            idx = (self.agent.active_character_index + int(advance)) % len(names)
+            messages = compact(self.pm.build_single_character_messages(
+                system_prompt=self.SYSTEM_PROMPT,
+                character_instructions=self.CHARACTER_INSTRUCTIONS,
+                submode_instructions=self.submode_instruction_text,
+                character_sheet=sheet(self.agent.sheets.prompt_text(paths[idx], submode, record=False)),
+                scene_text="",
+                user_input="",
+                speaker_name=names[idx],
+            ), SINGLE_CHARACTER_KINDS)
+            static = messages[:-1]
+        self.agent.count_tokens(static, include_history=False)
+        self.pm.build_scene_text(turns_to_keep=None)
 
     # Existing methods like show_help, normalize_llm_output, list_characters, next_character, etc.
 
@@ -41,6 +127,8 @@ class GMInterface:
         Send GM input to the LLM, using a collapsed scene (summaries for old turns)
         instead of the full scene, append output to scene, store messages for retry.
         """
+        started = time.perf_counter()
+
         # --- Append GM input first ---
         if user_input.strip():
             self.agent.append_to_active_scene(f"GM : {user_input}")
@@ -48,6 +136,24 @@ class GMInterface:
         # --- Build collapsed scene for LLM ---
         collapsed_scene = self.pm.build_scene_text(turns_to_keep=None)
 
+        if self.current_submode == "fanout":
+            self.agent._retry_context = {
+                "retry_system_prompt": self.SYSTEM_PROMPT,
+                "retry_character_instructions": self.CHARACTER_INSTRUCTIONS,
+                "retry_submode_instructions": self.submode_instruction_text,
+                "retry_character_sheet": "",
+                "retry_speaker_name": "Group",
+                "retry_scene_text_snapshot": collapsed_scene,
+                "retry_user_input": user_input,
+            }
+            merged = self._fanout_replies(collapsed_scene, user_input)
+            if merged is None:
+                return
+            console.print(merged)
+            self.agent.append_llm_output(merged)
+            self._report_first_message(started)
+            return
+
         speaker_name = self.agent.character_names[self.agent.active_character_index]
         active_char_sheet_text = ""
         # --- Build messages based on submode ---
@@ -57,18 +163,19 @@ class GMInterface:
                     self.agent,
                     self.SYSTEM_PROMPT,
                     collapsed_scene,
-                    user_input
+                    user_input,
+                    render_sheet=self._sheet_for_prompt if self.compactor else None,
+                    submode="group",
                 )
+                messages = self._compact(messages, ["group", "scene"])
                 speaker_name = "Group"
 
         else:
             # Single-character mode
             active_char_path = self.agent.character_paths[self.agent.active_character_index]
-            active_char_sheet_text = read_vault_file(
-                self.agent.vault_root,
-                str(active_char_path.relative_to(self.agent.vault_root))
-            )
+            active_char_sheet_text = self._sheet_for_prompt(self.agent.sheets.prompt_text(active_char_path, self.current_submode))
 
+            collapsed_scene = self._scene_for(speaker_name, collapsed_scene)
             messages = self.pm.build_single_character_messages(
                 system_prompt=self.SYSTEM_PROMPT,
                 character_instructions=self.CHARACTER_INSTRUCTIONS,
@@ -78,6 +185,7 @@ class GMInterface:
                 user_input=user_input,
                 speaker_name=speaker_name,
             )
+            messages = self._compact(messages, SINGLE_CHARACTER_KINDS)
 
         # --- Count tokens ---
         tokens_used, breakdown = self.agent.count_tokens(
@@ -85,9 +193,10 @@ class GMInterface:
         )
         console.print(f"[Token Usage] {tokens_used} tokens: {breakdown}")
         self.agent._last_token_usage = tokens_used
+        prompt_ready = time.perf_counter()
 
         # --- Check against model limit ---
-        check_context_usage(tokens_used, DEFAULT_MODEL_TOKEN_LIMIT)
+        check_context_usage(tokens_used, self.agent.model_token_limit())
 
         # --- Store for retry ---
         self.agent._retry_context = {
@@ -100,15 +209,108 @@ class GMInterface:
             "retry_user_input": user_input,
 }
         # --- Call LLM ---
-        response = self.agent.chat(messages)
+        response = self._chat_for_scene(
+            messages,
+            task="group" if self.current_submode == "group" else "roleplay",
+            character=speaker_name,
+            submode=self.current_submode,
+        )
+        if response is None:
+            return
 
         # --- Normalize & append ---
         char_response = self.normalize_llm_output(response, speaker_name)
         console.print(char_response)
         self.agent.append_llm_output(char_response)
+        self._report_first_message(started, prompt_ready)
+
+    def _report_first_message(self, started: float, prompt_ready: float = None):
+        """Print, once per session, how long the first message took (cold tokenizer, model load…)."""
+        if "first_message" in STARTUP:
+            return
+        done = time.perf_counter()
+        STARTUP["first_message"] = done - started
+        prompt = f"prompt built in {(prompt_ready - started) * 1000:.0f} ms, " if prompt_ready else ""
+        console.print(f"[dim][startup] First message: {prompt}reply appended after {done - started:.2f} s[/dim]")
 
 
 
+    def _chat_for_scene(self, messages, **perf_tags) -> str | None:
+        """
+        Call the LLM for a reply that goes into the scene, with the generation
+        profile of its submode (length, temperature, stop sequences) and a
+        repetition detector on the stream.
+        Returns None when the generation was cancelled (or timed out) and nothing should be appended.
+        """
+        options = generation_options(perf_tags.get("submode"), perf_tags.get("character"), self.agent.character_names)
+        try:
+            return self.agent.chat(messages, options=options, monitor=RepetitionDetector(), **perf_tags)
+        except GenerationTimeout:
+            console.print("[bold red]LLM request timed out — nothing appended.[/bold red]")
+            return None
+        except GenerationCancelled as e:
+            if e.keep and e.partial.strip():
+                console.print("[yellow]Generation cancelled — keeping partial output.[/yellow]")
+                return e.partial
+            console.print("[yellow]Generation cancelled — output discarded.[/yellow]")
+            return None
+
+    # ------------------- FAN-OUT GROUP -------------------
+    def fanout_order(self) -> list[int]:
+        """Speaking order for a fan-out turn: the active character first, then the roster order."""
+        count = len(self.agent.character_names)
+        start = self.agent.active_character_index
+        return [(start + i) % count for i in range(count)]
+
+    def _fanout_replies(self, collapsed_scene: str, user_input: str) -> str | None:
+        """
+        One request per character, all in flight at once, each with only its own sheet.
+        Replies are merged in fanout_order() as separate 'Name : ...' lines.
+        Returns None when no character produced a reply.
+        """
+        names = self.agent.character_names
+        order = self.fanout_order()
+        requests = {}
+        for idx in order:
+            requests[idx] = self._compact(self.pm.build_fanout_messages(
+                system_prompt=self.SYSTEM_PROMPT,
+                character_instructions=self.CHARACTER_INSTRUCTIONS,
+                submode_instructions=self.submode_instruction_text,
+                character_sheet=self._sheet_for_prompt(self.agent.sheets.prompt_text(self.agent.character_paths[idx], self.current_submode)),
+                speaker_name=names[idx],
+                group_names=names,
+                scene_text=self._scene_for(names[idx], collapsed_scene),
+                user_input=user_input,
+            ), FANOUT_KINDS)
+
+        largest = max(self.agent.count_tokens(m, include_history=False) for m in requests.values())
+        console.print(f"[Token Usage] {len(requests)} request(s), largest {largest} tokens")
+        self.agent._last_token_usage = largest
+        check_context_usage(largest, self.agent.model_token_limit())
+
+        replies = {}
+        workers = max(1, min(FANOUT_MAX_WORKERS, len(order)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    self._chat_for_scene,
+                    requests[idx],
+                    task="fanout",
+                    character=names[idx],
+                    submode=self.current_submode,
+                ): idx
+                for idx in order
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    replies[idx] = future.result()
+                except Exception as e:
+                    console.print(f"[red]{names[idx]}: request failed ({e})[/red]")
+
+        lines = [self.normalize_llm_output(replies[idx], names[idx]) for idx in order if replies.get(idx)]
+        return "\n\n".join(lines) if lines else None
+
     # ------------------- AUTO NEXT -------------------
     def auto_next_character(self):
         self.next_character()
@@ -122,8 +324,9 @@ class GMInterface:
         """
         Strip any leading prefix if it looks like the speaker name or part of it,
         followed by a colon, then prepend the canonical speaker_name once.
+        Lines the model wrote for the GM or another character are dropped.
         """
-        response = response.lstrip()
+        response = trim_foreign_lines(response.strip(), speaker_name, self.agent.character_names)
 
         # Split the speaker name into words
         name_parts = speaker_name.split()
@@ -167,12 +370,99 @@ class GMInterface:
         self.agent.active_character_index = (self.agent.active_character_index + 1) % len(self.agent.character_names)
         console.print(f"[green]Active character is now: {self.agent.character_names[self.agent.active_character_index]}[/green]")
 
+    # NPC library: search, add to / remove from the active roster
+    def list_npcs(self, query: str = ""):
+        counts = self.agent.library.refresh()
+        entries = self.agent.library.search(query)
+        changed = ", ".join(f"{n} {k}" for k, n in counts.items() if n)
+        console.print(f"\n[bold cyan]NPC library:[/bold cyan] {len(entries)} match(es)" + (f" [dim]({changed})[/dim]" if changed else ""))
+        for e in entries:
+            marker = "[active]" if e["name"] in self.agent.roster else ""
+            details = ", ".join(e["aliases"] + e["tags"])
+            console.print(f"{e['name']} — {e['tokens']} tok [dim]{e['path']}{' · ' + details if details else ''}[/dim] {marker}")
+        console.print("")
+
+    def add_npc(self, name: str):
+        if name.strip() in self.agent.roster:
+            console.print(f"[yellow]{name.strip()} is already on the roster.[/yellow]")
+            return
+        matches = self.agent.library.resolve(name)
+        if not matches:
+            console.print(f"[red]No NPC matching '{name}' (see /npc).[/red]")
+            return
+        if len(matches) > 1:
+            choices = ", ".join(e["path"] for e in matches)
+            console.print(f"[yellow]'{name}' is ambiguous: {choices}[/yellow]")
+            return
+        entry = matches[0]
+        if self.agent.roster.add(entry["name"], self.agent.library.path(entry)):
+            console.print(f"[green]{entry['name']} joins the roster as /{len(self.agent.roster)} ({entry['tokens']} tok).[/green]")
+        else:
+            console.print(f"[yellow]{entry['name']} is already on the roster.[/yellow]")
+
+    def remove_npc(self, name: str):
+        names = self.agent.character_names
+        name = name.strip()
+        if name.isdigit() and 1 <= int(name) <= len(names):
+            name = names[int(name) - 1]
+        elif exact := next((n for n in names if n.lower() == name.lower()), None):
+            name = exact
+        else:
+            # Aliases and prefixes, as /add resolves them, limited to roster members
+            members = list(dict.fromkeys(e["name"] for e in self.agent.library.resolve(name) if e["name"] in self.agent.roster))
+            if len(members) > 1:
+                console.print(f"[yellow]'{name}' is ambiguous: {', '.join(members)}[/yellow]")
+                return
+            name = members[0] if members else name
+        if name not in self.agent.roster:
+            console.print(f"[red]'{name}' is not on the roster.[/red]")
+            return
+        if len(names) == 1:
+            console.print("[red]The roster needs at least one character.[/red]")
+            return
+
+        active_name = names[self.agent.active_character_index]
+        self.agent.roster.remove(name)
+        names = self.agent.character_names
+        if active_name in self.agent.roster:
+            self.agent.active_character_index = names.index(active_name)
+        else:
+            self.agent.active_character_index = min(self.agent.active_character_index, len(names) - 1)
+        console.print(f"[green]{name} left the roster. Active character: {names[self.agent.active_character_index]}[/green]")
+
+    def handle_stat(self, args: str):
+        """
+        /stat <field> <+n|-n|=n> on the active character sheet.
+        Edits stay in memory and are flushed to disk by the sheet store's debounce.
+        """
+        m = re.match(r"^(.+?)\s+([+=-]?)\s*(\d+)$", args.strip())
+        if not m:
+            console.print("[red]Usage: /stat <field> <+n|-n|=n>[/red]")
+            return
+
+        label, op, number = m.group(1), m.group(2), int(m.group(3))
+        path = self.agent.character_paths[self.agent.active_character_index]
+        if op == "=" or not op:
+            field = self.agent.sheets.set_value(path, label, number)
+        else:
+            field = self.agent.sheets.adjust(path, label, number if op == "+" else -number)
+
+        if not field:
+            console.print(f"[red]No numeric field matching '{label}' on this sheet.[/red]")
+            return
+        console.print(f"[green]{' -> '.join(field.path)}: {field.label} = {field.value}[/green]")
+
     def handle_roll(self, expr: str):
+        from dice import roll_dice   # numpy is only imported on the first roll
         try:
             result = roll_dice(expr)
             console.print(f"[bold green]Roll: {expr}[/bold green]")
             if result["rolls"]:
                 console.print(f"Rolls: {result['rolls']}")
+            if "kept" in result:
+                console.print(f"Kept: {result['kept']}")
+            if "totals" in result:
+                console.print(f"Totals: {result['totals']}")
             if "breakdown" in result:
                 console.print(f"Breakdown: {result['breakdown']}")
             console.print(f"Total: [bold yellow]{result['total']}[/bold yellow]")
@@ -180,6 +470,45 @@ class GMInterface:
             console.print("[red]Invalid dice expression[/red]")
 
 
+    def handle_odds(self, args: str):
+        """
+        /odds <expr> [>= target] — exact probabilities, no sampling.
+        """
+        m = re.match(r"^(.*?)(?:\s*(>=|<=|>|<|=)\s*(-?\d+))?\s*$", args.strip())
+        expr, op, target = m.group(1), m.group(2), m.group(3)
+        from dice import dice_odds
+        try:
+            result = dice_odds(expr, op, int(target) if target is not None else None)
+        except Exception as e:
+            console.print(f"[red]Invalid dice expression: {e}[/red]")
+            return
+
+        high = result["max"] if result["max"] is not None else "∞"
+        console.print(f"[bold green]Odds: {expr}[/bold green]")
+        if result["repeat"]:
+            console.print(f"Per roll ({result['repeat']} rolls):")
+        console.print(f"Range: {result['min']} – {high}   Mean: {result['mean']:.2f}   Std dev: {result['stdev']:.2f}")
+        if op is not None:
+            console.print(f"P(total {op} {target}): [bold yellow]{result['probability'] * 100:.2f}%[/bold yellow]")
+            if result["repeat"]:
+                console.print(
+                    f"Expected successes: {result['expected_successes']:.2f} / {result['repeat']}   "
+                    f"P(at least one): {result['p_any'] * 100:.2f}%"
+                )
+
+    def find_in_scene(self, query: str):
+        """Search the active scene, including full turns kept in cold storage."""
+        scene_path = self.agent.get_active_scene_path()
+        if not scene_path or not query.strip():
+            return
+        needle = query.strip().lower()
+        hits = [l.strip() for l in self.agent.read_active_scene().splitlines() if needle in l.lower()]
+        hits += [r["line"] for r in search_cold(scene_path, query.strip())]
+        if not hits:
+            console.print("[yellow]No match.[/yellow]")
+        for line in hits:
+            console.print(f"  {line}")
+
     def summarize_scene(self, turns_to_keep: int = None):
         """
         Manual trigger for auto-summarizing old turns.
@@ -225,6 +554,17 @@ class GMInterface:
             user_input = user_input + "\n" + feedback
             ctx["retry_user_input"] = user_input  # update stored version
 
+        # ---- Fan-out: ask every character again ----
+        if self.current_submode == "fanout":
+            console.print("[cyan]Regenerating last group replies…[/cyan]")
+            merged = self._fanout_replies(collapsed_scene, user_input)
+            if merged is None:
+                return
+            self.agent.append_llm_output(merged)
+            console.print("\n[bold green]Updated Response:[/bold green]")
+            console.print(merged + "\n")
+            return
+
         # ---- Rebuild message stack ----
     # ---- Rebuild message stack depending on mode ----
         if self.current_submode == "group":
@@ -233,8 +573,11 @@ class GMInterface:
                     agent=self.agent,
                     system_prompt=system_prompt,
                     scene_text=collapsed_scene,   # already collapsed
-                    user_input=user_input
+                    user_input=user_input,
+                    render_sheet=self._sheet_for_prompt if self.compactor else None,
+                    submode="group",
                 )
+            messages = self._compact(messages, ["group", "scene"])
             speaker_name = "Group"
         else:
             # Single-character method
@@ -247,12 +590,19 @@ class GMInterface:
                 scene_text=collapsed_scene,   # <-- already collapsed
                 user_input=user_input         # <-- now includes feedback
             )
+            messages = self._compact(messages, SINGLE_CHARACTER_KINDS)
 
         console.print("[cyan]Regenerating last LLM response…[/cyan]")
-        response = self.agent.chat(messages)
+        response = self._chat_for_scene(
+            messages,
+            task="group" if self.current_submode == "group" else "roleplay",
+            character=speaker_name,
+            submode=self.current_submode,
+        )
+        if response is None:
+            return
 
-        # ---- Normalize and append to scene ----
-        speaker_name = self.agent.character_names[self.agent.active_character_index]
+        # ---- Normalize and append to scene (as the speaker the prompt was built for) ----
         char_response = self.normalize_llm_output(response, speaker_name)
         self.agent.append_llm_output(char_response)
 
@@ -260,7 +610,7 @@ class GMInterface:
         console.print("\n[bold green]Updated Response:[/bold green]")
         console.print(char_response + "\n")
 
-    def summarize_full_scene(self, scene_text: str) -> str:
+    def summarize_full_scene(self, scene_text: str, checkpoint: BatchCheckpoint = None) -> str:
         console.print("[cyan]Summarizing full scene…[/cyan]")
 
         summary_batches = self.batcher.get_tokenwise_summary_batches(
@@ -268,214 +618,323 @@ class GMInterface:
             system_prompts=[{"role": "system", "content": self.pm.summary_prompt()}],
             SCENE_CONTEXT_THRESHOLD=SCENE_CONTEXT_THRESHOLD,
             prompt_manager=self.pm,
-            model_token_limit=DEFAULT_MODEL_TOKEN_LIMIT,
+            model_token_limit=self.agent.model_token_limit(),
         )
 
-        accumulated_summary = ""
-        total = len(summary_batches)
-        console.print(f"[cyan]Created {total} summarization batch(es).[/cyan]")
-
-        for i, batch in enumerate(summary_batches, start=1):
-            messages = self.pm.build_summary_messages(
-                scene_text=batch['batch_text'],
-                prior_summary_text=batch['prior_summary_text']  # empty for first batch
-            )
-
-            used_tokens = self.agent.count_tokens(messages)
-            console.print(f"\n[bold cyan]Processing batch {i}/{total}…[/bold cyan]")
-            console.print(f"[magenta]Batch {i} token usage: {used_tokens} tokens[/magenta]")
-            console.print(f"[magenta]Turns in this batch: {batch['turn_indices']}[/magenta]")
-            console.print(f"[yellow]Requesting LLM summary for batch {i}…[/yellow]")
-
-            llm_output = self.agent.chat(messages).strip()
-            console.print(f"[green]Received summary for batch {i}.[/green]")
-
-            accumulated_summary += ("\n\n" if accumulated_summary else "") + llm_output
-            batch["prior_summary_text"] = accumulated_summary
+        console.print(f"[cyan]Created {len(summary_batches)} summarization batch(es).[/cyan]")
+        summary = self.batcher.summarize_batches(summary_batches, self.pm, checkpoint=checkpoint)
 
         console.print("\n[bold green]All batches processed![/bold green]")
-        return accumulated_summary.strip()
-    
-    # ---------- MAIN INTERACTIVE LOOP ----------
-    def run(self):
-        console.print("[bold cyan]GM Assistant Ready.[/bold cyan]\n")
-
-        while True:
-            GM_input = input(f"\n({self.current_submode}) {self.agent.character_names[self.agent.active_character_index]} GM> ").strip()
-            scene_path = self.agent.get_active_scene_path()
-            current_turn = ensure_current_turn(scene_path)
+        return summary
 
-            # -----------------------------------------------------
-            # 1) Handle TRY AGAIN and /p BEFORE any other commands
-            # -----------------------------------------------------
-            if GM_input.lower().startswith("try again") or GM_input.startswith("/p"):
-                parts = GM_input.split(" ", 1)
-                feedback = parts[1].strip() if len(parts) > 1 else ""
-
-                if feedback:
-                    self.retry_feedback.append(feedback)
-
-                self.regenerate_last()
-                continue
+    def generate_character_memories(self):
+        """
+        Ask the LLM for a one-sentence memory per active character, all requests in flight
+        at once, then append each memory under the sheet's Memories section (one write per sheet).
+        """
+        names = list(self.agent.character_names)
+        if not names:
+            console.print("[yellow]No active characters to write memories for.[/yellow]")
+            return {}
 
-            # Narration-only append
-            if GM_input.startswith("."):
-                narration_text = "GM : " + GM_input[1:].lstrip()
-                self.agent.append_to_active_scene(narration_text)
-                console.print(f"[Narration appended]", style="bold cyan")
-                continue  # skip LLM response
-
-            # ------------------ Toggle auto mode ------------------
-            if GM_input == "*":
-                self.auto_mode = not self.auto_mode
-                status = "activated" if self.auto_mode else "deactivated"
-                console.print(f"[bold cyan]Auto mode {status}[/bold cyan]")
+        collapsed_scene = self.pm.build_scene_text(turns_to_keep=None)
+        sheets = {name: self.agent.get_character_sheet_by_name(name) for name in names}
+
+        console.print(f"[cyan]Generating memories for {len(names)} character(s)…[/cyan]")
+        memories = {}
+        workers = max(1, min(MEMORY_MAX_WORKERS, len(names)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    self.agent.chat,
+                    self.pm.build_memory_messages(self._scene_for(name, collapsed_scene), name, sheets[name]),
+                    task="memory",
+                    character=name,
+                ): name
+                for name in names
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    memories[name] = future.result().strip()
+                    console.print(f"[green]✓ Memory for {name}[/green]")
+                except Exception as e:
+                    console.print(f"[red]Memory generation failed for {name}: {e}[/red]")
+
+        for name, path in zip(self.agent.character_names, self.agent.character_paths):
+            memory = memories.get(name)
+            if not memory:
                 continue
+            self.agent.sheets.append_to_section(path, "Memories", [memory])
+            console.print(f"[bold cyan]{name}[/bold cyan]: {memory}")
 
-            if GM_input.startswith("/"):
-                # Help
-                if GM_input == "/h":
-                    self.show_help()
-                    continue
+        return memories
+    
+    def save_session(self):
+        """Refresh the session snapshot next to the scene (see snapshot.py)."""
+        if not SNAPSHOT:
+            return
+        try:
+            save_snapshot(self)
+        except Exception as e:
+            console.print(f"[yellow][snapshot] Not saved: {e}[/yellow]")
 
-                # Roll dice
-                elif GM_input.startswith("/r "):
-                    self.handle_roll(GM_input[3:].strip())
-                    continue
+    def prompt_text(self) -> str:
+        return f"\n({self.current_submode}) {self.agent.character_names[self.agent.active_character_index]} GM> "
 
-                # Summarize scene, optionally with turns_to_keep
-                elif GM_input.startswith("/s"):
-                    parts = GM_input.split(maxsplit=1)
-                    turns_to_keep = None
+    def handle_command(self, GM_input: str):
+        """
+        Run one console line: a command, a narration line, or a GM message for the LLM.
+        """
+        GM_input = GM_input.strip()
+        scene_path = self.agent.get_active_scene_path()
+        with self.agent.scene_lock:
+            current_turn = ensure_current_turn(scene_path)
 
-                    if len(parts) > 1 and parts[1].isdigit():
-                        turns_to_keep = int(parts[1])
+        # -----------------------------------------------------
+        # 1) Handle TRY AGAIN and /p BEFORE any other commands
+        # -----------------------------------------------------
+        if GM_input.lower().startswith("try again") or GM_input == "/p" or GM_input.startswith("/p "):
+            parts = GM_input.split(" ", 1)
+            feedback = parts[1].strip() if len(parts) > 1 else ""
 
-                    self.summarize_scene(turns_to_keep=turns_to_keep)
-                    continue
+            if feedback:
+                self.retry_feedback.append(feedback)
 
+            self.regenerate_last()
+            return
 
-                # List characters
-                elif GM_input == "/ls":
-                    self.list_characters()
-                    continue
+        # Narration-only append
+        if GM_input.startswith("."):
+            narration_text = "GM : " + GM_input[1:].lstrip()
+            self.agent.append_to_active_scene(narration_text)
+            console.print(f"[Narration appended]", style="bold cyan")
+            return  # skip LLM response
+
+        # ------------------ Toggle auto mode ------------------
+        if GM_input == "*":
+            self.auto_mode = not self.auto_mode
+            status = "activated" if self.auto_mode else "deactivated"
+            console.print(f"[bold cyan]Auto mode {status}[/bold cyan]")
+            return
 
-                # Next character
-                elif GM_input == "/n":
-                    self.next_character()
-                    continue
+        if GM_input.startswith("/"):
+            # Help
+            if GM_input == "/h":
+                self.show_help()
+                return
+
+            # Roll dice
+            elif GM_input.startswith("/r "):
+                self.handle_roll(GM_input[3:].strip())
+                return
+
+            # Search the scene, including cold storage
+            elif GM_input.startswith("/find "):
+                self.find_in_scene(GM_input[6:])
+                return
+
+            # Prompt compaction savings
+            elif GM_input == "/compact":
+                if self.compactor:
+                    self.compactor.report()
+                else:
+                    console.print("[yellow]Prompt compaction is off (COMPACT_PROMPTS).[/yellow]")
+                self.agent.sheets.selection_report()
+                return
+
+            # Ollama backends status
+            elif GM_input == "/backends":
+                if hasattr(self.agent.client, "report"):
+                    self.agent.client.report()
+                else:
+                    console.print("[yellow]No backend pool in use.[/yellow]")
+                return
 
-                # Next turn
-                elif GM_input == "/t":
-                    scene_path = self.agent.get_active_scene_path()
-                    advance_turn(scene_path, self.agent, current_turn=current_turn)
-                    continue
-
-                # Submode shortcuts (/c, /r, /e)
-                elif GM_input.lower() in ("/c", "/r", "/g", "/e"):
-                    if GM_input.lower() == "/c":
-                        self.current_submode = "combat"
-                    elif GM_input.lower() == "/r":
-                        self.current_submode = "roleplay"
-                    elif GM_input.lower() == "/g":
-                        self.current_submode = "group"
-                        self.submode_instruction_text = ""
-                        console.print("[bold cyan]Submode switched to group[/bold cyan]")
-                        continue
-                    else:
-                        self.current_submode = "exploration"
-                        self.submode_instruction_text = self.pm.submode(self.current_submode)
-                        console.print(f"[bold cyan]Submode switched to {self.current_submode}[/bold cyan]")
-                        continue
-
-                # Switch active character by number (/1 /2 /3)
-                elif GM_input.startswith("/") and GM_input[1:].isdigit():
-                    self.switch_character(int(GM_input[1:]))
-                    continue
-
-                elif GM_input == "/end":
-
-                    # Get only the summary string (summarize_full_scene performs LLM calls)
-                    final_summary = self.summarize_full_scene(self.pm.scene_raw)
-
-                    if not final_summary:
-                        console.print("[yellow]No summary returned from summarizer.[/yellow]")
-                        continue
-
-                    # Read original scene
-                    original = self.agent.read_active_scene()
-
-                    # Remove any existing Scene Summary blocks (keep rest)
-                    # Pattern: header "# Scene Summary" (or "## Scene Summary") and any following lines
-                    import re
-                    # Remove any existing Scene Summary section(s)
-                    cleaned = re.sub(
-                        r"(?ms)^\s*#{1,2}\s*Scene Summary\s*\n.*?(?=^\s*#\s*(Turn\s+\d+|Scene Summary)\b|\Z)",
-                        "",
-                        original
-                    ).rstrip()
-
-                    # Detect description vs start at Turn 1
-                    m = re.search(r"^#\s*Turn\s+1\b", cleaned, flags=re.M)
-                    if m:
-                        desc_block = cleaned[:m.start()].strip()
-                        turns_block = cleaned[m.start():].lstrip()
-                    else:
-                        # No Turn 1 found — treat whole file as turns_block fallback
-                        desc_block = ""
-                        turns_block = cleaned.strip()
-
-                    # Build the new scene text: description (if any), Scene Summary, then turns
-                    parts = []
-                    if desc_block:
-                        parts.append(desc_block)
-                    parts.append("# Scene Summary\n" + final_summary.strip())
-                    if turns_block:
-                        parts.append(turns_block)
-
-                    new_scene = "\n\n".join(parts).strip() + "\n"
-
-                    # Write back the scene file (replace)
-                    # Use agent or helper that writes whole scene — replace with your write function
-                    try:
-                        # if your agent has a write_scene or similar, use it. Otherwise overwrite file.
-                        scene_path = self.agent.get_active_scene_path()
-                        scene_path.write_text(new_scene, encoding="utf-8")
-                        # Refresh pm.scene_text and agent internal state if needed
-                        self.pm.scene_raw = new_scene
-                        console.print("\n[bold green]Full scene summary written into scene file.[/bold green]")
-                        console.print("# Scene Summary\n" + final_summary.strip())
-                    except Exception as e:
-                        console.print(f"[red]Failed to write scene file: {e}[/red]")
-                        console.print("# Scene Summary\n" + final_summary.strip())
-
-                    continue
-
-                # Unknown command
+            # Live viewers
+            elif GM_input == "/viewers":
+                if self.agent.broadcaster:
+                    console.print(f"[cyan]{self.agent.broadcaster.report()}[/cyan]")
                 else:
-                    console.print("[yellow]Unknown command.[/yellow]")
-                    continue
+                    console.print("[yellow]Live broadcast is off (BROADCAST).[/yellow]")
+                return
 
-            # Empty input → treat as "GM says nothing" and continue the scene
-            if not GM_input:
-                if getattr(self, "auto_mode", False):
-                    self.auto_next_character()   # switches character AND sends empty input
+            # Perspective filter savings
+            elif GM_input == "/pov":
+                if self.perspective:
+                    self.perspective.report()
                 else:
-                    self._send_to_llm("")        # just sends empty input
-                continue
+                    console.print("[yellow]Perspective filter is off (PERSPECTIVE_FILTER).[/yellow]")
+                return
+
+            # Generation profiles: output length and decode time saved
+            elif GM_input == "/profiles":
+                profile_report(self.agent.perf.records)
+                return
+
+            # Session performance report
+            elif GM_input == "/perf":
+                self.agent.perf.report()
+                return
+
+            # Exact odds of a dice expression
+            elif GM_input.startswith("/odds "):
+                self.handle_odds(GM_input[6:])
+                return
+
+            # Edit a number on the active sheet
+            elif GM_input.startswith("/stat "):
+                self.handle_stat(GM_input[6:])
+                return
+
+            # Summarize scene, optionally with turns_to_keep
+            elif GM_input.startswith("/s"):
+                parts = GM_input.split(maxsplit=1)
+                turns_to_keep = None
+
+                if len(parts) > 1 and parts[1].isdigit():
+                    turns_to_keep = int(parts[1])
+
+                self.summarize_scene(turns_to_keep=turns_to_keep)
+                return
+
+
+            # List characters
+            elif GM_input == "/ls":
+                self.list_characters()
+                return
+
+            # Next character
+            elif GM_input == "/n":
+                self.next_character()
+                return
+
+            # NPC library and roster changes
+            elif GM_input == "/npc" or GM_input.startswith("/npc "):
+                self.list_npcs(GM_input[4:])
+                return
+
+            elif GM_input.startswith("/add "):
+                self.add_npc(GM_input[5:])
+                return
+
+            elif GM_input.startswith("/rm "):
+                self.remove_npc(GM_input[4:])
+                return
+
+            # Next turn
+            elif GM_input == "/t":
+                scene_path = self.agent.get_active_scene_path()
+                advance_turn(scene_path, self.agent, current_turn=current_turn)
+                return
+
+            # Fan-out group submode
+            elif GM_input.lower() == "/gf":
+                self.current_submode = "fanout"
+                self.submode_instruction_text = self.pm.submode(self.current_submode)
+                console.print("[bold cyan]Submode switched to fan-out group[/bold cyan]")
+                return
+
+            # Submode shortcuts (/c, /r, /e)
+            elif GM_input.lower() in ("/c", "/r", "/g", "/e"):
+                if GM_input.lower() == "/c":
+                    self.current_submode = "combat"
+                elif GM_input.lower() == "/r":
+                    self.current_submode = "roleplay"
+                elif GM_input.lower() == "/g":
+                    self.current_submode = "group"
+                    self.submode_instruction_text = ""
+                    console.print("[bold cyan]Submode switched to group[/bold cyan]")
+                    return
+                else:
+                    self.current_submode = "exploration"
+                    self.submode_instruction_text = self.pm.submode(self.current_submode)
+                    console.print(f"[bold cyan]Submode switched to {self.current_submode}[/bold cyan]")
+                    return
+
+            # Switch active character by number (/1 /2 /3)
+            elif GM_input.startswith("/") and GM_input[1:].isdigit():
+                self.switch_character(int(GM_input[1:]))
+                return
+
+            elif GM_input == "/end" or GM_input.startswith("/end "):
+                end_args = GM_input.split()[1:]
+                write_memories = MEMORIES_ON_END or "m" in end_args
+
+                # Get only the summary string (summarize_full_scene performs LLM calls)
+                # Full text of the current scene, including turns in cold storage
+                scene_path = self.agent.get_active_scene_path()
+                full_scene = hydrate_scene_text(self.agent.read_active_scene(), scene_path)
+                # Finished batches survive a crash or Ctrl-C; a rerun continues after them
+                checkpoint = BatchCheckpoint(checkpoint_path(scene_path), full_scene)
+                final_summary = self.summarize_full_scene(full_scene, checkpoint=checkpoint)
+
+                if not final_summary:
+                    console.print("[yellow]No summary returned from summarizer.[/yellow]")
+                    return
+
+                # Read original scene and place the summary between description and turns
+                original = self.agent.read_active_scene()
+                new_scene = insert_scene_summary(original, final_summary)
+
+                # Write back the scene file (replace)
+                # Use agent or helper that writes whole scene — replace with your write function
+                try:
+                    # if your agent has a write_scene or similar, use it. Otherwise overwrite file.
+                    scene_path = self.agent.get_active_scene_path()
+                    scene_path.write_text(new_scene, encoding="utf-8")
+                    # Refresh pm.scene_text and agent internal state if needed
+                    self.pm.scene_raw = new_scene
+                    checkpoint.clear()
+                    console.print("\n[bold green]Full scene summary written into scene file.[/bold green]")
+                    console.print("# Scene Summary\n" + final_summary.strip())
+                except Exception as e:
+                    console.print(f"[red]Failed to write scene file: {e}[/red]")
+                    console.print("# Scene Summary\n" + final_summary.strip())
+
+                if write_memories:
+                    self.generate_character_memories()
+
+                return
+
+            # Unknown command
+            else:
+                console.print("[yellow]Unknown command.[/yellow]")
+                return
+
+        # Empty input → treat as "GM says nothing" and continue the scene
+        if not GM_input:
+            if getattr(self, "auto_mode", False):
+                self.auto_next_character()   # switches character AND sends empty input
+            else:
+                self._send_to_llm("")        # just sends empty input
+            return
 
 
-                # NORMAL FLOW: GM provides input → LLM responds → append to scene
+            # NORMAL FLOW: GM provides input → LLM responds → append to scene
 
-            # Use the helper to send GM input to LLM and append
-            self._send_to_llm(GM_input)
+        # Use the helper to send GM input to LLM and append
+        self._send_to_llm(GM_input)
+
+    # ---------- MAIN INTERACTIVE LOOP ----------
+    def run(self):
+        console.print("[bold cyan]GM Assistant Ready.[/bold cyan]\n")
+
+        while True:
+            GM_input = input(self.prompt_text()).strip()
+            self.handle_command(GM_input)
+            self.save_session()
 
     # ---------- Main ----------
-def main():
+def create_interface() -> GMInterface:
+    """Agent, live broadcast, prompt manager and GM interface, with the session snapshot restored."""
     agent = OllamaAgent(vault_root, characters_dir, scenes_active_dir)
+    if BROADCAST:
+        from broadcast import start_broadcast
+        agent.broadcaster = start_broadcast(BROADCAST_HOST, BROADCAST_PORT, queue_size=BROADCAST_QUEUE_SIZE)
     scene_text = agent.read_active_scene()
     # Create PromptManager
-    pm = PromptManager(prompts_dir)
+    pm = PromptManager(prompts_dir, count_tokens=agent.count_tokens_string)
 
     
 
@@ -485,7 +944,29 @@ def main():
         current_submode="roleplay",
     )
 
-    gm.run()
+    if SNAPSHOT:
+        import atexit
+        restore_snapshot(gm)
+        atexit.register(gm.save_session)
+    return gm
+
+
+def main():
+    STARTUP["imports_done"] = time.perf_counter()
+    gm = create_interface()
+
+    STARTUP["ready"] = time.perf_counter()
+    console.print(
+        f"[dim][startup] imports {(STARTUP['imports_done'] - STARTUP['import_start']) * 1000:.0f} ms, "
+        f"ready after {(STARTUP['ready'] - STARTUP['import_start']) * 1000:.0f} ms[/dim]"
+    )
+
+    if ASYNC_CONSOLE:
+        import asyncio
+        from async_console import AsyncGMConsole
+        asyncio.run(AsyncGMConsole(gm).run())
+    else:
+        gm.run()
 
 if __name__ == "__main__":
     main()
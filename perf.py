@@ -0,0 +1,127 @@
+# perf.py
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from utils import LazyConsole
+
+console = LazyConsole()
+
+LOAD_STALL_SECONDS = 0.5        # load_duration above this counts as a model (re)load stall
+TREND_WINDOW = 5                # calls compared at the start vs the end of the session
+
+
+def _rate(count, duration_ns):
+    if not count or not duration_ns:
+        return None
+    return count / (duration_ns / 1e9)
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _fmt(value, digits=1):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+class PerfLog:
+    """
+    Per-call Ollama timing metadata for the session, kept in memory and
+    appended to a JSONL file (one line per LLM call).
+    """
+
+    def __init__(self, log_dir: Path):
+        self.log_dir = log_dir
+        self.path = log_dir / f"perf-{datetime.now():%Y%m%d-%H%M%S}.jsonl"
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, result: dict, task: str, model: str, character: str = None,
+               submode: str = None, num_ctx: int = None) -> dict:
+        entry = {
+            "time": time.time(),
+            "task": task,
+            "model": model,
+            "character": character,
+            "submode": submode,
+            "num_ctx": num_ctx,
+            "wall_time": result.get("wall_time"),
+            "prompt_eval_count": result.get("prompt_eval_count"),
+            "prompt_eval_duration": result.get("prompt_eval_duration"),
+            "eval_count": result.get("eval_count"),
+            "eval_duration": result.get("eval_duration"),
+            "load_duration": result.get("load_duration"),
+            "total_duration": result.get("total_duration"),
+            "done_reason": result.get("done_reason"),
+        }
+        entry["prefill_tps"] = _rate(entry["prompt_eval_count"], entry["prompt_eval_duration"])
+        entry["decode_tps"] = _rate(entry["eval_count"], entry["eval_duration"])
+
+        with self._lock:
+            self.records.append(entry)
+            try:
+                self.log_dir.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                console.print(f"[yellow][perf] Could not write {self.path}: {e}[/yellow]")
+        return entry
+
+    # ------------------------------------------------------------------
+    # Report
+    # ------------------------------------------------------------------
+    def report(self):
+        from rich.table import Table
+        records = list(self.records)
+        if not records:
+            console.print("[yellow]No LLM calls recorded yet.[/yellow]")
+            return
+
+        table = Table(title=f"LLM performance — {len(records)} call(s)")
+        for col in ("Task", "Calls", "Prompt tok", "Output tok", "Prefill tok/s",
+                    "Decode tok/s", "Load stalls", "Avg wall s"):
+            table.add_column(col, justify="right" if col != "Task" else "left")
+
+        by_task = {}
+        for r in records:
+            by_task.setdefault(r["task"], []).append(r)
+        for task, rows in by_task.items():
+            stalls = sum(1 for r in rows if (r["load_duration"] or 0) / 1e9 > LOAD_STALL_SECONDS)
+            table.add_row(
+                task,
+                str(len(rows)),
+                _fmt(_mean([r["prompt_eval_count"] for r in rows]), 0),
+                _fmt(_mean([r["eval_count"] for r in rows]), 0),
+                _fmt(_mean([r["prefill_tps"] for r in rows])),
+                _fmt(_mean([r["decode_tps"] for r in rows])),
+                str(stalls),
+                _fmt(_mean([r["wall_time"] for r in rows]), 2),
+            )
+        console.print(table)
+
+        # Where the time goes
+        prefill = sum((r["prompt_eval_duration"] or 0) for r in records) / 1e9
+        decode = sum((r["eval_duration"] or 0) for r in records) / 1e9
+        load = sum((r["load_duration"] or 0) for r in records) / 1e9
+        total = prefill + decode + load
+        if total:
+            console.print(
+                f"Time split: prefill {prefill / total:.0%} ({prefill:.1f}s) · "
+                f"decode {decode / total:.0%} ({decode:.1f}s) · "
+                f"load {load / total:.0%} ({load:.1f}s)"
+            )
+
+        # Session trend: first calls vs latest calls
+        if len(records) >= 2 * TREND_WINDOW:
+            first, last = records[:TREND_WINDOW], records[-TREND_WINDOW:]
+            for label, key, digits in (("Prompt tokens", "prompt_eval_count", 0),
+                                       ("Prefill tok/s", "prefill_tps", 1),
+                                       ("Decode tok/s", "decode_tps", 1),
+                                       ("Wall s", "wall_time", 2)):
+                before = _mean([r[key] for r in first])
+                after = _mean([r[key] for r in last])
+                console.print(f"Trend {label}: {_fmt(before, digits)} → {_fmt(after, digits)}")
+        console.print(f"[dim]Log: {self.path}[/dim]")
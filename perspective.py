@@ -0,0 +1,143 @@
+# perspective.py
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from utils import LazyConsole
+
+console = LazyConsole()
+
+TURN_HEADER_RE = re.compile(r"^#\s*Turns?\s+\d+")
+SPEAKER_RE = re.compile(r"^\**\s*([^:*\n]{1,40}?)\s*\**\s*:")
+GROUP_RE = re.compile(r"\b(?:everyone|the party|the group|all of you|you all)\b", re.I)   # lines involving the whole roster
+VIEW_CACHE_SIZE = 64
+
+
+def _name_patterns(roster: list[str]) -> dict:
+    """Word-boundary pattern per character: full name, or first name for multi-word names."""
+    patterns = {}
+    for name in roster:
+        forms = {name} | ({name.split()[0]} if " " in name else set())
+        patterns[name] = re.compile(r"\b(?:" + "|".join(re.escape(f) for f in sorted(forms, key=len, reverse=True)) + r")\b", re.I)
+    return patterns
+
+
+def split_blocks(scene_text: str) -> tuple[list[str], list[list[str]]]:
+    """Lines before the first turn (description), then one block of lines per '# Turn' / '# Turns' header."""
+    head, blocks = [], []
+    for line in scene_text.splitlines():
+        if TURN_HEADER_RE.match(line.strip()):
+            blocks.append([line])
+        elif blocks:
+            blocks[-1].append(line)
+        else:
+            head.append(line)
+    return head, blocks
+
+
+def line_tags(line: str, patterns: dict) -> tuple[set, set]:
+    """
+    (speakers, involved) of a line: the character speaking it ("Name : …"),
+    and every character it concerns (speaker, mentions, or all for group lines).
+    """
+    m = SPEAKER_RE.match(line.strip())
+    speakers = {name for name, pattern in patterns.items() if m and pattern.fullmatch(m.group(1).strip())}
+    if GROUP_RE.search(line):
+        return speakers, set(patterns)
+    return speakers, speakers | {name for name, pattern in patterns.items() if pattern.search(line)}
+
+
+class PerspectiveFilter:
+    """
+    Per-character view of the collapsed scene.
+
+    Every line is tagged with its speaker and the characters it mentions.
+    A character's view keeps the description, whole turns it spoke in, only
+    the lines that mention it (or the whole group) from other turns, and
+    always the latest turn (the one it is answering in). Runs of turns
+    without it are reduced to one '(… not present)' note.
+    Views are cached by scene version (hash of the collapsed scene) and
+    roster; token savings are accumulated per character.
+    """
+
+    def __init__(self, count_tokens=None, cache_size: int = VIEW_CACHE_SIZE):
+        self.count_tokens = count_tokens
+        self.cache_size = cache_size
+        self._views = OrderedDict()       # (scene hash, roster, name) -> view text
+        self.stats = {}                   # name -> {"calls", "full", "view"}
+        self._lock = threading.Lock()
+
+    def view(self, scene_text: str, name: str, roster: list[str]) -> str:
+        if name not in roster or len(roster) < 2:
+            return scene_text
+        key = (hashlib.sha1(scene_text.encode("utf-8")).hexdigest(), tuple(roster), name)
+        with self._lock:
+            text = self._views.get(key)
+            if text is not None:
+                self._views.move_to_end(key)
+        if text is None:
+            text = self._build(scene_text, name, roster)
+            with self._lock:
+                self._views[key] = text
+                while len(self._views) > self.cache_size:
+                    self._views.popitem(last=False)
+        self._record(name, scene_text, text)
+        return text
+
+    def _build(self, scene_text: str, name: str, roster: list[str]) -> str:
+        patterns = _name_patterns(roster)
+        head, blocks = split_blocks(scene_text)
+        out = list(head)
+        absent = []                       # headers of the current run of turns without the character
+
+        def flush_absent():
+            if absent:
+                first, last = re.findall(r"\d+", absent[0])[0], re.findall(r"\d+", absent[-1])[-1]
+                out.append(f"# Turn {first}" if first == last else f"# Turns {first}–{last}")
+                out.append(f"({name} was not present)")
+                out.append("")
+                absent.clear()
+
+        for i, block in enumerate(blocks):
+            header, body = block[0], block[1:]
+            tags = [line_tags(line, patterns) if line.strip() else (set(), set()) for line in body]
+            if any(name in speakers for speakers, _ in tags) or i == len(blocks) - 1:
+                flush_absent()
+                out.extend(block)
+                continue
+            involved = [line for line, (_, concerned) in zip(body, tags) if name in concerned]
+            if involved:
+                flush_absent()
+                out.append(header)
+                out.extend(involved)
+                out.append("")
+            else:
+                absent.append(header)
+        flush_absent()
+        return "\n".join(out).rstrip()
+
+    def _record(self, name: str, full: str, view: str):
+        if not self.count_tokens:
+            return
+        full_tokens, view_tokens = self.count_tokens(full), self.count_tokens(view)
+        with self._lock:
+            s = self.stats.setdefault(name, {"calls": 0, "full": 0, "view": 0})
+            s["calls"] += 1
+            s["full"] += full_tokens
+            s["view"] += view_tokens
+
+    def report(self):
+        from rich.table import Table
+        if not self.stats:
+            console.print("[yellow]No filtered prompt yet.[/yellow]")
+            return
+        table = Table(title="Perspective filter — scene tokens per character")
+        for col in ("Character", "Prompts", "Full scene", "Own view", "Saved"):
+            table.add_column(col, justify="left" if col == "Character" else "right")
+        for name, s in sorted(self.stats.items(), key=lambda kv: kv[1]["view"] / max(kv[1]["full"], 1)):
+            saved = s["full"] - s["view"]
+            table.add_row(
+                name, str(s["calls"]), str(s["full"]), str(s["view"]),
+                f"{saved} ({saved / s['full']:.0%})" if s["full"] else "-",
+            )
+        console.print(table)
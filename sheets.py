@@ -0,0 +1,557 @@
+# sheets.py
+import atexit
+import json
+import re
+import threading
+from functools import lru_cache
+from dataclasses import dataclass, field
+from pathlib import Path
+from utils import LazyConsole
+from config import SHEET_FLUSH_DELAY, SUBMODE_SHEET_PROFILES
+from snitch import SnitchEditor, append_to_section
+from utils import safe_resolve
+
+console = LazyConsole()
+
+HEADER_RE = re.compile(r"^(#+)\s*(.*)$")
+NUMBER_RE = re.compile(r"-?\d+")
+LABEL_STRIP_RE = re.compile(r"[*_`>#:\-]")
+
+
+# ---------------------------------------------------------
+# Sheet model
+# ---------------------------------------------------------
+@dataclass
+class SheetSection:
+    header: str
+    level: int
+    path: list[str]
+    start: int                  # line index of the header
+    end: int                    # line index after the last line of the section
+
+
+@dataclass
+class NumericField:
+    label: str                  # text right before the number, formatting stripped
+    value: int
+    line_idx: int
+    start: int                  # character span of the number inside the raw line
+    end: int
+    path: list[str]
+    json_path: list | None = None
+
+
+@dataclass
+class CharacterSheet:
+    name: str
+    path: Path
+    source: str                 # "markdown" or "json"
+    mtime: float
+    lines: list[dict]           # {"raw", "line", "path"} — raw keeps original formatting
+    sections: list[SheetSection] = field(default_factory=list)
+    fields: list[NumericField] = field(default_factory=list)
+    json_data: dict | None = None
+    version: int = 1
+    dirty: bool = False
+
+    def to_text(self) -> str:
+        return "\n".join(entry["raw"] for entry in self.lines)
+
+    def find_field(self, label: str) -> NumericField | None:
+        """First numeric field whose label matches (exact first, then substring)."""
+        key = label.lower().strip()
+        for f in self.fields:
+            if f.label.lower() == key:
+                return f
+        for f in self.fields:
+            if key in f.label.lower():
+                return f
+        return None
+
+    def section(self, header: str) -> SheetSection | None:
+        for sec in self.sections:
+            if sec.header.lower() == header.lower():
+                return sec
+        return None
+
+
+def _line_fields(raw: str, line_idx: int, path: list[str], json_path=None) -> list[NumericField]:
+    fields = []
+    for m in NUMBER_RE.finditer(raw):
+        # "-" is only a sign when it does not follow a word ("4-5" stays a range)
+        start = m.start()
+        if raw[start] == "-" and start > 0 and raw[start - 1].isalnum():
+            start += 1
+        label = LABEL_STRIP_RE.sub(" ", raw[:start]).strip()
+        label = " ".join(label.split()[-3:]) if label else (path[-1] if path else "")
+        fields.append(NumericField(
+            label=label,
+            value=int(raw[start:m.end()]),
+            line_idx=line_idx,
+            start=start,
+            end=m.end(),
+            path=list(path),
+            json_path=json_path,
+        ))
+    return fields
+
+
+def build_model(sheet: CharacterSheet, json_paths: dict | None = None):
+    """(Re)compute header paths, sections and numeric fields from sheet.lines."""
+    json_paths = json_paths or {}
+    stack = []                  # (level, header) of the open headers
+    current_path = []
+    sections = []
+    fields = []
+
+    for idx, entry in enumerate(sheet.lines):
+        stripped = entry["raw"].strip()
+        entry["line"] = stripped
+        m = HEADER_RE.match(stripped)
+        if m:
+            level = len(m.group(1))
+            header = m.group(2).strip()
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, header))
+            current_path = [h for _, h in stack]
+            # Close every open section at the same or deeper level
+            for sec in sections:
+                if sec.end == -1 and sec.level >= level:
+                    sec.end = idx
+            sections.append(SheetSection(header, level, list(current_path), idx, -1))
+        entry["path"] = list(current_path)
+        if stripped:
+            fields.extend(_line_fields(entry["raw"], idx, current_path, json_paths.get(idx)))
+
+    for sec in sections:
+        if sec.end == -1:
+            sec.end = len(sheet.lines)
+
+    sheet.sections = sections
+    sheet.fields = fields
+
+
+# ---------------------------------------------------------
+# Section selection per submode
+# ---------------------------------------------------------
+@lru_cache(maxsize=64)
+def _keyword_pattern(keywords: tuple[str, ...]):
+    """Whole words only, with an optional plural: "stat" matches "Stats" but not "Status"."""
+    if not keywords:
+        return None
+    words = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"\b(?:{words})(?:s|es)?\b", re.IGNORECASE)
+
+
+def _relevance(path: list[str], profile: dict) -> str:
+    """
+    'keep', 'drop' or 'neutral' for a chunk, from the headers of its path.
+    A 'keep' keyword on any of them wins, so a subsection of a kept section
+    stays in even if its own header holds a 'drop' keyword (e.g. "Weaponized
+    Charm" under "Clichés" in roleplay); otherwise a 'drop' keyword on any
+    of them drops the chunk.
+    """
+    keep = _keyword_pattern(tuple(profile.get("keep", ())))
+    drop = _keyword_pattern(tuple(profile.get("drop", ())))
+    if keep and any(keep.search(header) for header in path):
+        return "keep"
+    if drop and any(drop.search(header) for header in path):
+        return "drop"
+    return "neutral"
+
+
+def select_sections(sheet: CharacterSheet, profile: dict, count_tokens=None) -> str:
+    """
+    Prompt text of the sheet sections a submode needs.
+    The sheet is cut into chunks (each header with its own lines up to the next
+    header). Chunks under a 'keep' header always go in, 'drop' chunks never do,
+    and the others fill what is left of the profile's token budget in sheet
+    order. Parent headers of a selected chunk are kept for structure.
+    """
+    lines = [entry["raw"] for entry in sheet.lines]
+    starts = [sec.start for sec in sheet.sections]
+    chunks = []                 # (path, start, end, parent chunk index)
+    if not starts or starts[0] > 0:
+        chunks.append(([], 0, starts[0] if starts else len(lines), None))
+    stack = []                  # (level, chunk index) of the open headers
+    for i, sec in enumerate(sheet.sections):
+        while stack and stack[-1][0] >= sec.level:
+            stack.pop()
+        end = starts[i + 1] if i + 1 < len(starts) else len(lines)
+        chunks.append((sec.path, sec.start, end, stack[-1][1] if stack else None))
+        stack.append((sec.level, len(chunks) - 1))
+
+    text_of = lambda c: "\n".join(lines[c[1]:c[2]]).strip()
+    relevance = [_relevance(c[0], profile) for c in chunks]
+    selected = {i for i, r in enumerate(relevance) if r == "keep"}
+    budget = profile.get("budget")
+    if count_tokens and budget:
+        used = sum(count_tokens(text_of(chunks[i])) for i in selected)
+        for i, r in enumerate(relevance):
+            if r == "neutral":
+                tokens = count_tokens(text_of(chunks[i]))
+                if used + tokens <= budget:
+                    selected.add(i)
+                    used += tokens
+    else:
+        selected |= {i for i, r in enumerate(relevance) if r == "neutral"}
+    if not selected:
+        return sheet.to_text().strip()
+
+    out = []
+    emitted = set()
+    for i in sorted(selected):
+        parents = []
+        parent = chunks[i][3]
+        while parent is not None and parent not in emitted:
+            parents.append(parent)
+            parent = chunks[parent][3]
+        for p in reversed(parents):
+            if p not in selected:
+                out.append(lines[chunks[p][1]])     # header line only
+            emitted.add(p)
+        if i not in emitted:
+            out.append(text_of(chunks[i]))
+            emitted.add(i)
+    return "\n".join(line for line in out if line).strip()
+
+
+def parse_markdown_sheet(path: Path, text: str, mtime: float) -> CharacterSheet:
+    sheet = CharacterSheet(
+        name=path.stem,
+        path=path,
+        source="markdown",
+        mtime=mtime,
+        lines=[{"raw": line} for line in text.splitlines()],
+    )
+    build_model(sheet)
+    return sheet
+
+
+def _title(key: str) -> str:
+    return key.replace("_", " ").strip().title()
+
+
+def render_json_sheet(data: dict) -> tuple[list[str], dict]:
+    """
+    Render a JSON character sheet as Markdown lines.
+    Returns the lines and a map of line index -> JSON path for numeric leaves.
+    """
+    lines = []
+    json_paths = {}
+
+    def emit_value(key, value, path, level):
+        if isinstance(value, bool) or value is None:
+            lines.append(f"**{_title(key)}:** {value}")
+        elif isinstance(value, (int, float)):
+            json_paths[len(lines)] = path
+            lines.append(f"**{_title(key)}:** {value}")
+        elif isinstance(value, str):
+            if level <= 2:
+                lines.append(f"{'#' * level} {_title(key)}")
+                lines.append(value)
+            else:
+                lines.append(f"**{_title(key)}:** {value}")
+        elif isinstance(value, list):
+            lines.append(f"{'#' * level} {_title(key)}" if level <= 2 else f"**{_title(key)}**")
+            for i, item in enumerate(value):
+                if isinstance(item, dict):
+                    title = item.get("name", f"{_title(key)} {i + 1}")
+                    lines.append(f"{'#' * min(level + 1, 6)} {title}")
+                    for k, v in item.items():
+                        if k != "name":
+                            emit_value(k, v, path + [i, k], level + 2)
+                elif isinstance(item, (int, float)) and not isinstance(item, bool):
+                    json_paths[len(lines)] = path + [i]
+                    lines.append(f"- {item}")
+                else:
+                    lines.append(f"- {item}")
+        elif isinstance(value, dict):
+            lines.append(f"{'#' * min(level, 6)} {_title(key)}")
+            for k, v in value.items():
+                emit_value(k, v, path + [k], level + 1)
+        if level <= 2:
+            lines.append("")
+
+    for key, value in data.items():
+        emit_value(key, value, [key], 2)
+
+    return lines, json_paths
+
+
+def parse_json_sheet(path: Path, text: str, mtime: float) -> CharacterSheet:
+    data = json.loads(text)
+    rendered, json_paths = render_json_sheet(data)
+    sheet = CharacterSheet(
+        name=path.stem,
+        path=path,
+        source="json",
+        mtime=mtime,
+        lines=[{"raw": line} for line in rendered],
+        json_data=data,
+    )
+    build_model(sheet, json_paths)
+    return sheet
+
+
+def _set_json_value(data, json_path: list, value):
+    target = data
+    for key in json_path[:-1]:
+        target = target[key]
+    target[json_path[-1]] = value
+
+
+# ---------------------------------------------------------
+# Store
+# ---------------------------------------------------------
+class SheetStore:
+    """
+    Parses each character sheet (Markdown or JSON) once and keeps it in memory:
+      - header paths, sections and numeric fields
+      - cached prompt rendering and token count per sheet version
+      - numeric edits batched in memory, flushed to disk after SHEET_FLUSH_DELAY
+        seconds without further edits (one write per sheet)
+    """
+
+    def __init__(self, vault_root: Path, count_tokens=None, flush_delay: float = SHEET_FLUSH_DELAY):
+        self.vault_root = vault_root
+        self.count_tokens = count_tokens
+        self.flush_delay = flush_delay
+        self.sheets: dict[Path, CharacterSheet] = {}
+        self._prompt_cache = {}   # path -> (version, text, tokens)
+        self._selection_cache = {}  # (path, submode) -> (version, text, tokens)
+        self.selection_stats = {}   # submode -> {"calls", "full", "selected"}
+        self._editors = {}        # path -> (version, SnitchEditor)
+        self._timer = None
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+    def _resolve(self, path: Path) -> Path:
+        path = Path(path)
+        if not path.is_absolute():
+            path = self.vault_root / path
+        return safe_resolve(self.vault_root, str(path.relative_to(self.vault_root)))
+
+    def get(self, path: Path) -> CharacterSheet | None:
+        """Return the parsed sheet, re-parsing only if the file changed on disk."""
+        path = self._resolve(path)
+        with self._lock:
+            sheet = self.sheets.get(path)
+            if not path.exists():
+                return sheet
+            mtime = path.stat().st_mtime
+            if sheet and (sheet.mtime == mtime or sheet.dirty):
+                return sheet
+
+            text = path.read_text(encoding="utf-8")
+            if path.suffix.lower() == ".json":
+                new_sheet = parse_json_sheet(path, text, mtime)
+            else:
+                new_sheet = parse_markdown_sheet(path, text, mtime)
+            if sheet:
+                new_sheet.version = sheet.version + 1
+            self.sheets[path] = new_sheet
+            return new_sheet
+
+    def text(self, path: Path) -> str:
+        sheet = self.get(path)
+        return sheet.to_text() if sheet else ""
+
+    # ------------------------------------------------------------------
+    # Prompt rendering
+    # ------------------------------------------------------------------
+    def prompt_text(self, path: Path, submode: str = None, record: bool = True) -> str:
+        """
+        Prompt rendering of the sheet; with a submode, only the sections its profile selects.
+        record=False leaves the selection stats untouched (cache prewarming).
+        """
+        if submode in SUBMODE_SHEET_PROFILES:
+            return self._selected(path, submode, record)
+        return self._compiled(path)[0]
+
+    def prompt_tokens(self, path: Path) -> int:
+        return self._compiled(path)[1]
+
+    def _compiled(self, path: Path) -> tuple[str, int]:
+        sheet = self.get(path)
+        if not sheet:
+            return "", 0
+        cached = self._prompt_cache.get(sheet.path)
+        if cached and cached[0] == sheet.version:
+            return cached[1], cached[2]
+
+        text = sheet.to_text().strip()
+        tokens = self.count_tokens(text) if self.count_tokens else 0
+        self._prompt_cache[sheet.path] = (sheet.version, text, tokens)
+        return text, tokens
+
+    def _selected(self, path: Path, submode: str, record: bool = True) -> str:
+        """Submode selection of a sheet, cached per sheet version and submode."""
+        full_text, full_tokens = self._compiled(path)
+        sheet = self.get(path)
+        if not sheet:
+            return ""
+        key = (sheet.path, submode)
+        cached = self._selection_cache.get(key)
+        if cached and cached[0] == sheet.version:
+            text, tokens = cached[1], cached[2]
+        else:
+            text = select_sections(sheet, SUBMODE_SHEET_PROFILES[submode], self.count_tokens)
+            tokens = self.count_tokens(text) if self.count_tokens else 0
+            self._selection_cache[key] = (sheet.version, text, tokens)
+
+        if not record:
+            return text
+        with self._lock:
+            stats = self.selection_stats.setdefault(submode, {"calls": 0, "full": 0, "selected": 0})
+            stats["calls"] += 1
+            stats["full"] += full_tokens
+            stats["selected"] += tokens
+        return text
+
+    def selection_report(self):
+        if not self.selection_stats:
+            return
+        console.print("[bold cyan]Sheet sections per submode:[/bold cyan]")
+        for submode, s in self.selection_stats.items():
+            saved = s["full"] - s["selected"]
+            share = f" ({saved / s['full']:.0%})" if s["full"] else ""
+            console.print(f"  {submode}: {s['calls']} sheet(s), {s['full']} → {s['selected']} tokens, saved {saved}{share}")
+
+    def editor(self, path: Path) -> SnitchEditor | None:
+        """SnitchEditor sharing the store's parsed lines, cached per sheet version."""
+        sheet = self.get(path)
+        if not sheet:
+            return None
+        cached = self._editors.get(sheet.path)
+        if cached and cached[0] == sheet.version:
+            return cached[1]
+        editor = SnitchEditor(
+            sheet.to_text(),
+            sheet_lines=[entry for entry in sheet.lines if entry["line"]],
+        )
+        self._editors[sheet.path] = (sheet.version, editor)
+        return editor
+
+    # ------------------------------------------------------------------
+    # Edits
+    # ------------------------------------------------------------------
+    def _touch(self, sheet: CharacterSheet):
+        sheet.version += 1
+        sheet.dirty = True
+        self._schedule_flush()
+
+    def set_value(self, path: Path, label: str, value: int) -> NumericField | None:
+        """Set the first numeric field matching label. The write is debounced."""
+        with self._lock:
+            sheet = self.get(path)
+            f = sheet.find_field(label) if sheet else None
+            if not f:
+                return None
+            entry = sheet.lines[f.line_idx]
+            entry["raw"] = entry["raw"][:f.start] + str(value) + entry["raw"][f.end:]
+            if sheet.source == "json" and f.json_path:
+                _set_json_value(sheet.json_data, f.json_path, value)
+            build_model(sheet, {x.line_idx: x.json_path for x in sheet.fields if x.json_path})
+            self._touch(sheet)
+            return sheet.find_field(label)
+
+    def adjust(self, path: Path, label: str, delta: int, min_value: int = None, max_value: int = None):
+        """Add delta to a numeric field, clamped to optional bounds."""
+        with self._lock:
+            sheet = self.get(path)
+            f = sheet.find_field(label) if sheet else None
+            if not f:
+                return None
+            value = f.value + delta
+            if min_value is not None:
+                value = max(min_value, value)
+            if max_value is not None:
+                value = min(max_value, value)
+            return self.set_value(path, label, value)
+
+    def sync_editor(self, path: Path):
+        """Pick up line edits made through a SnitchEditor returned by editor()."""
+        with self._lock:
+            sheet = self.get(path)
+            if not sheet:
+                return
+            changed = False
+            for entry in sheet.lines:
+                if entry["line"] and entry["line"] != entry["raw"].strip():
+                    indent = entry["raw"][: len(entry["raw"]) - len(entry["raw"].lstrip())]
+                    entry["raw"] = indent + entry["line"]
+                    changed = True
+            if changed:
+                build_model(sheet, {x.line_idx: x.json_path for x in sheet.fields if x.json_path})
+                self._touch(sheet)
+
+    def append_to_section(self, path: Path, header: str, entries: list[str]):
+        """Append bullet entries under a section and write the sheet once, immediately."""
+        with self._lock:
+            sheet = self.get(path)
+            if not sheet:
+                return
+            if sheet.source == "json":
+                target = sheet.json_data
+                for value in sheet.json_data.values():
+                    if isinstance(value, dict) and header.lower() in value:
+                        target = value
+                key, existing = header.lower(), target.get(header.lower())
+                if existing is None:
+                    target[key] = list(entries)
+                elif isinstance(existing, list):
+                    existing.extend(entries)
+                elif isinstance(existing, str):
+                    # A single text value becomes the first entry of the list
+                    target[key] = ([existing] if existing.strip() else []) + list(entries)
+                else:
+                    console.print(f"[yellow]{sheet.name}: '{key}' is not a list in the JSON sheet, entries not added.[/yellow]")
+                    return
+                rendered, json_paths = render_json_sheet(sheet.json_data)
+                sheet.lines = [{"raw": line} for line in rendered]
+                build_model(sheet, json_paths)
+            else:
+                text = append_to_section(sheet.to_text(), header, entries)
+                sheet.lines = [{"raw": line} for line in text.splitlines()]
+                build_model(sheet)
+            sheet.version += 1
+            sheet.dirty = True
+            self._write(sheet)
+
+    # ------------------------------------------------------------------
+    # Write-back
+    # ------------------------------------------------------------------
+    def _schedule_flush(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.flush_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _write(self, sheet: CharacterSheet):
+        if sheet.source == "json":
+            text = json.dumps(sheet.json_data, indent=2, ensure_ascii=False)
+        else:
+            text = sheet.to_text() + "\n"
+        sheet.path.write_text(text, encoding="utf-8")
+        sheet.mtime = sheet.path.stat().st_mtime
+        sheet.dirty = False
+
+    def flush(self):
+        """Write every sheet with pending edits (one write per sheet)."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            for sheet in self.sheets.values():
+                if sheet.dirty:
+                    try:
+                        self._write(sheet)
+                        console.print(f"[dim][sheets] Saved {sheet.name}[/dim]")
+                    except Exception as e:
+                        console.print(f"[red][sheets] Failed to save {sheet.name}: {e}[/red]")
@@ -0,0 +1,173 @@
+# snapshot.py
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from utils import LazyConsole
+from npc_library import Roster
+
+console = LazyConsole()
+
+SNAPSHOT_VERSION = 2
+_save_lock = threading.Lock()
+
+
+def snapshot_path(scene_path: Path) -> Path:
+    return scene_path.with_name(scene_path.name + ".snapshot.json")
+
+
+# ---------------------------------------------------------
+# Source validation
+# ---------------------------------------------------------
+def _sha1(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def fingerprint(path: Path) -> dict:
+    st = path.stat()
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": _sha1(path)}
+
+
+def fingerprint_matches(path: Path, fp: dict) -> bool:
+    """
+    Cheap check first (mtime + size), content hash only when those differ,
+    so a touched-but-unchanged file does not invalidate the snapshot.
+    """
+    if not path.exists():
+        return False
+    st = path.stat()
+    if st.st_mtime_ns == fp.get("mtime_ns") and st.st_size == fp.get("size"):
+        return True
+    return st.st_size == fp.get("size") and _sha1(path) == fp.get("sha1")
+
+
+def _sources(gm, roster_paths=None) -> list[Path]:
+    """Files whose content the snapshot depends on: scene, roster sheets and prompt files."""
+    paths = [gm.agent.get_active_scene_path()]
+    paths += list(gm.agent.character_paths if roster_paths is None else roster_paths)
+    paths += sorted(gm.pm.prompts_dir.rglob("*.md"))
+    return [p for p in paths if p and p.exists()]
+
+
+# ---------------------------------------------------------
+# Save
+# ---------------------------------------------------------
+def save_snapshot(gm) -> Path | None:
+    """Write the session snapshot next to the active scene (atomic replace)."""
+    scene_path = gm.agent.get_active_scene_path()
+    if not scene_path or not scene_path.exists():
+        return None
+
+    with _save_lock:
+        with gm.agent.scene_lock:
+            sources = {str(p.relative_to(gm.agent.vault_root)): fingerprint(p) for p in _sources(gm)}
+
+        last_append = gm.agent._last_llm_append
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "model": gm.agent.model,
+            "scene": str(scene_path.relative_to(gm.agent.vault_root)),
+            "sources": sources,
+            "roster": {
+                "names": list(gm.agent.character_names),
+                "paths": [str(p.relative_to(gm.agent.vault_root)) for p in gm.agent.character_paths],
+                "active": gm.agent.active_character_index,
+                "active_dir": sorted(p.name for p in gm.agent.characters_dir.glob("*.md")),
+            },
+            "session": {
+                "submode": gm.current_submode,
+                "auto_mode": gm.auto_mode,
+                "retry_feedback": list(gm.retry_feedback),
+                "retry_context": getattr(gm.agent, "_retry_context", None),
+                "last_llm_append": {**last_append, "file": str(last_append["file"])} if last_append else None,
+            },
+            "token_cache": gm.agent.token_cache_items(),
+        }
+
+        path = snapshot_path(scene_path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        return path
+
+
+# ---------------------------------------------------------
+# Load
+# ---------------------------------------------------------
+def load_snapshot(gm) -> dict | None:
+    """
+    Read the snapshot of the active scene in one go.
+    Returns None when there is none or its version does not match;
+    otherwise the data with "fresh" set to whether every source is unchanged.
+    """
+    scene_path = gm.agent.get_active_scene_path()
+    if not scene_path:
+        return None
+    path = snapshot_path(scene_path)
+    if not path.exists():
+        return None
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        console.print(f"[yellow][snapshot] Unreadable snapshot ignored: {e}[/yellow]")
+        return None
+    if data.get("version") != SNAPSHOT_VERSION:
+        return None
+
+    # Sheets are checked against the roster of the saved session (NPCs may have
+    # been added from the library), plus any change to Characters/Active itself
+    vault_root = gm.agent.vault_root
+    roster = data.get("roster", {})
+    current = {str(p.relative_to(vault_root)) for p in _sources(gm, [vault_root / p for p in roster.get("paths", [])])}
+    recorded = data.get("sources", {})
+    data["fresh"] = (
+        data.get("model") == gm.agent.model
+        and roster.get("active_dir") == sorted(p.name for p in gm.agent.characters_dir.glob("*.md"))
+        and current == set(recorded)
+        and all(fingerprint_matches(vault_root / rel, fp) for rel, fp in recorded.items())
+    )
+    return data
+
+
+def restore_snapshot(gm) -> bool:
+    """
+    Resume the session from the snapshot when every source is unchanged.
+    Token counts are keyed by content, so they are reused even from a stale snapshot.
+    Returns True when the session state was restored.
+    """
+    start = time.perf_counter()
+    data = load_snapshot(gm)
+    if data is None:
+        return False
+
+    if data.get("model") == gm.agent.model:
+        gm.agent.seed_token_cache(data.get("token_cache", {}))
+
+    if not data["fresh"]:
+        console.print("[dim][snapshot] Scene, sheets or prompts changed since the last session — full rebuild.[/dim]")
+        return False
+
+    roster = data["roster"]
+    gm.agent.roster = Roster(gm.agent.vault_root / p for p in roster["paths"])
+    if gm.agent.character_names == roster["names"] and 0 <= roster["active"] < len(roster["names"]):
+        gm.agent.active_character_index = roster["active"]
+
+    session = data["session"]
+    gm.current_submode = session["submode"]
+    gm.submode_instruction_text = "" if gm.current_submode == "group" else gm.pm.submode(gm.current_submode)
+    gm.auto_mode = session["auto_mode"]
+    gm.retry_feedback = session["retry_feedback"]
+    if session["retry_context"]:
+        gm.agent._retry_context = session["retry_context"]
+    if session["last_llm_append"]:
+        gm.agent._last_llm_append = {**session["last_llm_append"], "file": Path(session["last_llm_append"]["file"])}
+
+    console.print(
+        f"[cyan][snapshot] Resumed {data['scene']}: {gm.current_submode} mode, "
+        f"active {gm.agent.character_names[gm.agent.active_character_index] if gm.agent.character_names else '-'} "
+        f"({(time.perf_counter() - start) * 1000:.0f} ms)[/cyan]"
+    )
+    return True
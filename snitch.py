@@ -1,20 +1,124 @@
 # snitch.py
 import re
-from rich.console import Console
+from utils import LazyConsole
 
-console = Console()
+console = LazyConsole()
 
 NUMBER_RE = re.compile(r"(\d+)")
+FORMATTING_RE = re.compile(r"[_*`]")
+CANDIDATE_STRIP_RE = re.compile(r"[*_`>#-]")
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher.
+    Patterns are compiled once into a trie with failure links, then any text
+    is scanned in a single pass regardless of the number of patterns.
+    """
+
+    def __init__(self, patterns: dict[str, set]):
+        # patterns: pattern string -> payloads reported when it is found
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+
+        for pattern, payloads in patterns.items():
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                node = nxt
+            self.out[node] |= set(payloads)
+
+        # Breadth-first pass to build failure links and merge outputs
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def search(self, text: str) -> set:
+        """Return the union of payloads of every pattern occurring in text."""
+        found = set()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+def extract_candidates(raw_line: str) -> list[str]:
+    """
+    Words or phrases of a sheet line worth looking for in LLM output:
+    proper nouns, multiword capitalized phrases, long nouns, and the
+    whole line when it carries a number.
+    """
+    clean = CANDIDATE_STRIP_RE.sub("", raw_line).strip()
+    if not clean:
+        return []
+
+    tokens = clean.split()
+    candidates = []
+
+    # Proper nouns
+    for t in tokens:
+        if t[:1].isupper() and len(t) > 2:
+            candidates.append(t)
+
+    # Multiword proper phrases
+    capital_words = [t for t in tokens if t[:1].isupper()]
+    if len(capital_words) >= 2:
+        candidates.append(" ".join(capital_words))
+
+    # Long nouns
+    for t in tokens:
+        if len(t) >= 8 and not t.lower().endswith(("ing", "ed")):
+            candidates.append(t)
+
+    # Lines with numbers only trigger on a full-line quote
+    if NUMBER_RE.search(clean):
+        candidates.append(clean)
+
+    return [c.lower() for c in candidates]
+
 
 class SnitchEditor:
-    def __init__(self, sheet_text: str):
+    def __init__(self, sheet_text: str, sheet_lines: list[dict] = None):
         self.sheet_text = sheet_text
         self.sheet_lines = []
-        self.parse_sheet(sheet_text)
+        self.version = 0
+        self._matcher = None
+        self._matcher_version = None
+        if sheet_lines is not None:
+            # Pre-parsed lines (e.g. from SheetStore) — skip re-parsing
+            self.sheet_lines = sheet_lines
+            self.version = 1
+        else:
+            self.parse_sheet(sheet_text)
 
     def parse_sheet(self, text: str):
         """Parse Markdown sheet into structured lines with path info."""
         self.sheet_lines = []
+        self.version += 1
         current_path = []
 
         for line in text.splitlines():
@@ -34,22 +138,48 @@ class SnitchEditor:
                 "path": list(current_path)
             })
 
+    def match_at(self, idx: int) -> dict:
+        """Build a match record for the sheet line at idx."""
+        line_info = self.sheet_lines[idx]
+        return {
+            "line_idx": idx,
+            "line": line_info["line"],
+            "path": line_info["path"],
+            "context": " -> ".join(line_info["path"] + [line_info["line"]])
+        }
+
     def find_matches(self, keyword: str):
         """Find all lines containing the keyword, ignoring Markdown formatting."""
         matches = []
         keyword_lower = keyword.lower().strip()
         for idx, line_info in enumerate(self.sheet_lines):
             # Remove Markdown formatting for matching
-            plain_line = re.sub(r"[_*`]", "", line_info["line"]).lower()
+            plain_line = FORMATTING_RE.sub("", line_info["line"]).lower()
             if keyword_lower in plain_line:
-                matches.append({
-                    "line_idx": idx,
-                    "line": line_info["line"],
-                    "path": line_info["path"],
-                    "context": " -> ".join(line_info["path"] + [line_info["line"]])
-                })
+                matches.append(self.match_at(idx))
         return matches
 
+    def candidate_matcher(self) -> AhoCorasick:
+        """
+        Automaton over the auto-detection candidates of every non-header line,
+        each pattern reporting the indices of the lines it came from.
+        Rebuilt only when the sheet version changes.
+        """
+        if self._matcher is not None and self._matcher_version == self.version:
+            return self._matcher
+
+        patterns = {}
+        for idx, entry in enumerate(self.sheet_lines):
+            raw_line = entry["line"].strip()
+            if raw_line.startswith("#"):
+                continue
+            for candidate in extract_candidates(raw_line):
+                patterns.setdefault(candidate, set()).add(idx)
+
+        self._matcher = AhoCorasick(patterns)
+        self._matcher_version = self.version
+        return self._matcher
+
 
     def print_matches(self, matches):
         for i, m in enumerate(matches, 1):
@@ -73,6 +203,7 @@ class SnitchEditor:
                 # Replace first number in the line
                 new_line = line_text[:num_match.start(1)] + str(new_val) + line_text[num_match.end(1):]
                 self.sheet_lines[idx]["line"] = new_line
+                self.version += 1
                 console.print(f"[Snitch] Number adjusted: {line_text} -> {new_line}", style="bold green")
                 return idx
             idx -= 1
@@ -92,61 +223,54 @@ def write_vault_file(vault_root, rel_path, text):
         raise ValueError("Illegal path escape attempt")
     p.write_text(text, encoding="utf-8")
 
-def run_snitch_auto_detection(assistant_text, editor, console):
+def append_to_section(text: str, header: str, entries: list[str], default_level: int = 2) -> str:
     """
-    Run auto-detection on the assistant's output.
-    Returns the list of hits (or empty list).
+    Append bullet entries at the end of the section titled `header` (any level).
+    The section ends at the next header of the same or higher level.
+    Creates the section at the end of the sheet if it does not exist.
     """
+    lines = text.rstrip().splitlines()
+    bullets = [f"- {e.strip()}" for e in entries if e.strip()]
+    if not bullets:
+        return text
 
-    assistant_l = assistant_text.lower()
-    hits = []
-
-    for entry in editor.sheet_lines:
-        raw_line = entry["line"].strip()
-        if raw_line.startswith("#"):
-            continue
+    start = None
+    level = None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            lvl = len(stripped) - len(stripped.lstrip("#"))
+            if stripped[lvl:].strip().lower() == header.lower():
+                start, level = i, lvl
+                break
 
-        clean = re.sub(r"[*_`>#-]", "", raw_line).strip()
-        if not clean:
-            continue
+    if start is None:
+        lines += ["", f"{'#' * default_level} {header}"] + bullets
+        return "\n".join(lines) + "\n"
 
-        has_number = bool(re.search(r"\d+", clean))
-        tokens = clean.split()
-        candidates = []
+    end = len(lines)
+    for i in range(start + 1, len(lines)):
+        stripped = lines[i].strip()
+        if stripped.startswith("#") and len(stripped) - len(stripped.lstrip("#")) <= level:
+            end = i
+            break
 
-        # Proper nouns
-        for t in tokens:
-            if t[:1].isupper() and len(t) > 2:
-                candidates.append(t)
+    # Insert after the last non-empty line of the section
+    insert_at = end
+    while insert_at > start + 1 and not lines[insert_at - 1].strip():
+        insert_at -= 1
+    lines[insert_at:insert_at] = bullets
+    return "\n".join(lines) + "\n"
 
-        # Multiword proper phrases
-        capital_words = [t for t in tokens if t[:1].isupper()]
-        if len(capital_words) >= 2:
-            candidates.append(" ".join(capital_words))
-
-        # Long nouns
-        for t in tokens:
-            if len(t) >= 8 and not t.lower().endswith(("ing", "ed")):
-                candidates.append(t)
-
-        if not candidates and not has_number:
-            continue
-
-        found = False
-
-        if has_number and clean.lower() in assistant_l:
-            found = True
-
-        if not found:
-            for c in candidates:
-                if c.lower() in assistant_l:
-                    found = True
-                    break
+def run_snitch_auto_detection(assistant_text, editor, console):
+    """
+    Run auto-detection on the assistant's output.
+    The reply is scanned once against the editor's cached candidate automaton.
+    Returns the list of hits (or empty list).
+    """
 
-        if found:
-            m = editor.find_matches(clean)
-            if m:
-                hits.extend(m)
+    line_indices = editor.candidate_matcher().search(assistant_text.lower())
+    hits = [editor.match_at(idx) for idx in sorted(line_indices)]
 
     # ----- Print first hit if any -----
     if hits:
@@ -0,0 +1,120 @@
+# tokenizer.py
+"""
+Offline tiktoken encodings.
+
+tiktoken downloads its BPE files on first use. Here they are read from
+TOKENIZER_CACHE_DIR (shipped with the vault) instead, so token counting
+never touches the network:
+
+    python tokenizer.py                          # download into the vault cache (online machine)
+    python tokenizer.py --from cl100k_base.tiktoken   # provision from a copied file (air-gapped)
+    python tokenizer.py --check                  # show what is provisioned
+"""
+import hashlib
+import os
+import re
+import sys
+from functools import lru_cache
+from pathlib import Path
+from config import TOKENIZER_CACHE_DIR, FALLBACK_ENCODING
+from utils import LazyConsole
+
+console = LazyConsole()
+
+# Source URL (the tiktoken cache key) and sha256 of each BPE file
+ENCODINGS = {
+    "cl100k_base": (
+        "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+        "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7",
+    ),
+    "o200k_base": (
+        "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+        "446a9538cb6c348e3516120d7c08b09f57c36495e2acfffe59a5bf8b0cfb1a2d",
+    ),
+}
+
+APPROX_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+class ApproxEncoding:
+    """
+    Used when no BPE file is provisioned: roughly one token per 4 word
+    characters or punctuation mark, close enough for budgets and warnings.
+    """
+    name = "approx"
+
+    def encode(self, text: str, **kwargs) -> list[int]:
+        return [0] * len(APPROX_TOKEN_RE.findall(text))
+
+
+def cache_file(name: str) -> Path:
+    """Where tiktoken looks for an encoding inside TIKTOKEN_CACHE_DIR (sha1 of its URL)."""
+    url, _ = ENCODINGS[name]
+    return TOKENIZER_CACHE_DIR / hashlib.sha1(url.encode()).hexdigest()
+
+
+def is_provisioned(name: str) -> bool:
+    return name not in ENCODINGS or cache_file(name).exists()
+
+
+def _use_vault_cache():
+    # Must be set before tiktoken reads its first file; an explicit setting wins
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(TOKENIZER_CACHE_DIR))
+
+
+def provision(name: str = FALLBACK_ENCODING, source: Path = None) -> Path:
+    """
+    Put an encoding into the vault cache, from a local .tiktoken file or by
+    downloading it (needs network). The file is checked against its known hash.
+    """
+    target = cache_file(name)
+    _, expected = ENCODINGS[name]
+    if source is not None:
+        data = Path(source).read_bytes()
+        if hashlib.sha256(data).hexdigest() != expected:
+            raise ValueError(f"{source} is not the {name} BPE file (hash mismatch)")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+    else:
+        _use_vault_cache()
+        import tiktoken
+        tiktoken.get_encoding(name)
+    return target
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    Encoding for a model (or FALLBACK_ENCODING for models tiktoken does not know),
+    loaded from the vault cache. Never downloads: without a provisioned file an
+    ApproxEncoding is returned and a warning printed once.
+    """
+    _use_vault_cache()
+    import tiktoken
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = FALLBACK_ENCODING
+
+    if not is_provisioned(name) and os.environ["TIKTOKEN_CACHE_DIR"] == str(TOKENIZER_CACHE_DIR):
+        console.print(
+            f"[yellow][tokenizer] {name} is not provisioned in {TOKENIZER_CACHE_DIR} — using approximate counts. "
+            f"Run 'python tokenizer.py' (online) or 'python tokenizer.py --from {name}.tiktoken'.[/yellow]"
+        )
+        return ApproxEncoding()
+    return tiktoken.get_encoding(name)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--check"]:
+        for enc in ENCODINGS:
+            state = "[green]provisioned[/green]" if is_provisioned(enc) else "[red]missing[/red]"
+            console.print(f"{enc}: {state} ({cache_file(enc)})")
+    elif args[:1] == ["--from"] and len(args) >= 2:
+        src = Path(args[1])
+        enc = args[2] if len(args) > 2 else src.stem
+        console.print(f"[green]{enc} provisioned → {provision(enc, src)}[/green]")
+    else:
+        for enc in args or [FALLBACK_ENCODING]:
+            console.print(f"[green]{enc} provisioned → {provision(enc)}[/green]")
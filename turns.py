@@ -1,11 +1,11 @@
 import re
 from config import AUTO_SUMMARIZE, CONTEXT_THRESHOLD, prompts_dir
-from rich.console import Console
+from utils import LazyConsole
 from pathlib import Path
-from config import TURNS_TO_KEEP
-from utils import DEFAULT_MODEL_TOKEN_LIMIT
+from config import TURNS_TO_KEEP, COLD_STORAGE, ROLLUP_FACTOR, ROLLUP_MAX_LEVEL
+from cold_storage import freeze_summarized_turns
 
-console = Console()
+console = LazyConsole()
 
 def ensure_current_turn(scene_path):
     """
@@ -74,27 +74,35 @@ def advance_turn(scene_path, agent, current_turn=None):
     if current_turn is None:
         current_turn = last_turn
 
-    new_turn = last_turn + 1
-
     # --- Auto-summary based on token usage ---
-    if AUTO_SUMMARIZE and hasattr(agent, "_last_token_usage") and DEFAULT_MODEL_TOKEN_LIMIT:
-        usage_ratio = agent._last_token_usage / DEFAULT_MODEL_TOKEN_LIMIT
+    token_limit = agent.model_token_limit() if AUTO_SUMMARIZE and hasattr(agent, "_last_token_usage") else None
+    if token_limit:
+        usage_ratio = agent._last_token_usage / token_limit
         if usage_ratio >= CONTEXT_THRESHOLD:
             console.print(f"[yellow]Token usage {usage_ratio*100:.1f}% — auto-summarizing previous turns[/yellow]")
             summarize_scene_turns(scene_path, agent)
-            # Refresh lines after summarization
-            lines = scene_path.read_text(encoding="utf-8").splitlines()
 
-    # --- Append new turn ---
-    console.print(f"[cyan]Advancing to Turn {new_turn}…[/cyan]")
-    lines.append(f"# Turn {new_turn}")
-    scene_path.write_text("\n".join(lines), encoding="utf-8")
+    # --- Append new turn (re-read: summaries and narration may have changed the file) ---
+    with agent.scene_lock:
+        lines = scene_path.read_text(encoding="utf-8").splitlines()
+        turn_numbers = [int(turn_pattern.match(l).group(1)) for l in lines if turn_pattern.match(l)]
+        new_turn = (max(turn_numbers) if turn_numbers else 0) + 1
+        console.print(f"[cyan]Advancing to Turn {new_turn}…[/cyan]")
+        lines.append(f"# Turn {new_turn}")
+        scene_path.write_text("\n".join(lines), encoding="utf-8")
     console.print(f"[bold green]Turn {new_turn} created.[/bold green]")
 
     return new_turn
 
 
 
+def rewrite_scene(scene_path: Path, agent, lines: list[str]):
+    """Write the rewritten scene (under agent.scene_lock) and keep the agent's rollback offsets on their text."""
+    before = scene_path.read_bytes()
+    scene_path.write_text("\n".join(lines), encoding="utf-8")
+    agent.follow_scene_rewrite(scene_path, before)
+
+
 def summarize_turn(turn_text, agent, turn_num):
     """
     Sends a single turn text to the LLM for summarization.
@@ -103,7 +111,7 @@ def summarize_turn(turn_text, agent, turn_num):
     from Prompt_Manager2000 import PromptManager
     pm = PromptManager(prompts_dir)
     summary_messages = pm.build_turn_summary_messages(turn_text, turn_num)
-    summary = agent.chat(summary_messages).strip()
+    summary = agent.chat(summary_messages, task="turn summary").strip()
     return summary
 
 
@@ -111,6 +119,162 @@ turn_header_pattern = re.compile(
     r"^#{1,3}\s*Turn[: ]+\s*(\d+)",
     re.IGNORECASE
 )
+# '## Roll-up L2 (Turns 1–25)'; older scenes have no turn range
+rollup_header_pattern = re.compile(
+    r"^##\s*Roll-up\s+L(\d+)(?:\s*\(\s*Turns?\s+(\d+)\s*[–-]\s*(\d+)\s*\))?\s*$", re.IGNORECASE
+)
+
+
+
+# =====================================================================
+#   HIERARCHICAL ROLL-UP SUMMARIES
+# =====================================================================
+def rollup_span(level: int, factor: int = ROLLUP_FACTOR) -> int:
+    """Number of turns covered by one roll-up of this level."""
+    return factor ** level
+
+
+def rollup_header(level: int, first_turn: int, last_turn: int) -> str:
+    return f"## Roll-up L{level} (Turns {first_turn}–{last_turn})"
+
+
+def rollup_matches(level: int, turn_range: tuple | None, closing_turn: int, factor: int = ROLLUP_FACTOR) -> bool:
+    """
+    Whether a roll-up stored in the turn at position `closing_turn` (1-based)
+    still covers the turns its header records. Removing or renumbering turns
+    moves it away from its range, which leaves it stale. Headers without a
+    range (older scenes) are only checked to stand in a turn closing a group.
+    """
+    span = rollup_span(level, factor)
+    if turn_range is None:
+        return closing_turn % span == 0
+    first, last = turn_range
+    return last == closing_turn and last % span == 0 and last - first + 1 == span
+
+
+def drop_stale_rollups(lines: list[str], factor: int = ROLLUP_FACTOR) -> int:
+    """Remove, in place, every roll-up that no longer covers the turns it was built from. Returns the count."""
+    stale = []
+    for n, block in enumerate(parse_turn_blocks(lines)):
+        for level, at in block["rollup_at"].items():
+            if not rollup_matches(level, block["rollup_ranges"][level], n + 1, factor):
+                end = next((i for i in range(at + 1, block["end"]) if lines[i].strip().startswith("#")), block["end"])
+                stale.append((at, end))
+    for start, end in sorted(stale, reverse=True):
+        del lines[start:end]
+    return len(stale)
+
+
+def parse_turn_blocks(lines: list[str]) -> list[dict]:
+    """
+    Turns of a scene with their line range, summary and roll-ups:
+      - turn: number in the turn header
+      - start / end: line range of the turn block
+      - summary: lines under '## Summary' (None if not summarized)
+      - rollups: {level: lines under '## Roll-up L<level>'}
+      - rollup_ranges: {level: (first turn, last turn) from the header, or None}
+      - rollup_at: {level: line index of the roll-up header}
+    """
+    starts = [i for i, line in enumerate(lines) if turn_header_pattern.match(line)]
+    blocks = []
+    for n, start in enumerate(starts):
+        end = starts[n + 1] if n + 1 < len(starts) else len(lines)
+        block = {"turn": int(turn_header_pattern.match(lines[start]).group(1)), "start": start, "end": end,
+                 "summary": None, "rollups": {}, "rollup_ranges": {}, "rollup_at": {}}
+        target = None
+        for i in range(start + 1, end):
+            stripped = lines[i].strip()
+            m = rollup_header_pattern.match(stripped)
+            if m:
+                level = int(m.group(1))
+                target = block["rollups"].setdefault(level, [])
+                block["rollup_ranges"][level] = (int(m.group(2)), int(m.group(3))) if m.group(2) else None
+                block["rollup_at"][level] = i
+            elif stripped.lower().startswith("## summary"):
+                block["summary"] = target = []
+            elif stripped.startswith("#"):
+                target = None
+            elif target is not None and stripped:
+                target.append(stripped)
+        blocks.append(block)
+    return blocks
+
+
+def find_turn_block(blocks: list[dict], turn_num: int) -> dict | None:
+    """The block of the turn with this header number, if the scene still has it."""
+    return next((b for b in blocks if b["turn"] == turn_num), None)
+
+
+def summarize_rollup(texts: list[str], level: int, first_turn: int, last_turn: int, agent) -> str:
+    from Prompt_Manager2000 import PromptManager
+    pm = PromptManager(prompts_dir)
+    messages = pm.build_rollup_messages(texts, level, first_turn, last_turn)
+    return agent.chat(messages, task="roll-up").strip()
+
+
+def build_rollups(scene_path: Path, agent, factor: int = ROLLUP_FACTOR, max_level: int = ROLLUP_MAX_LEVEL) -> int:
+    """
+    Incrementally build missing roll-ups of summarized turns.
+    A level-L roll-up covers factor**L turns and is stored in the turn that
+    closes its group; it is built from the `factor` level L-1 roll-ups
+    (turn summaries for level 1) of that group, once they all exist.
+    Stale roll-ups (turns removed or renumbered since) are dropped first and
+    rebuilt. The scene lock is only held while the file is rewritten, not
+    during the LLM call: lines appended meanwhile are kept, and the roll-up
+    goes into the closing turn found again by its header.
+    Returns the number of roll-ups written.
+    """
+    with agent.scene_lock:
+        lines = scene_path.read_text(encoding="utf-8").splitlines()
+        if dropped := drop_stale_rollups(lines, factor):
+            console.print(f"[yellow]Dropped {dropped} stale roll-up(s) after turns were removed or renumbered.[/yellow]")
+            rewrite_scene(scene_path, agent, lines)
+
+    written = 0
+    for level in range(1, max_level + 1):
+        span = rollup_span(level, factor)
+        child_span = rollup_span(level - 1, factor)
+        while True:
+            lines = scene_path.read_text(encoding="utf-8").splitlines()
+            blocks = parse_turn_blocks(lines)
+
+            pending = None
+            for group_end in range(span, len(blocks) + 1, span):
+                closing = blocks[group_end - 1]
+                if level in closing["rollups"]:
+                    continue
+                children = [
+                    blocks[i]["summary"] if level == 1 else blocks[i]["rollups"].get(level - 1)
+                    for i in range(group_end - span + child_span - 1, group_end, child_span)
+                ]
+                if all(children):
+                    pending = (group_end, children)
+                    break
+            if pending is None:
+                break
+
+            group_end, children = pending
+            first_turn, last_turn = group_end - span + 1, group_end
+            console.print(f"[cyan]→ Roll-up L{level} of turns {first_turn}–{last_turn}…[/cyan]")
+            text = summarize_rollup(["\n".join(c) for c in children], level, first_turn, last_turn, agent)
+            if not text:
+                break
+
+            # Stored right before the closing turn's full text (or at the end of its block)
+            with agent.scene_lock:
+                lines = scene_path.read_text(encoding="utf-8").splitlines()
+                closing = find_turn_block(parse_turn_blocks(lines), last_turn)
+                if closing is None or level in closing["rollups"]:
+                    break
+                insert_at = next(
+                    (i for i in range(closing["start"] + 1, closing["end"])
+                     if lines[i].strip().lower().startswith("## full turn")),
+                    closing["end"],
+                )
+                lines[insert_at:insert_at] = [rollup_header(level, first_turn, last_turn), text, ""]
+                rewrite_scene(scene_path, agent, lines)
+            written += 1
+    return written
 
 
 
@@ -137,6 +301,46 @@ def renumber_turns(scene_path: Path):
 
 
 
+# =====================================================================
+#   SCENE SUMMARY SECTION
+# =====================================================================
+SCENE_SUMMARY_RE = re.compile(
+    r"(?ms)^\s*#{1,2}\s*Scene Summary\s*\n.*?(?=^\s*#\s*(Turn\s+\d+|Scene Summary)\b|\Z)"
+)
+
+
+def has_scene_summary(scene_text: str) -> bool:
+    return re.search(r"(?m)^\s*#{1,2}\s*Scene Summary\s*$", scene_text) is not None
+
+
+def insert_scene_summary(scene_text: str, summary: str) -> str:
+    """
+    Return the scene text with a single '# Scene Summary' section placed
+    between the description and Turn 1 (any previous summary is replaced).
+    """
+    cleaned = SCENE_SUMMARY_RE.sub("", scene_text).rstrip()
+
+    # Detect description vs start at Turn 1
+    m = re.search(r"^#\s*Turn\s+1\b", cleaned, flags=re.M)
+    if m:
+        desc_block = cleaned[:m.start()].strip()
+        turns_block = cleaned[m.start():].lstrip()
+    else:
+        # No Turn 1 found — treat whole file as turns_block fallback
+        desc_block = ""
+        turns_block = cleaned.strip()
+
+    parts = []
+    if desc_block:
+        parts.append(desc_block)
+    parts.append("# Scene Summary\n" + summary.strip())
+    if turns_block:
+        parts.append(turns_block)
+
+    return "\n\n".join(parts).strip() + "\n"
+
+
+
 # =====================================================================
 #   REMOVE EMPTY TURNS
 # =====================================================================
@@ -174,7 +378,6 @@ def remove_empty_turns(lines, console):
 # =====================================================================
 def summarize_scene_turns(scene_path: Path, agent, turns_to_keep: int = None):
 
-    console = Console()
     summary_marker = "## Summary"
 
     if not scene_path or not scene_path.exists():
@@ -186,17 +389,19 @@ def summarize_scene_turns(scene_path: Path, agent, turns_to_keep: int = None):
 
     console.print("\n[cyan]Starting turn summarization…[/cyan]\n")
 
+    # The scene lock is held while the file is read and rewritten, not during
+    # the LLM call: narration appended meanwhile stays in the scene.
     while True:
-        lines = scene_path.read_text(encoding="utf-8").splitlines()
+        with agent.scene_lock:
+            lines = scene_path.read_text(encoding="utf-8").splitlines()
 
-        # ------------------------
-        # Remove empty turns first
-        # ------------------------
-        lines = remove_empty_turns(lines, console)
-        scene_path.write_text("\n".join(lines), encoding="utf-8")
+            # ------------------------
+            # Remove empty turns first
+            # ------------------------
+            lines = remove_empty_turns(lines, console)
+            rewrite_scene(scene_path, agent, lines)
 
-        # Re-scan after removal
-        lines = scene_path.read_text(encoding="utf-8").splitlines()
+        # Scan after removal
         turn_positions = [(i, int(m.group(1))) for i, line in enumerate(lines) if (m := turn_header_pattern.match(line))]
 
         if not turn_positions:
@@ -242,16 +447,27 @@ def summarize_scene_turns(scene_path: Path, agent, turns_to_keep: int = None):
 
         summary = summarize_turn("\n".join(block), agent, turn_num).strip()
 
-        new_block = [
-            f"# Turn {turn_num}",
-            "## Summary",
-            summary,
-            "",
-            "## Full Turn",
-        ] + block[1:]
+        # Splice into the turn as it is now (it may have grown during the call)
+        with agent.scene_lock:
+            lines = scene_path.read_text(encoding="utf-8").splitlines()
+            current = find_turn_block(parse_turn_blocks(lines), turn_num)
+            if current is None:
+                console.print(f"[yellow]Turn {turn_num} is gone from the scene, summary discarded.[/yellow]")
+                continue
+            block = lines[current["start"]:current["end"]]
+            if summary_marker in "\n".join(block):
+                continue
+
+            new_block = [
+                f"# Turn {turn_num}",
+                "## Summary",
+                summary,
+                "",
+                "## Full Turn",
+            ] + block[1:]
 
-        lines[line_idx:next_idx] = new_block
-        scene_path.write_text("\n".join(lines), encoding="utf-8")
+            lines[current["start"]:current["end"]] = new_block
+            rewrite_scene(scene_path, agent, lines)
 
         console.print(f"[green]✓ Turn {turn_num} summarized.[/green]\n")
 
@@ -260,9 +476,30 @@ def summarize_scene_turns(scene_path: Path, agent, turns_to_keep: int = None):
     # ----------------------------------------------------
     # FINAL STEP → Renumber all turns to be consecutive
     # ----------------------------------------------------
-    final_count = renumber_turns(scene_path)
+    with agent.scene_lock:
+        before = scene_path.read_bytes()
+        final_count = renumber_turns(scene_path)
+        agent.follow_scene_rewrite(scene_path, before)
     console.print(f"[cyan]Turns renumbered 1 → {final_count}[/cyan]\n")
 
+    # ----------------------------------------------------
+    # Roll up aged turn summaries into coarser levels
+    # ----------------------------------------------------
+    rolled = build_rollups(scene_path, agent)
+    if rolled:
+        console.print(f"[cyan]{rolled} roll-up summar{'y' if rolled == 1 else 'ies'} written[/cyan]\n")
+
+    # ----------------------------------------------------
+    # Move full text of summarized turns to cold storage
+    # ----------------------------------------------------
+    if COLD_STORAGE:
+        with agent.scene_lock:
+            before = scene_path.read_bytes()
+            moved = freeze_summarized_turns(scene_path, turns_to_keep)
+            agent.follow_scene_rewrite(scene_path, before)
+        if moved:
+            console.print(f"[cyan]{moved} full turn(s) moved to cold storage[/cyan]\n")
+
 def parse_scene_generic(self, scene_text: str) -> list[dict]:
     """
     Parse scene into hierarchical blocks based on headers.
@@ -1,10 +1,27 @@
 from pathlib import Path
 import subprocess
 import re
-from config import DEFAULT_MODEL, CONTEXT_THRESHOLD
-from rich.console import Console
+from config import CONTEXT_THRESHOLD
 
-console = Console()
+
+class LazyConsole:
+    """
+    Stand-in for rich's Console: rich is only imported, and the console
+    built, on the first print (keeps it out of the startup import time).
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console(**self._kwargs)
+        return getattr(self._console, name)
+
+
+console = LazyConsole()
 
 # ---------------------------------------------------------
 # Path Helpers
@@ -72,11 +89,6 @@ def get_model_token_limit(model_name: str) -> int:
         return None
 
 
-DEFAULT_MODEL_TOKEN_LIMIT = get_model_token_limit(DEFAULT_MODEL)
-console.print(
-    f"[bold cyan]Token limit for {DEFAULT_MODEL}: {DEFAULT_MODEL_TOKEN_LIMIT}[/bold cyan]"
-)
-
 
 # ---------------------------------------------------------
 # Context Usage Warning